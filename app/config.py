@@ -8,19 +8,100 @@ load_dotenv()
 
 # Database settings
 DB_PATH = os.getenv("DB_PATH", "conversation_history.db")
+# Reader connections in the conversation store (writes use one dedicated connection)
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+# Write-behind: conversation rows are committed in batches every interval or once this many are waiting
+DB_FLUSH_INTERVAL_MS = float(os.getenv("DB_FLUSH_INTERVAL_MS", "20"))
+DB_FLUSH_MAX_ROWS = int(os.getenv("DB_FLUSH_MAX_ROWS", "100"))
+# Failed flushes are retried this many times, waiting twice as long each time, before their rows are dropped
+DB_FLUSH_MAX_RETRIES = int(os.getenv("DB_FLUSH_MAX_RETRIES", "3"))
+DB_FLUSH_RETRY_DELAY_MS = float(os.getenv("DB_FLUSH_RETRY_DELAY_MS", "200"))
+# In-memory history cache: approximate memory cap and idle time before a user's history is dropped
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "1800"))
 
 # Vector DB settings
 CHROMA_PATH = os.getenv("CHROMA_PATH", "./my_chroma_db")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "document_chunks")
+# Pointer to the live collection version written by rebuild_vector_db
+ACTIVE_COLLECTION_FILE = os.getenv(
+    "ACTIVE_COLLECTION_FILE", os.path.join(CHROMA_PATH, "active_collection.json")
+)
+# Product name dictionaries written by rebuild_vector_db for entity matching, one file per collection version
+ENTITY_INDEX_DIR = os.getenv("ENTITY_INDEX_DIR", os.path.join(CHROMA_PATH, "entity_index"))
+# BM25 indexes over the same documents, one file per collection version
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", os.path.join(CHROMA_PATH, "lexical_index"))
+# Retrieval: "hybrid" fuses BM25 and vector results, "vector" uses embeddings only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Reciprocal rank fusion constant; larger values flatten the advantage of top ranks
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Number of rebuilt collection versions kept around for rollback
+COLLECTION_KEEP_VERSIONS = int(os.getenv("COLLECTION_KEEP_VERSIONS", "3"))
+# Number of threads used to run blocking Chroma calls off the event loop
+VECTOR_STORE_MAX_WORKERS = int(os.getenv("VECTOR_STORE_MAX_WORKERS", "4"))
+
+# Embedding settings
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# Query embedding cache, stored next to the conversation database by default
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(DB_PATH), "embedding_cache.db")
+)
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "2048"))
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "50000"))
+EMBEDDING_CACHE_TTL_DAYS = float(os.getenv("EMBEDDING_CACHE_TTL_DAYS", "30"))
+# Concurrent query embeddings are coalesced into one API call of up to this many inputs
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "64"))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+# Bulk embedding during rebuild_vector_db: batch bounds, parallel requests and
+# the account's tokens-per-minute quota for the embedding model
+EMBEDDING_REBUILD_BATCH_TOKENS = int(os.getenv("EMBEDDING_REBUILD_BATCH_TOKENS", "50000"))
+EMBEDDING_REBUILD_BATCH_SIZE = int(os.getenv("EMBEDDING_REBUILD_BATCH_SIZE", "256"))
+# Per-input token limit of the embedding model; longer chunks are sent on their own
+EMBEDDING_MAX_INPUT_TOKENS = int(os.getenv("EMBEDDING_MAX_INPUT_TOKENS", "8191"))
+EMBEDDING_REBUILD_CONCURRENCY = int(os.getenv("EMBEDDING_REBUILD_CONCURRENCY", "4"))
+EMBEDDING_REBUILD_TPM = int(os.getenv("EMBEDDING_REBUILD_TPM", "1000000"))
 
 # LLM settings
 LLM_MODEL = os.getenv("LLM_MODEL", "openai/gpt-4o-mini")
 LLM_API_KEY = os.getenv("LLM_API_KEY")
+# Prompt assembly: most recent turns loaded from the DB, and the total token
+# budget shared by the system prompt (with retrieved docs), history and question
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "20"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "8000"))
+# Older turns about the product in focus added ahead of the recent ones
+RELEVANT_HISTORY_TURNS = int(os.getenv("RELEVANT_HISTORY_TURNS", "4"))
+# Exchanges per history page sent to websocket clients on the delta protocol
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+# Turns older than HISTORY_MAX_TURNS are folded into a rolling summary once this many accumulate
+SUMMARY_MIN_NEW_TURNS = int(os.getenv("SUMMARY_MIN_NEW_TURNS", "5"))
+# Below this confidence the local pricing classifier defers to the LLM check
+PRICING_CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("PRICING_CLASSIFIER_MIN_CONFIDENCE", "0.6"))
+# Conversation context kept in memory (users beyond this, or idle this long, are spilled to SQLite)
+CONTEXT_MAX_USERS = int(os.getenv("CONTEXT_MAX_USERS", "10000"))
+CONTEXT_TTL_SECONDS = float(os.getenv("CONTEXT_TTL_SECONDS", "3600"))
+# Semantic answer cache: entries, lifetime and the cosine similarity a rewritten question needs to reuse an answer
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "21600"))
+ANSWER_CACHE_MIN_SIMILARITY = float(os.getenv("ANSWER_CACHE_MIN_SIMILARITY", "0.95"))
 
 
 FACEBOOK_VERIFY_TOKEN = os.getenv("FACEBOOK_VERIFY_TOKEN")
 PAGE_ACCESS_TOKEN = os.getenv("PAGE_ACCESS_TOKEN")
 WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
+# WhatsApp Phone Number ID from the Meta dashboard
+WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "551662914706608")
+GRAPH_API_URL = os.getenv("GRAPH_API_URL", "https://graph.facebook.com/v15.0/")
+
+# Outbound sends: pooled connections, concurrent sends and retries on 429/5xx
+OUTBOUND_MAX_CONNECTIONS = int(os.getenv("OUTBOUND_MAX_CONNECTIONS", "20"))
+OUTBOUND_MAX_CONCURRENCY = int(os.getenv("OUTBOUND_MAX_CONCURRENCY", "20"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Webhook processing: number of background workers and max queued messages
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Recent platform message IDs remembered to drop webhook redeliveries
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", "10000"))
 # Optional: Validate critical configuration
 if not LLM_API_KEY:
     print("WARNING: LLM_API_KEY environment variable is not set")
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""
+Offline evaluation of the local pricing classifier against the LLM check.
+
+Labels every question with the current LLM classifier, runs the local
+classifier on the same questions and reports agreement, the confusion matrix,
+how often the local classifier would defer to the LLM, and its latency.
+
+Usage (from the app directory):
+    python evaluate_intent.py                 # questions from the conversation DB
+    python evaluate_intent.py questions.txt   # one question per line
+"""
+import asyncio
+import sqlite3
+import sys
+import time
+from typing import List
+from config import DB_PATH
+from services.intent import pricing_classifier
+from services.llm import llm_check_if_pricing_question
+
+
+def load_questions(path: str = None, limit: int = 500) -> List[str]:
+    """Read questions from a text file, or the most recent distinct ones from the DB."""
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    conn = sqlite3.connect(DB_PATH)
+    with conn:
+        rows = conn.execute(
+            'SELECT question FROM conversations GROUP BY question ORDER BY MAX(id) DESC LIMIT ?', (limit,)
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+async def evaluate(questions: List[str]) -> None:
+    await pricing_classifier.ensure_examples()
+
+    llm_labels = await asyncio.gather(*(llm_check_if_pricing_question(q) for q in questions))
+
+    confusion = {(True, True): 0, (True, False): 0, (False, True): 0, (False, False): 0}
+    deferred = 0
+    local_correct = 0
+    local_decided = 0
+    timings = []
+    disagreements = []
+    for question, llm_label in zip(questions, llm_labels):
+        started = time.perf_counter()
+        decision = await pricing_classifier.aclassify(question)
+        timings.append(time.perf_counter() - started)
+
+        # What the production path would answer: local if confident, else the LLM
+        final = decision.is_pricing if decision.confident else llm_label
+        confusion[(llm_label, final)] += 1
+        if not decision.confident:
+            deferred += 1
+        else:
+            local_decided += 1
+            if decision.is_pricing == llm_label:
+                local_correct += 1
+            else:
+                disagreements.append((question, llm_label, decision))
+
+    total = len(questions)
+    agreement = (confusion[(True, True)] + confusion[(False, False)]) / total
+    timings.sort()
+    print(f"Questions evaluated:        {total}")
+    print(f"Agreement with LLM labels:  {agreement:.1%}")
+    if local_decided:
+        print(f"Local-only accuracy:        {local_correct / local_decided:.1%} on {local_decided} questions")
+    print(f"Deferred to LLM:            {deferred} ({deferred / total:.1%})")
+    print(f"Median classify time:       {timings[len(timings) // 2] * 1000:.3f} ms (includes embedding lookup)")
+    print("Confusion matrix (rows = LLM label, cols = pipeline answer):")
+    print(f"              pricing  not-pricing")
+    print(f"  pricing     {confusion[(True, True)]:7d}  {confusion[(True, False)]:11d}")
+    print(f"  not-pricing {confusion[(False, True)]:7d}  {confusion[(False, False)]:11d}")
+    if disagreements:
+        print("\nConfident local decisions that disagree with the LLM:")
+        for question, llm_label, decision in disagreements:
+            print(f"  LLM={'YES' if llm_label else 'NO'} local={'YES' if decision.is_pricing else 'NO'} "
+                  f"({decision.source}, {decision.confidence:.2f}): {question}")
+
+
+if __name__ == "__main__":
+    questions = load_questions(sys.argv[1] if len(sys.argv) > 1 else None)
+    if not questions:
+        print("No questions to evaluate")
+        sys.exit(1)
+    asyncio.run(evaluate(questions))
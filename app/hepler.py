@@ -2,20 +2,34 @@
 
 
 import asyncio
+import hashlib
 import json
+import re
 import time
 import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional
 import httpx
 import chromadb
-from litellm import acompletion
-from openai import OpenAI
+from litellm import acompletion, token_counter
+from openai import OpenAI, AsyncOpenAI, RateLimitError
 from config import LLM_API_KEY
 from models.schemas import Document
-from config import CHROMA_PATH, COLLECTION_NAME
+from config import CHROMA_PATH, COLLECTION_KEEP_VERSIONS
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_REBUILD_BATCH_TOKENS,
+    EMBEDDING_REBUILD_BATCH_SIZE,
+    EMBEDDING_MAX_INPUT_TOKENS,
+    EMBEDDING_REBUILD_CONCURRENCY,
+    EMBEDDING_REBUILD_TPM,
+)
+from services.collection_registry import collection_registry
+from services.entity_index import build_entity_dictionary, delete_entity_index, write_entity_index
+from services.lexical_index import build_lexical_index, delete_lexical_index, write_lexical_index
 
 
 open_client = OpenAI(api_key=LLM_API_KEY)
+async_open_client = AsyncOpenAI(api_key=LLM_API_KEY)
 
 # --- Existing Helper Functions (Unchanged) ---
 
@@ -52,6 +66,7 @@ def convert_product_to_document(product: dict) -> Document:
         content=enhanced_content,
         metadata={
             "title": product_title,
+            "handle": product.get("handle", ""),
             "vendor": product.get("vendor", ""),
             "status": product.get("status", ""),
         }
@@ -342,9 +357,7 @@ Please return the metadata in the following format:
                 return {}
         except Exception as e:
             if "rate_limit_exceeded" in str(e):
-                import re
-                match = re.search(r"try again in (\d+)ms", str(e))
-                wait_time =  1.0
+                wait_time = parse_retry_after(e)
                 print(f"Rate limit exceeded. Waiting {wait_time}s before retry {attempt + 1}/{max_retries}...")
                 await asyncio.sleep(wait_time)
             else:
@@ -354,128 +367,414 @@ Please return the metadata in the following format:
                     return {}
                 await asyncio.sleep(1)  # Brief delay before retrying non-rate-limit errors
 
-def get_embedding(text, model="text-embedding-3-small", max_retries=3):
+def parse_retry_after(error: Exception, default: float = 1.0) -> float:
     """
-    Generate an embedding with retry logic for API failures.
-    Returns None only after exhausting retries.
+    Work out how long the server asked us to back off for.
+    Prefers the retry-after headers and falls back to the "try again in Xms"
+    hint in the error message.
     """
-    for attempt in range(max_retries):
-        try:
-            response = open_client.embeddings.create(input=text, model=model)
-            return response.data[0].embedding
-        except Exception as e:
-            if "rate_limit_exceeded" in str(e):
-                import re
-                match = re.search(r"try again in (\d+)ms", str(e))
-                wait_time = 1.0
-                print(f"Rate limit exceeded. Waiting {wait_time}s before retry {attempt + 1}/{max_retries}...")
-                time.sleep(wait_time)
-            else:
-                print(f"Error getting embedding on attempt {attempt + 1}: {str(e)}")
-                if attempt == max_retries - 1:
-                    print("Max retries reached. Failed to get embedding.")
-                    return None
-                time.sleep(1)  # Brief delay before retrying non-rate-limit errors
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    match = re.search(r"try again in ([\d.]+)(ms|s)", str(error))
+    if match:
+        value = float(match.group(1))
+        return value / 1000 if match.group(2) == "ms" else value
+    return default
+
+class TokenBucket:
+    """Async token-bucket limiter for a tokens-per-minute API quota."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount: int) -> None:
+        """Wait until `amount` tokens are available and take them."""
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+def build_embedding_batches(token_counts: List[int], max_tokens: int, max_inputs: int,
+                            max_input_tokens: int = EMBEDDING_MAX_INPUT_TOKENS) -> List[List[int]]:
+    """
+    Pack chunk indices into batches bounded by total tokens and input count.
+    Chunks over the model's per-input limit (or over max_tokens) are rejected
+    by the API, so each gets a batch of its own and only that chunk is lost.
+    """
+    batches = []
+    current, current_tokens = [], 0
+    for index, tokens in enumerate(token_counts):
+        if tokens > max_input_tokens or tokens > max_tokens:
+            batches.append([index])
+            continue
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+async def embed_chunks(texts: List[str], model=EMBEDDING_MODEL, max_retries=5) -> List[Optional[List[float]]]:
+    """
+    Embed many texts with token-bounded batches, a concurrency cap and a
+    tokens-per-minute limiter. Rate-limited batches wait as long as the server
+    asks before retrying.
+    Returns one embedding per input text, None where a batch failed for good.
+    """
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+    token_counts = [token_counter(model=model, text=text) if text else 0 for text in texts]
+    # The embeddings endpoint rejects empty input, so those chunks are never sent
+    indices = [i for i, text in enumerate(texts) if text]
+    batches = [
+        [indices[i] for i in batch]
+        for batch in build_embedding_batches(
+            [token_counts[i] for i in indices],
+            EMBEDDING_REBUILD_BATCH_TOKENS,
+            EMBEDDING_REBUILD_BATCH_SIZE
+        )
+    ]
+    limiter = TokenBucket(EMBEDDING_REBUILD_TPM)
+    semaphore = asyncio.Semaphore(EMBEDDING_REBUILD_CONCURRENCY)
+
+    async def run_batch(batch_number: int, batch: List[int]) -> None:
+        batch_tokens = sum(token_counts[i] for i in batch)
+        async with semaphore:
+            for attempt in range(max_retries):
+                await limiter.acquire(batch_tokens)
+                started = time.perf_counter()
+                try:
+                    response = await async_open_client.embeddings.create(
+                        input=[texts[i] for i in batch],
+                        model=model
+                    )
+                except Exception as e:
+                    status_code = getattr(e, "status_code", None)
+                    if status_code is not None and 400 <= status_code < 500 and status_code != 429:
+                        # The request itself is bad (e.g. input too long); retrying won't help
+                        print(f"Embedding batch {batch_number} rejected with {status_code}: {str(e)}")
+                        return
+                    if isinstance(e, RateLimitError) or "rate_limit_exceeded" in str(e):
+                        wait_time = parse_retry_after(e)
+                        print(f"Rate limit on embedding batch {batch_number}. Waiting {wait_time:.2f}s before retry {attempt + 1}/{max_retries}...")
+                        await asyncio.sleep(wait_time)
+                    else:
+                        print(f"Error embedding batch {batch_number} on attempt {attempt + 1}: {str(e)}")
+                        await asyncio.sleep(1)  # Brief delay before retrying non-rate-limit errors
+                    continue
+                for item in response.data:
+                    embeddings[batch[item.index]] = item.embedding
+                elapsed = time.perf_counter() - started
+                print(f"Embedding batch {batch_number}/{len(batches)}: {len(batch)} chunks, "
+                      f"{batch_tokens} tokens in {elapsed:.2f}s (attempt {attempt + 1})")
+                return
+            print(f"Max retries reached. Failed to embed batch {batch_number}.")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_batch(n, batch) for n, batch in enumerate(batches, 1)))
+    print(f"Embedded {sum(e is not None for e in embeddings)}/{len(texts)} chunks "
+          f"in {len(batches)} batches, {time.perf_counter() - started:.2f}s total")
+    return embeddings
+
+# --- Document Preparation Shared by Rebuild and Sync ---
+
+# Serializes rebuild_vector_db and sync_vector_db so they never write the index at the same time
+vector_db_lock = asyncio.Lock()
+
+async def load_documents() -> List[Document]:
+    """
+    Fetch products and articles from Shopify and convert them to Documents.
+    Also writes the documents to vector_db_documents.json for inspection.
+    """
+    # Fetch products and articles concurrently
+    products, article_edges = await asyncio.gather(
+        fetch_products(),
+        fetch_articles()
+    )
+
+    # Convert to Document objects
+    product_documents = [convert_product_to_document(prod) for prod in products]
+    article_documents = [convert_article_to_document(edge) for edge in article_edges]
+    all_documents = product_documents + article_documents
+
+    # Write documents to file for inspection
+    with open('vector_db_documents.json', 'w') as f:
+        json_data = []
+        for doc in all_documents:
+            # Convert document to dict for JSON serialization
+            doc_dict = {
+                'name': doc.name,
+                'content': doc.content,
+                'metadata': doc.metadata
+            }
+            json_data.append(doc_dict)
+
+        json.dump(json_data, f, indent=2)
+
+    print(f"Wrote {len(all_documents)} documents to vector_db_documents.json")
+    return all_documents
+
+def assign_document_ids(documents: List[Document]) -> List[str]:
+    """
+    Give every document a unique ID based on its name, suffixing duplicates
+    with a counter ("Name", "Name-2", ...).
+    """
+    id_counts = {}
+    ids = []
+    for doc in documents:
+        base_id = doc.name
+        if base_id in id_counts:
+            id_counts[base_id] += 1
+            ids.append(f"{base_id}-{id_counts[base_id]}")
+        else:
+            id_counts[base_id] = 1
+            ids.append(base_id)
+    return ids
+
+def document_content_hash(document: Document) -> str:
+    """
+    Hash the source fields of a document (before LLM metadata is added) so a
+    sync can tell whether it changed since it was last indexed.
+    """
+    payload = json.dumps(
+        {"name": document.name, "content": document.content, "metadata": document.metadata},
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+async def build_chunks(documents: List[Document], ids: List[str]) -> List[dict]:
+    """
+    Generate LLM metadata for each document and turn it into a chunk dict
+    ready to embed. Documents whose metadata generation fails are skipped.
+    """
+    content_hashes = [document_content_hash(doc) for doc in documents]
+
+    # Generate metadata with retries
+    metadata_tasks = [generate_metadata_for_document(doc) for doc in documents]
+    metadatas = await asyncio.gather(*metadata_tasks)
+    failed_documents = [doc.name for doc, meta in zip(documents, metadatas) if not meta]
+    if failed_documents:
+        print(f"Failed to generate metadata for: {failed_documents}")
+
+    chunks = []
+    for doc, chunk_id, content_hash, metadata in zip(documents, ids, content_hashes, metadatas):
+        if not metadata:
+            continue
+        source_metadata = doc.metadata or {}
+        # Product documents carry their title; articles do not
+        is_product = "title" in source_metadata
+        doc.metadata = metadata
+        flat_metadata = flatten_metadata(doc.metadata)
+        flat_metadata["content_hash"] = content_hash
+        # Retrieval filters narrow the product chunks and leave the others eligible
+        flat_metadata["document_type"] = "product" if is_product else "article"
+        if is_product and source_metadata.get("handle"):
+            # Canonical product ID, the same one the entity index uses
+            flat_metadata["product_handle"] = source_metadata["handle"]
+        chunks.append({
+            "id": chunk_id,
+            "text": str(doc.content),
+            "metadata": flat_metadata
+        })
+    return chunks
+
+def catalog_products(documents: List[Document]) -> List[tuple]:
+    """
+    (handle, title) of every product document, for the entity index.
+    Must run before build_chunks, which replaces document metadata.
+    """
+    return [
+        (doc.metadata["handle"], doc.metadata["title"])
+        for doc in documents
+        if doc.metadata and doc.metadata.get("handle") and "title" in doc.metadata
+    ]
+
+async def embed_valid_chunks(chunks: List[dict]):
+    """
+    Embed chunks and drop the ones whose embedding failed.
+    Returns (valid_chunks, valid_embeddings).
+    """
+    embeddings = await embed_chunks([chunk["text"] for chunk in chunks])
+    valid_chunks = [chunk for chunk, emb in zip(chunks, embeddings) if emb is not None]
+    valid_embeddings = [emb for emb in embeddings if emb is not None]
+    failed_chunks = [chunk["id"] for chunk, emb in zip(chunks, embeddings) if emb is None]
+    if failed_chunks:
+        print(f"Failed to generate embeddings for: {failed_chunks}")
+    return valid_chunks, valid_embeddings
+
+def validate_collection(collection, chunks: List[dict], embeddings: List[List[float]]) -> bool:
+    """
+    Sanity-check a freshly built collection before it goes live: the document
+    count must match what was added and a sample query must find its own chunk.
+    """
+    count = collection.count()
+    if count != len(chunks):
+        print(f"Collection has {count} documents, expected {len(chunks)}")
+        return False
+    results = collection.query(query_embeddings=[embeddings[0]], n_results=1)
+    found_ids = [item for sublist in results.get("ids", []) for item in sublist]
+    if chunks[0]["id"] not in found_ids:
+        print(f"Sample query for {chunks[0]['id']} returned {found_ids}")
+        return False
+    return True
 
 # --- Main Updated Function ---
 
 async def rebuild_vector_db():
     """
-    Rebuild the vector database in place using the fixed COLLECTION_NAME.
-    Only updates the collection if all steps succeed, preventing corruption.
+    Rebuild the vector database into a new versioned collection.
+    Live traffic keeps reading the current version until the new one is
+    fully written and validated, then the active pointer is flipped. Older
+    versions are kept for rollback, up to COLLECTION_KEEP_VERSIONS.
     """
-    try:
-        # Step 1: Fetch products and articles concurrently
-        products, article_edges = await asyncio.gather(
-            fetch_products(),
-            fetch_articles()
-        )
-
-        # Step 2: Convert to Document objects
-        product_documents = [convert_product_to_document(prod) for prod in products]
-        article_documents = [convert_article_to_document(edge) for edge in article_edges]
-        all_documents = product_documents + article_documents
-
-                # Step 3: Write documents to file for inspection
-        with open('vector_db_documents.json', 'w') as f:
-            # Using pprint for more readable output
-            import json
-            json_data = []
-            for doc in all_documents:
-                # Convert document to dict for JSON serialization
-                doc_dict = {
-                    'name': doc.name,
-                    'content': doc.content,
-                    'metadata': doc.metadata
-                }
-                json_data.append(doc_dict)
-            
-            json.dump(json_data, f, indent=2)
-        
-        print(f"Wrote {len(all_documents)} documents to vector_db_documents.json")
-
-        # Step 3: Generate metadata with retries
-        metadata_tasks = [generate_metadata_for_document(doc) for doc in all_documents]
-        metadatas = await asyncio.gather(*metadata_tasks)
-        valid_documents = [doc for doc, meta in zip(all_documents, metadatas) if meta]
-        failed_documents = [doc.name for doc, meta in zip(all_documents, metadatas) if not meta]
-        if failed_documents:
-            print(f"Failed to generate metadata for: {failed_documents}")
-        if not valid_documents:
-            print("No documents with valid metadata. Aborting rebuild.")
-            return
-        for doc, metadata in zip(valid_documents, metadatas):
-            if metadata:
-                doc.metadata = metadata
-
-        # Step 4: Create chunks with unique IDs
-        id_counts = {}
-        chunks = []
-        for doc in valid_documents:
-            base_id = doc.name
-            if base_id in id_counts:
-                id_counts[base_id] += 1
-                unique_id = f"{base_id}-{id_counts[base_id]}"
-            else:
-                id_counts[base_id] = 1
-                unique_id = base_id
-            flat_metadata = flatten_metadata(doc.metadata)
-            chunk = {
-                "id": unique_id,
-                "text": str(doc.content),
-                "metadata": flat_metadata
-            }
-            chunks.append(chunk)
-
-        # Step 5: Generate embeddings with retries
-        embedding_tasks = [asyncio.to_thread(get_embedding, chunk["text"]) for chunk in chunks]
-        embeddings = await asyncio.gather(*embedding_tasks)
-        valid_chunks = [chunk for chunk, emb in zip(chunks, embeddings) if emb is not None]
-        valid_embeddings = [emb for emb in embeddings if emb is not None]
-        failed_chunks = [chunk["id"] for chunk, emb in zip(chunks, embeddings) if emb is None]
-        if failed_chunks:
-            print(f"Failed to generate embeddings for: {failed_chunks}")
-        if not valid_chunks:
-            print("No chunks with valid embeddings. Aborting rebuild.")
-            return
-
-        # Step 6: Update the existing collection in place
-        from config import CHROMA_PATH, COLLECTION_NAME
-        client = chromadb.PersistentClient(path=CHROMA_PATH)
+    async with vector_db_lock:
         try:
-            client.delete_collection(name=COLLECTION_NAME)
-        except Exception:
-            pass  # Collection might not exist yet
-        collection = client.create_collection(name=COLLECTION_NAME)
-        collection.add(
-            ids=[chunk["id"] for chunk in valid_chunks],
-            embeddings=valid_embeddings,
-            documents=[chunk["text"] for chunk in valid_chunks],
-            metadatas=[chunk["metadata"] for chunk in valid_chunks]
-        )
+            # Step 1: Fetch and convert documents
+            all_documents = await load_documents()
+            ids = assign_document_ids(all_documents)
+            products = catalog_products(all_documents)
+
+            # Step 2: Generate metadata and build chunks
+            chunks = await build_chunks(all_documents, ids)
+            if not chunks:
+                print("No documents with valid metadata. Aborting rebuild.")
+                return
+
+            # Step 3: Generate embeddings with retries
+            valid_chunks, valid_embeddings = await embed_valid_chunks(chunks)
+            if not valid_chunks:
+                print("No chunks with valid embeddings. Aborting rebuild.")
+                return
+
+            # Step 4: Build a shadow collection, check it, then flip live traffic to it
+            client = chromadb.PersistentClient(path=CHROMA_PATH)
+            shadow_name = collection_registry.new_version_name()
+            collection = await asyncio.to_thread(client.create_collection, name=shadow_name)
+            await asyncio.to_thread(
+                collection.add,
+                ids=[chunk["id"] for chunk in valid_chunks],
+                embeddings=valid_embeddings,
+                documents=[chunk["text"] for chunk in valid_chunks],
+                metadatas=[chunk["metadata"] for chunk in valid_chunks]
+            )
+
+            if not await asyncio.to_thread(validate_collection, collection, valid_chunks, valid_embeddings):
+                print(f"Validation of {shadow_name} failed. Keeping {collection_registry.active()} live.")
+                await asyncio.to_thread(client.delete_collection, name=shadow_name)
+                return
+
+            # BM25 index for hybrid retrieval and the product dictionary for entity
+            # matching, written first so they are there when the version goes live
+            await asyncio.to_thread(write_lexical_index, build_lexical_index(valid_chunks), shadow_name)
+            entities = build_entity_dictionary(products)
+            await asyncio.to_thread(write_entity_index, entities, shadow_name)
+            print(f"Wrote entity index with {len(entities)} products")
 
-        print(f"Vector DB rebuild completed successfully. Updated {COLLECTION_NAME}")
+            collection_registry.activate(shadow_name)
 
-    except Exception as e:
-        print(f"Error during vector DB rebuild: {e}")
+            removed = await asyncio.to_thread(collection_registry.prune, client, COLLECTION_KEEP_VERSIONS)
+            for name in removed:
+                await asyncio.to_thread(delete_lexical_index, name)
+                await asyncio.to_thread(delete_entity_index, name)
+            if removed:
+                print(f"Removed old collection versions: {removed}")
+
+            print(f"Vector DB rebuild completed successfully. Active collection is {shadow_name}")
+
+        except Exception as e:
+            print(f"Error during vector DB rebuild: {e}")
+
+def write_lexical_index_for(collection, version: str) -> None:
+    """Rebuild the BM25 index from everything currently in a collection."""
+    contents = collection.get(include=["documents", "metadatas"])
+    chunks = [
+        {"id": chunk_id, "text": text, "metadata": metadata}
+        for chunk_id, text, metadata in zip(contents["ids"], contents["documents"], contents["metadatas"])
+    ]
+    write_lexical_index(build_lexical_index(chunks), version)
+
+async def sync_vector_db():
+    """
+    Incrementally sync the vector database with Shopify.
 
+    Each indexed chunk carries a content_hash of its source document. Only
+    documents that are new or whose hash changed go through metadata
+    generation and embedding and are upserted; chunks whose documents are
+    gone from Shopify are deleted. Everything else is left untouched.
+    """
+    async with vector_db_lock:
+        try:
+            all_documents = await load_documents()
+            if not all_documents:
+                # An empty catalog almost certainly means a bad fetch; don't wipe the index
+                print("No documents fetched. Aborting sync.")
+                return
+            ids = assign_document_ids(all_documents)
+            products = catalog_products(all_documents)
+
+            client = chromadb.PersistentClient(path=CHROMA_PATH)
+            active_name = collection_registry.active()
+            collection = await asyncio.to_thread(
+                client.get_or_create_collection, name=active_name
+            )
+            existing = await asyncio.to_thread(collection.get, include=["metadatas"])
+            existing_hashes = {
+                chunk_id: (metadata or {}).get("content_hash")
+                for chunk_id, metadata in zip(existing["ids"], existing["metadatas"])
+            }
+
+            changed = [
+                (doc, chunk_id) for doc, chunk_id in zip(all_documents, ids)
+                if existing_hashes.get(chunk_id) != document_content_hash(doc)
+            ]
+            current_ids = set(ids)
+            removed_ids = [chunk_id for chunk_id in existing_hashes if chunk_id not in current_ids]
+
+            upserted = 0
+            if changed:
+                chunks = await build_chunks([doc for doc, _ in changed], [chunk_id for _, chunk_id in changed])
+                valid_chunks, valid_embeddings = await embed_valid_chunks(chunks)
+                if valid_chunks:
+                    await asyncio.to_thread(
+                        collection.upsert,
+                        ids=[chunk["id"] for chunk in valid_chunks],
+                        embeddings=valid_embeddings,
+                        documents=[chunk["text"] for chunk in valid_chunks],
+                        metadatas=[chunk["metadata"] for chunk in valid_chunks]
+                    )
+                    upserted = len(valid_chunks)
+
+            if removed_ids:
+                await asyncio.to_thread(collection.delete, ids=removed_ids)
+
+            if upserted or removed_ids:
+                # Answers derived from the old contents are no longer valid
+                collection_registry.mark_updated()
+                await asyncio.to_thread(write_entity_index, build_entity_dictionary(products), active_name)
+                await asyncio.to_thread(write_lexical_index_for, collection, active_name)
+
+            unchanged = len(all_documents) - len(changed)
+            print(f"Vector DB sync completed. Upserted {upserted}, deleted {len(removed_ids)}, "
+                  f"unchanged {unchanged} in {active_name}")
+
+        except Exception as e:
+            print(f"Error during vector DB sync: {e}")
@@ -1,19 +1,42 @@
 """
 Main application module.
 """
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
-from routes.chat import router as chat_router
-from services.db import init_db
+from routes.chat import router as chat_router, message_pool
+from routes.metrics import router as metrics_router
+from services.context import conversation_context
+from services.db import init_db, conversation_store, conversation_buffer
+from services.messaging import outbound_client
+from services.summarizer import conversation_summarizer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background workers on startup and drain them on shutdown."""
+    message_pool.start()
+    conversation_summarizer.start()
+    yield
+    await message_pool.stop()
+    await conversation_summarizer.stop()
+    await conversation_context.close()
+    try:
+        # Raises if buffered conversations could not be written
+        await conversation_buffer.flush()
+    finally:
+        conversation_store.close()
+        await outbound_client.close()
 
 # Initialize the application
-app = FastAPI(title="Omnivoltaic Support Bot API")
+app = FastAPI(title="Omnivoltaic Support Bot API", lifespan=lifespan)
 
 # Initialize database
 init_db()
 
 # Register routes
 app.include_router(chat_router)
+app.include_router(metrics_router)
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
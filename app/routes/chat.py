@@ -3,18 +3,58 @@ Chat endpoint routes.
 """
 from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Request, Response
 from models.schemas import QueryRequest, ChatResponse
-from services.db import get_user_conversation_history, save_conversation
+from services.db import get_user_conversation_history, get_history_page, save_conversation, get_conversation_summary
+from services.summarizer import conversation_summarizer
 from services.vector_store import VectorStore
-from services.llm import create_system_prompt, generate_response, analyze_question
-from config import FACEBOOK_VERIFY_TOKEN, PAGE_ACCESS_TOKEN, WHATSAPP_TOKEN
-import requests
+from services.answer_pipeline import answer_question, stream_answer
+from services.context import conversation_context
+from services.metrics import metrics
+from services.message_queue import IncomingMessage, MessageWorkerPool
+from services.messaging import send_facebook_message, send_whatsapp_message
+from config import FACEBOOK_VERIFY_TOKEN
+from config import WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, HISTORY_MAX_TURNS, HISTORY_PAGE_SIZE
 import json
-from hepler import rebuild_vector_db
+from typing import Optional
+from hepler import rebuild_vector_db, sync_vector_db
+from services.collection_registry import collection_registry
 import asyncio
+import time
 
 router = APIRouter()
 vector_store = VectorStore()
 
+# Websocket protocol versions: 1 resends the full history with every answer,
+# 2 sends only the new exchange and pages history on request
+SUPPORTED_PROTOCOLS = (1, 2)
+HISTORY_PAGE_MAX_SIZE = 100
+
+
+async def history_page(user_id: str, before: Optional[int] = None, limit: Optional[int] = None) -> dict:
+    """
+    One page of history for the delta protocol, newest page first.
+
+    Exchanges are numbered by `seq`, their row id in the conversation store,
+    which is also what answers report for new exchanges.
+
+    Args:
+        user_id: User whose history to page through
+        before: Return exchanges with seq lower than this (None for the latest page)
+        limit: Page size, defaults to HISTORY_PAGE_SIZE
+
+    Returns:
+        {"history": [...], "next_cursor": seq to pass as `before` for the
+        previous page or None, "seq": seq of the latest exchange}
+    """
+    try:
+        limit = min(max(int(limit or HISTORY_PAGE_SIZE), 1), HISTORY_PAGE_MAX_SIZE)
+    except (TypeError, ValueError):
+        limit = HISTORY_PAGE_SIZE
+    try:
+        before = int(before) if before is not None else None
+    except (TypeError, ValueError):
+        before = None
+    return dict(await get_history_page(user_id, before, limit), protocol=2)
+
 @router.websocket("/chat")
 async def websocket_chat(websocket: WebSocket):
     """
@@ -24,25 +64,37 @@ async def websocket_chat(websocket: WebSocket):
     1. Accepts WebSocket connections.
     2. Receives JSON messages containing user_id and question.
     3. Retrieves relevant documents and conversation history.
-    4. Generates a response using the LLM.
+    4. Generates a response using the LLM. With "stream": true in the message,
+       the response is sent as {"delta": ...} frames while it is generated.
     5. Sends the response and updated chat history back to the client.
     6. Saves the conversation to the database.
+
+    Clients that send "protocol": 2 (in any message, usually the first) get
+    the delta protocol instead: the handshake returns one page of history
+    ({"history", "next_cursor", "seq"}, older pages via "before"/"limit"), and
+    answers carry only {"response", "seq"} rather than the whole history.
     """
     await websocket.accept()
+    protocol = 1
     
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_json()
+            received_at = time.monotonic()
             user_id = data.get("user_id")
             question = data.get("question")
-            user_conversation = get_user_conversation_history(user_id)
+            if data.get("protocol") in SUPPORTED_PROTOCOLS:
+                protocol = data["protocol"]
             # Send conversation history upon first connection
             if user_id and question is None:  # If no question, just the user_id
-                # Retrieve the user's conversation history
+                if protocol >= 2:
+                    await websocket.send_json(await history_page(user_id, data.get("before"), data.get("limit")))
+                    continue
 
+                # Protocol 1 clients expect the user's whole history
                 await websocket.send_json({
-                    "history": user_conversation
+                    "history": await get_user_conversation_history(user_id)
                 })
                 continue
 
@@ -53,39 +105,49 @@ async def websocket_chat(websocket: WebSocket):
 
             try:
 
-                analyzed_question = await analyze_question(question, user_conversation)
-                print(analyzed_question, "Analyzed question")
-                # Get relevant documents from vector store
-                relevant_docs = vector_store.query(analyzed_question)
-                print(relevant_docs, "-----55---")
-                # Create system prompt with relevant docs
-                system_prompt = create_system_prompt(relevant_docs)
-
-                # Build message list starting with system prompt
-                messages = [{"role": "system", "content": system_prompt}]
-
-                # Add user's conversation history
-
-                for exchange in user_conversation:
-                    messages.append({"role": "user", "content": exchange['question']})
-                    messages.append({"role": "assistant", "content": exchange['answer']})
-
-                # Add the current question
-                messages.append({"role": "user", "content": question})
-
-                # Generate response from LLM
-                response_content = await generate_response(messages)
-
-                # Save conversation to database
-                save_conversation(user_id, question, response_content)
-
-                # Manually append the new exchange to the history
-                updated_history = user_conversation + [{"question": question, "answer": response_content}]
-
-                # Send response and updated history back to client
+                # Rewrite, retrieve and answer (with the pricing gate running alongside)
+                user_conversation, summary = await asyncio.gather(
+                    get_user_conversation_history(user_id, limit=HISTORY_MAX_TURNS),
+                    get_conversation_summary(user_id)
+                )
+                conversation_summary = summary["summary"] if summary else ""
+                if data.get("stream"):
+                    # Send the reply as it is generated, then the full answer below
+                    pieces = []
+                    async for delta in stream_answer(
+                        question, user_conversation, vector_store,
+                        conversation_summary=conversation_summary, user_id=user_id
+                    ):
+                        if not pieces:
+                            metrics.observe("websocket.time_to_first_delta", time.monotonic() - received_at)
+                        pieces.append(delta)
+                        await websocket.send_json({"delta": delta})
+                    response_content = "".join(pieces)
+                else:
+                    response_content = await answer_question(
+                        question, user_conversation, vector_store,
+                        conversation_summary=conversation_summary, user_id=user_id
+                    )
+
+                # Save conversation to database and refresh the rolling summary in the background
+                saved = await save_conversation(
+                    user_id, question, response_content, platform="websocket",
+                    entities=conversation_context.exchange_entities(user_id, question, response_content)
+                )
+                conversation_summarizer.schedule(user_id)
+
+                if protocol >= 2:
+                    # Only the new exchange, numbered by its row id once the write-behind flush commits it
+                    await websocket.send_json({
+                        "response": response_content,
+                        "seq": await saved
+                    })
+                    continue
+
+                # Send response and the whole updated history back to protocol 1 clients
                 await websocket.send_json({
                     "response": response_content,
-                    "history": updated_history
+                    "history": await get_user_conversation_history(user_id)
                 })
 
             except Exception as e:
@@ -111,10 +173,7 @@ async def verify_webhook(request: Request):
     mode = query_params.get("hub.mode")
     token = query_params.get("hub.verify_token")
     challenge = query_params.get("hub.challenge")
-    
-    print(token, "Token")
-    print(FACEBOOK_VERIFY_TOKEN, "Facebook Verify token")
-    print(mode, "---117")
+
     if mode == "subscribe" and token == FACEBOOK_VERIFY_TOKEN:
         print("Webhook verified successfully")
         return Response(content=challenge, media_type="text/plain")
@@ -203,7 +262,12 @@ async def verify_webhook(request: Request):
 async def handle_incoming_messages(request: Request):
     """
     Handles incoming messages from both Facebook Messenger and WhatsApp Business API.
+
+    Messages are only validated and queued here; the webhook worker pool does
+    the actual processing, so Meta gets its 200 without waiting on the LLM.
+    If the queue is full a 503 is returned so Meta redelivers later.
     """
+    rejected = 0
     try:
         # Parse the incoming request payload
         payload = await request.json()
@@ -212,84 +276,83 @@ async def handle_incoming_messages(request: Request):
         # Determine which platform the message is from based on payload structure
         if "object" in payload:
             # Handle WhatsApp messages
-            print("-----215-----")
             if payload["object"] == "whatsapp_business_account":
                 for entry in payload.get("entry", []):
-                    print("-----217-----")
                     for change in entry.get("changes", []):
-                        print("-----219-----")
                         if change.get("field") == "messages":
-                            print("-----221-----")
                             for message in change.get("value", {}).get("messages", []):
-                                print("-----223-----")
                                 if message.get("type") == "text":
-                                    print("------225----")
                                     # Extract WhatsApp sender and message info
                                     sender_id = message.get("from")
                                     message_text = message.get("text", {}).get("body", "")
                                     print(f"WhatsApp message from {sender_id}: {message_text}")
-                                    
+
                                     if not message_text:
                                         continue
-                                    
-                                    await process_message(sender_id, message_text, platform="whatsapp")
-            
+
+                                    incoming = IncomingMessage(sender_id, message_text, "whatsapp", message.get("id"))
+                                    if not message_pool.submit(incoming):
+                                        rejected += 1
+
             # Handle Facebook Messenger messages (your existing code path)
             elif payload["object"] == "page":
                 for entry in payload.get("entry", []):
                     for messaging_event in entry.get("messaging", []):
                         if "message" in messaging_event:
-                            sender_id = messaging_event["sender"]["id"]
+                            sender_id = messaging_event.get("sender", {}).get("id")
                             message_text = messaging_event["message"].get("text", "")
                             print(f"Message from {sender_id}: {message_text}")
 
                             if not message_text:
                                 print(f"No text content in message from {sender_id}, skipping")
                                 continue
-                            
-                            await process_message(sender_id, message_text, platform="facebook")
 
-        return {"status": "success"}
+                            incoming = IncomingMessage(
+                                sender_id, message_text, "facebook", messaging_event["message"].get("mid")
+                            )
+                            if not message_pool.submit(incoming):
+                                rejected += 1
+
     except Exception as e:
         print(f"Error processing webhook: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while processing the request")
 
-async def process_message(sender_id: str, message_text: str, platform: str):
+    if rejected:
+        print(f"Webhook queue full, rejected {rejected} messages")
+        raise HTTPException(status_code=503, detail="Message queue is full, retry later")
+    return {"status": "success"}
+
+async def process_message(sender_id: str, message_text: str, platform: str, message_id: Optional[str] = None):
     """
     Process messages from any platform and send responses.
     """
     try:
         # Use sender_id as user_id
         user_id = sender_id
-        user_conversation = get_user_conversation_history(user_id)
-
-        # Analyze the incoming message
-        analyzed_question = await analyze_question(message_text, user_conversation)
-
-        # Query vector store for relevant documents
-        relevant_docs = vector_store.query(analyzed_question)
-
-        # Create system prompt with relevant documents
-        system_prompt = create_system_prompt(relevant_docs)
-
-        # Build message list: system prompt + history + current message
-        messages = [{"role": "system", "content": system_prompt}]
-        for exchange in user_conversation:
-            messages.append({"role": "user", "content": exchange['question']})
-            messages.append({"role": "assistant", "content": exchange['answer']})
-        messages.append({"role": "user", "content": message_text})
-
-        # Generate LLM response
-        llm_response = await generate_response(messages)
-
-        # Save the conversation
-        save_conversation(user_id, message_text, llm_response)
+        user_conversation, summary = await asyncio.gather(
+            get_user_conversation_history(user_id, limit=HISTORY_MAX_TURNS),
+            get_conversation_summary(user_id)
+        )
+
+        # Rewrite, retrieve and answer (with the pricing gate running alongside)
+        llm_response = await answer_question(
+            message_text, user_conversation, vector_store,
+            conversation_summary=summary["summary"] if summary else "",
+            user_id=user_id
+        )
+
+        # Save the conversation and refresh the rolling summary in the background
+        await save_conversation(
+            user_id, message_text, llm_response, platform=platform, external_message_id=message_id,
+            entities=conversation_context.exchange_entities(user_id, message_text, llm_response)
+        )
+        conversation_summarizer.schedule(user_id)
 
         # Send response based on platform
         if platform == "facebook":
-            send_facebook_message(sender_id, llm_response)
+            await send_facebook_message(sender_id, llm_response)
         elif platform == "whatsapp":
-            send_whatsapp_message(sender_id, llm_response)
+            await send_whatsapp_message(sender_id, llm_response)
 
     except Exception as e:
         # Handle errors gracefully
@@ -297,61 +360,12 @@ async def process_message(sender_id: str, message_text: str, platform: str):
         print(f"Error processing message from {sender_id}: {e}")
         
         if platform == "facebook":
-            send_facebook_message(sender_id, error_msg)
+            await send_facebook_message(sender_id, error_msg)
         elif platform == "whatsapp":
-            send_whatsapp_message(sender_id, error_msg)
-
-
-def send_whatsapp_message(recipient_id: str, message_text: str):
-    """
-    Send a message to the user via WhatsApp Business API.
-    """
-    # Get your WhatsApp Phone Number ID from the Meta dashboard
-    phone_number_id = "551662914706608"  # Replace with your actual Phone Number ID
-    
-    url = f"https://graph.facebook.com/v15.0/{phone_number_id}/messages"
-    headers = {"Content-Type": "application/json"}
-    params = {"access_token": WHATSAPP_TOKEN}  # Use the same token or a WhatsApp-specific one
-    payload = {
-        "messaging_product": "whatsapp",
-        "recipient_type": "individual",
-        "to": recipient_id,
-        "type": "text",
-        "text": {
-            "body": message_text
-        }
-    }
+            await send_whatsapp_message(sender_id, error_msg)
 
-    try:
-        response = requests.post(url, headers=headers, json=payload, params=params)
-        response.raise_for_status()
-        print(f"WhatsApp message sent to {recipient_id}: {message_text}")
-    except requests.RequestException as e:
-        print(f"Error sending WhatsApp message to {recipient_id}: {e}")
-        if 'response' in locals() and response is not None:
-            print(f"API Response: {response.text}")
-
-
-def send_facebook_message(recipient_id: str, message_text: str):
-    """
-    Send a message to the user via Facebook Messenger API and log any errors.
-    """
-    url = "https://graph.facebook.com/v15.0/me/messages"
-    headers = {"Content-Type": "application/json"}
-    params = {"access_token": PAGE_ACCESS_TOKEN}
-    payload = {
-        "recipient": {"id": recipient_id},
-        "message": {"text": message_text},
-    }
 
-    try:
-        response = requests.post(url, headers=headers, json=payload, params=params)
-        response.raise_for_status()
-        print(f"Message sent to {recipient_id}: {message_text}")
-    except requests.RequestException as e:
-        print(f"Error sending message to {recipient_id}: {e}")
-        if response is not None:
-            print(f"API Response: {response.text}")
+message_pool = MessageWorkerPool(process_message, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
 
 
 @router.get("/rebuild-vector-db")
@@ -363,4 +377,31 @@ async def rebuild_vector_db_endpoint():
         dict: Confirmation message indicating the rebuild has started.
     """
     asyncio.create_task(rebuild_vector_db())
-    return {"message": "Vector DB rebuild started"}
\ No newline at end of file
+    return {"message": "Vector DB rebuild started"}
+
+
+@router.get("/sync-vector-db")
+async def sync_vector_db_endpoint():
+    """
+    Endpoint to trigger an asynchronous incremental sync of the vector database.
+    Only new or changed documents are re-embedded; removed ones are deleted.
+
+    Returns:
+        dict: Confirmation message indicating the sync has started.
+    """
+    asyncio.create_task(sync_vector_db())
+    return {"message": "Vector DB sync started"}
+
+
+@router.get("/rollback-vector-db")
+async def rollback_vector_db_endpoint():
+    """
+    Endpoint to flip the active collection back to the previous rebuild.
+
+    Returns:
+        dict: The collection that is now active.
+    """
+    previous = collection_registry.rollback()
+    if previous is None:
+        raise HTTPException(status_code=409, detail="No previous collection version to roll back to")
+    return {"message": "Vector DB rolled back", "active_collection": previous}
@@ -0,0 +1,14 @@
+"""
+Metrics endpoint routes.
+"""
+from fastapi import APIRouter
+from services.metrics import metrics
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Returns the in-process counters, gauges and latency summaries.
+    """
+    return metrics.snapshot()
@@ -0,0 +1,173 @@
+"""
+Semantic cache of generated answers.
+
+Support questions repeat with small wording changes. Answers are stored
+under the embedding of the rewritten (standalone) question and reused when a
+new question is within ANSWER_CACHE_MIN_SIMILARITY cosine similarity, which
+skips retrieval and the completion. Entries are tagged with the collection
+data version, so a rebuild, rollback or sync invalidates them. Questions
+that refer to the user's own orders or account, and questions asked with
+conversation history or a summary in the prompt, are never cached.
+"""
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+from config import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MIN_SIMILARITY
+from services.collection_registry import collection_registry
+from services.metrics import metrics
+
+# Questions about the asker's own situation, records or contact details
+USER_SPECIFIC_PATTERN = re.compile(
+    r"\b(?:my|mine|our|ours)\b"
+    r"|\b(?:order|account|invoice|receipt|delivery|refund|complaint|ticket|installment|loan)s?\b"
+    r"|\d{4,}|\S+@\S+",
+    re.IGNORECASE
+)
+
+
+def is_user_specific(question: str) -> bool:
+    """True if the answer to the question likely depends on who is asking."""
+    return bool(USER_SPECIFIC_PATTERN.search(question))
+
+
+class CachedAnswer:
+    """One cached answer and the row of the embedding matrix it occupies."""
+
+    __slots__ = ("slot", "question", "answer", "created_at", "cost")
+
+    def __init__(self, slot: int, question: str, answer: str, cost: float):
+        self.slot = slot
+        self.question = question
+        self.answer = answer
+        self.created_at = time.monotonic()
+        # Seconds it took to produce the answer, i.e. what a hit saves
+        self.cost = cost
+
+
+class SemanticAnswerCache:
+    """LRU/TTL cache of answers, looked up by cosine similarity of question embeddings."""
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 min_similarity: float = ANSWER_CACHE_MIN_SIMILARITY, registry=collection_registry):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.min_similarity = min_similarity
+        self.registry = registry
+        self.version: Optional[str] = None
+        # Normalized embeddings, one row per slot; allocated on the first put
+        self._matrix: Optional[np.ndarray] = None
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._free: List[int] = list(range(max_entries - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.invalidations = 0
+        self.latency_saved = 0.0
+
+        metrics.register_gauge("answer_cache", self.stats)
+
+    def _check_version(self) -> None:
+        """Drop every entry if the collection data changed since they were stored."""
+        version = self.registry.data_version()
+        if version == self.version:
+            return
+        if self._entries:
+            self.invalidations += 1
+            print(f"Answer cache cleared: collection data changed to {version}")
+        self._entries.clear()
+        self._valid[:] = False
+        self._free = list(range(self.max_entries - 1, -1, -1))
+        self.version = version
+
+    def _remove(self, slot: int) -> None:
+        del self._entries[slot]
+        self._valid[slot] = False
+        self._free.append(slot)
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def cacheable(self, question: str) -> bool:
+        """Whether answers to this question may be cached and reused."""
+        if is_user_specific(question):
+            self.skipped += 1
+            metrics.increment("answer_cache.skipped")
+            return False
+        return True
+
+    def get(self, embedding: List[float]) -> Optional[CachedAnswer]:
+        """
+        Find a cached answer for a question.
+
+        Args:
+            embedding: Embedding of the rewritten question
+
+        Returns:
+            The closest entry if it is similar enough and still fresh, else None
+        """
+        self._check_version()
+        if self._entries and self._matrix is not None:
+            similarities = self._matrix @ self._normalize(embedding)
+            similarities[~self._valid] = -1.0
+            slot = int(np.argmax(similarities))
+            if similarities[slot] >= self.min_similarity:
+                entry = self._entries[slot]
+                if time.monotonic() - entry.created_at <= self.ttl:
+                    self._entries.move_to_end(slot)
+                    self.hits += 1
+                    self.latency_saved += entry.cost
+                    metrics.increment("answer_cache.hit")
+                    return entry
+                self._remove(slot)
+        self.misses += 1
+        metrics.increment("answer_cache.miss")
+        return None
+
+    def put(self, question: str, embedding: List[float], answer: str, cost: float, version: str) -> None:
+        """
+        Store an answer.
+
+        Args:
+            question: The rewritten question (kept for inspection)
+            embedding: Its embedding
+            answer: The generated answer
+            cost: Seconds spent producing the answer
+            version: Cache version seen at lookup; answers generated from
+                data that changed in the meantime are not stored
+        """
+        self._check_version()
+        if version != self.version:
+            return
+        vector = self._normalize(embedding)
+        if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+            self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            self._entries.clear()
+            self._valid[:] = False
+            self._free = list(range(self.max_entries - 1, -1, -1))
+        if not self._free:
+            self._remove(next(iter(self._entries)))
+        slot = self._free.pop()
+        self._matrix[slot] = vector
+        self._valid[slot] = True
+        self._entries[slot] = CachedAnswer(slot, question, answer, cost)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "skipped_user_specific": self.skipped,
+            "invalidations": self.invalidations,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+        }
+
+
+answer_cache = SemanticAnswerCache()
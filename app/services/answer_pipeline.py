@@ -0,0 +1,218 @@
+"""
+Per-message answer pipeline.
+
+Stages and dependencies:
+
+    pricing_rules
+    rewrite ──┬──> embed ──┬──> pricing ──> cache ─┐
+              │            └──> retrieve ──────────┼──> prompt ──> answer
+              └──> history ────────────────────────┘
+
+Questions the pricing rules alone settle short-circuit straight away with the
+sales reply, cancelling the other stages. The rewritten question is embedded
+once; the pricing classifier's nearest-neighbour vote, the answer cache and
+retrieval all use that embedding, and the pricing check falls back to the LLM
+when the local classifier is unsure. The cache stage likewise short-circuits with
+a stored answer to an equivalent question, for users without history or a
+summary. The history stage adds older exchanges about the product in focus
+to the recent ones. Streaming replies run the same graph up to the prompt
+and then stream the answer token by token.
+"""
+import time
+from typing import AsyncIterator, List, Optional
+from services.llm import (
+    PRICING_RESPONSE,
+    analyze_question,
+    build_messages,
+    check_if_pricing_question,
+    create_system_prompt,
+    generate_response,
+    stream_response,
+)
+from services.answer_cache import answer_cache
+from services.context import AMBIGUOUS, conversation_context
+from services.embedding import agenerate_embedding
+from services.history import fit_history_to_budget
+from services.intent import pricing_classifier
+from services.metrics import metrics
+from services.pipeline import Pipeline, ShortCircuit, Stage
+
+
+async def pricing_rules_stage(ctx: dict) -> bool:
+    """Stop the pipeline with the sales reply straight away if the pricing rules alone settle it."""
+    if pricing_classifier.is_conclusive(ctx["question"]) and await check_if_pricing_question(ctx["question"]):
+        raise ShortCircuit(PRICING_RESPONSE)
+    return False
+
+async def pricing_stage(ctx: dict) -> bool:
+    """Stop the pipeline with the sales reply if this is a pricing question."""
+    if await check_if_pricing_question(ctx["question"], ctx["embed"]):
+        raise ShortCircuit(PRICING_RESPONSE)
+    return False
+
+async def rewrite_stage(ctx: dict) -> str:
+    """
+    Rewrite follow-up questions into standalone ones. A local pre-pass settles
+    standalone questions and simple "it"/"this" follow-ups; only ambiguous
+    ones go to the LLM.
+    """
+    question, user_conversation = ctx["question"], ctx["user_conversation"]
+    if ctx["user_id"] is not None and user_conversation:
+        await conversation_context.load(ctx["user_id"])
+        conversation_context.sync_history(ctx["user_id"], user_conversation)
+        kind, local_question = conversation_context.classify_question(ctx["user_id"], question)
+        metrics.increment(f"rewrite.{kind}")
+        if kind != AMBIGUOUS:
+            metrics.increment("rewrite.llm_calls_avoided")
+            return local_question
+    return await analyze_question(question, user_conversation)
+
+async def embed_stage(ctx: dict) -> Optional[List[float]]:
+    """
+    Embed the rewritten question once for every stage that needs it.
+
+    Returns:
+        The embedding, or None if it could not be fetched; retrieval then
+        tries again itself, and the cache and local pricing vote are skipped
+    """
+    try:
+        return await agenerate_embedding(ctx["rewrite"])
+    except Exception as e:
+        print(f"Could not embed question: {e}")
+        return None
+
+async def retrieve_stage(ctx: dict) -> str:
+    """Fetch relevant documents for the rewritten question, narrowed to the products it is about."""
+    products = conversation_context.focus_products(ctx["user_id"], ctx["rewrite"])
+    return await ctx["vector_store"].aquery(ctx["rewrite"], products=products, embedding=ctx["embed"])
+
+async def history_stage(ctx: dict) -> list:
+    """Recent exchanges, preceded by older ones about the product in focus."""
+    if ctx["user_id"] is None or not ctx["user_conversation"]:
+        return ctx["user_conversation"]
+    # The rewrite stage has brought the user's context up to date
+    return await conversation_context.filter_relevant_history(
+        ctx["user_id"], ctx["question"], ctx["user_conversation"]
+    )
+
+async def cache_stage(ctx: dict) -> Optional[dict]:
+    """
+    Stop the pipeline with a cached answer if an equivalent question was answered before.
+
+    Only used when the prompt carries no per-user context: answers generated
+    with a user's history or summary may depend on it, so they are neither
+    served from nor stored in the shared cache.
+
+    Returns:
+        What answer_stage needs to cache the new answer, or None if it must not be cached
+    """
+    if ctx["user_conversation"] or ctx["conversation_summary"]:
+        metrics.increment("answer_cache.skipped_context")
+        return None
+    question, embedding = ctx["rewrite"], ctx["embed"]
+    if embedding is None or not answer_cache.cacheable(f"{ctx['question']}\n{question}"):
+        return None
+    cached = answer_cache.get(embedding)
+    if cached is not None:
+        raise ShortCircuit(cached.answer)
+    return {
+        "question": question,
+        "embedding": embedding,
+        "version": answer_cache.version,
+        "started": time.monotonic(),
+    }
+
+def remember_answer(ctx: dict, answer: str) -> None:
+    """Store a generated answer in the semantic cache if the question allows it."""
+    lookup = ctx.get("cache")
+    if lookup is None or not answer:
+        return
+    answer_cache.put(
+        lookup["question"], lookup["embedding"], answer,
+        cost=time.monotonic() - lookup["started"], version=lookup["version"]
+    )
+
+async def prompt_stage(ctx: dict) -> list:
+    """Build the LLM messages from the retrieved documents and as much history as fits the token budget."""
+    system_prompt = create_system_prompt(ctx["retrieve"], ctx["conversation_summary"])
+    # Newest first, so older relevant exchanges are the first to be left out
+    history = fit_history_to_budget(ctx["history"], system_prompt, ctx["question"])
+    return build_messages(system_prompt, history, ctx["question"])
+
+async def answer_stage(ctx: dict) -> str:
+    """Generate the final answer."""
+    answer = await generate_response(ctx["prompt"], check_pricing=False)
+    remember_answer(ctx, answer)
+    return answer
+
+
+PROMPT_STAGES = [
+    Stage("pricing_rules", pricing_rules_stage),
+    Stage("rewrite", rewrite_stage),
+    Stage("embed", embed_stage, depends_on=["rewrite"]),
+    Stage("pricing", pricing_stage, depends_on=["embed"]),
+    Stage("retrieve", retrieve_stage, depends_on=["rewrite", "embed"]),
+    Stage("cache", cache_stage, depends_on=["rewrite", "embed", "pricing"]),
+    Stage("history", history_stage, depends_on=["rewrite"]),
+    Stage("prompt", prompt_stage, depends_on=["retrieve", "history", "pricing", "cache"]),
+]
+
+answer_pipeline = Pipeline("answer", PROMPT_STAGES + [
+    Stage("answer", answer_stage, depends_on=["prompt"]),
+], output="answer")
+
+# Same graph without the final completion; used when the reply is streamed
+prompt_pipeline = Pipeline("answer", PROMPT_STAGES, output="prompt")
+
+
+async def answer_question(question: str, user_conversation: list, vector_store,
+                          conversation_summary: str = "", user_id: Optional[str] = None) -> str:
+    """
+    Answer a user question.
+
+    Args:
+        question: The user's question as they sent it
+        user_conversation: List of recent Q&A exchanges [{"question": str, "answer": str}]
+        vector_store: VectorStore used for retrieval
+        conversation_summary: Rolling summary of turns older than user_conversation
+        user_id: Asking user, used to track conversation context; without it
+            every follow-up goes through the LLM rewrite
+
+    Returns:
+        The reply to send back to the user
+    """
+    return await answer_pipeline.run(
+        question=question,
+        user_conversation=user_conversation,
+        vector_store=vector_store,
+        conversation_summary=conversation_summary,
+        user_id=user_id,
+    )
+
+
+async def stream_answer(question: str, user_conversation: list, vector_store,
+                        conversation_summary: str = "", user_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Answer a user question, yielding the reply in pieces as the LLM produces them.
+    Takes the same arguments as answer_question.
+
+    Yields:
+        Pieces of the reply text; the sales reply and cached answers come as one piece
+    """
+    try:
+        ctx = await prompt_pipeline.run_context(
+            question=question,
+            user_conversation=user_conversation,
+            vector_store=vector_store,
+            conversation_summary=conversation_summary,
+            user_id=user_id,
+        )
+    except ShortCircuit as short_circuit:
+        # Sales reply or cached answer
+        yield short_circuit.result
+        return
+    pieces = []
+    async for delta in stream_response(ctx["prompt"]):
+        pieces.append(delta)
+        yield delta
+    remember_answer(ctx, "".join(pieces))
@@ -0,0 +1,149 @@
+"""
+Tracks which Chroma collection version is live.
+
+Rebuilds write into a fresh versioned collection and then flip a small JSON
+pointer file next to the Chroma data; readers resolve the active name through
+this registry, so they never see a half-built or missing collection.
+"""
+import datetime
+import json
+import os
+import threading
+from typing import List, Optional
+from config import COLLECTION_NAME, ACTIVE_COLLECTION_FILE
+
+
+class CollectionRegistry:
+    """Persistent pointer to the active collection plus the list of retained versions."""
+
+    def __init__(self, path: str = ACTIVE_COLLECTION_FILE, default: str = COLLECTION_NAME):
+        self.path = path
+        self.default = default
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._state = {"active": default, "versions": [], "revision": 0}
+
+    def _load(self) -> dict:
+        """Return the pointer state, re-reading the file only when it changed on disk."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return self._state
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._state = json.load(f)
+            self._mtime = mtime
+        return self._state
+
+    def _save(self, state: dict) -> None:
+        """Write the pointer file atomically (write to a temp file, then rename)."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._state = state
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def active(self) -> str:
+        """Name of the collection live traffic should read from."""
+        with self._lock:
+            return self._load()["active"]
+
+    def versions(self) -> List[str]:
+        """Retained collection versions, oldest first."""
+        with self._lock:
+            return list(self._load()["versions"])
+
+    def data_version(self) -> str:
+        """
+        Identifies the data live traffic reads: the active collection plus the
+        registry revision, which grows on every rebuild, rollback and sync and
+        never repeats, so caches of derived answers can tag entries with it.
+        Rolling back to a version gives a new data version, not the one it had
+        before, since syncs may have changed what that version reads.
+        """
+        with self._lock:
+            state = self._load()
+            return f"{state['active']}@{state.get('revision', 0)}"
+
+    def _next_revision(self, state: dict) -> int:
+        return state.get("revision", 0) + 1
+
+    def mark_updated(self) -> None:
+        """Record that the active collection was modified in place (by a sync)."""
+        with self._lock:
+            state = self._load()
+            self._save(dict(state, revision=self._next_revision(state)))
+
+    def new_version_name(self) -> str:
+        """Generate a name for a new shadow collection."""
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M%S")
+        name = f"{self.default}_v{stamp}"
+        existing = set(self.versions())
+        suffix = 1
+        while name in existing:
+            suffix += 1
+            name = f"{self.default}_v{stamp}_{suffix}"
+        return name
+
+    def activate(self, name: str) -> None:
+        """
+        Atomically make `name` the active collection.
+
+        Args:
+            name: Collection to flip live traffic to
+        """
+        with self._lock:
+            state = self._load()
+            versions = [v for v in state["versions"] if v != name] + [name]
+            self._save({"active": name, "versions": versions, "revision": self._next_revision(state)})
+        print(f"Active collection is now {name}")
+
+    def rollback(self) -> Optional[str]:
+        """
+        Flip back to the version created before the active one.
+
+        Returns:
+            The newly active collection name, or None if there is nothing to roll back to
+        """
+        with self._lock:
+            state = self._load()
+            versions = state["versions"]
+            if state["active"] not in versions:
+                return None
+            position = versions.index(state["active"])
+            if position == 0:
+                return None
+            previous = versions[position - 1]
+            self._save({"active": previous, "versions": versions, "revision": self._next_revision(state)})
+        print(f"Rolled back active collection to {previous}")
+        return previous
+
+    def prune(self, client, keep: int) -> List[str]:
+        """
+        Delete all but the newest `keep` versions. The active one is never deleted.
+
+        Args:
+            client: Chroma client owning the collections
+            keep: Number of versions to retain
+
+        Returns:
+            Names of the collections that were deleted
+        """
+        with self._lock:
+            state = self._load()
+            versions = state["versions"]
+            stale = [v for v in versions[:-keep] if v != state["active"]] if keep > 0 else []
+            if not stale:
+                return []
+            self._save(dict(state, versions=[v for v in versions if v not in stale]))
+        for name in stale:
+            try:
+                client.delete_collection(name=name)
+            except Exception as e:
+                print(f"Could not delete old collection {name}: {e}")
+        return stale
+
+
+collection_registry = CollectionRegistry()
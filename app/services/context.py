@@ -3,42 +3,314 @@
 Universal context tracking service for maintaining conversation focus across any product domain.
 """
 from typing import Dict, List, Tuple, Any, Optional
+import asyncio
+import json
 import re
-from collections import defaultdict
+import time
+import zlib
+from collections import OrderedDict
+from config import CONTEXT_MAX_USERS, CONTEXT_TTL_SECONDS, RELEVANT_HISTORY_TURNS
+from services.db import get_conversation_context_state, get_relevant_history, save_conversation_context_states
+from services.entity_index import entity_index
+from services.metrics import metrics
+
+# Outcomes of ConversationContext.classify_question
+STANDALONE = "standalone"   # understandable without the conversation
+RESOLVED = "resolved"       # a follow-up whose reference was filled in locally
+AMBIGUOUS = "ambiguous"     # needs the LLM rewrite
+
+# Openers that continue the previous exchange ("and the warranty?", "what about the 200W one?")
+FOLLOW_UP_OPENER_PATTERN = re.compile(
+    r"^\s*(?:and|also|so|then|what about|how about|what else|same|ok(?:ay)?,? (?:and|so|what))\b",
+    re.IGNORECASE
+)
+# "it" that does not refer to anything ("is it possible to...", "it's raining")
+EXPLETIVE_IT_PATTERN = re.compile(
+    r"\b(?:is it|it(?:'s| is| was| would be)?)\s+(?:possible|necessary|true|okay|ok|time|raining)\b",
+    re.IGNORECASE
+)
+SINGULAR_REFERENCE_PATTERN = re.compile(r"\b(?:it|this)\b", re.IGNORECASE)
+# References the local pass does not try to resolve: possessives, plurals, and "that",
+# which is often a relative pronoun
+OTHER_REFERENCE_PATTERN = re.compile(
+    r"\b(?:its|they|them|their|these|those|that|one|ones|other|others|same|former|latter)\b",
+    re.IGNORECASE
+)
+# Questions this short ("why?", "how long?") only make sense after the previous answer
+MIN_STANDALONE_WORDS = 4
+# Capitalized words that start questions rather than product names
+NON_NAME_WORDS = {
+    'a', 'an', 'the', 'i', 'my', 'your', 'our', 'is', 'are', 'does', 'do', 'can', 'will',
+    'should', 'what', 'which', 'how', 'when', 'where', 'why', 'tell', 'about', 'please', 'hi', 'hello'
+}
+
+# Bounds on what is tracked per user
+MAX_TRACKED_ENTITIES = 20
+MAX_SECONDARY_ENTITIES = 5
+
+
+def _text_hash(text: str) -> int:
+    """Compact fingerprint of a message, used to recognise exchanges already tracked."""
+    return zlib.crc32(text.encode("utf-8"))
+
 
 class EntityTracker:
     """Tracks entities and references throughout a conversation."""
     
+    __slots__ = ('entities', 'primary_entity', 'secondary_entities', 'last_update_turn', 'attributes_discussed')
+    
     def __init__(self):
-        self.entities = defaultdict(dict)  # Tracks all mentioned entities
+        self.entities: Dict[str, Tuple[int, float]] = {}  # entity -> (last_seen turn, confidence)
         self.primary_entity = None         # Current focus entity
         self.secondary_entities = []       # Related entities in current context
         self.last_update_turn = 0          # Conversation turn counter
-        self.attributes_discussed = defaultdict(list)  # Tracks attributes per entity
+        self.attributes_discussed: Dict[str, List[str]] = {}  # Tracks attributes per entity
     
     def update(self, entity: str, confidence: float, turn: int, 
                attributes: Optional[List[str]] = None) -> None:
         """Update tracked entity with new information"""
-        self.entities[entity]['last_seen'] = turn
-        self.entities[entity]['confidence'] = confidence
+        self.entities[entity] = (turn, confidence)
+        self.last_update_turn = turn
         
         # Update primary entity if this one has higher confidence
-        if not self.primary_entity or confidence > self.entities.get(
-                self.primary_entity, {}).get('confidence', 0):
+        if not self.primary_entity or confidence > self.entities.get(self.primary_entity, (0, 0))[1]:
             if self.primary_entity:
+                if self.primary_entity in self.secondary_entities:
+                    self.secondary_entities.remove(self.primary_entity)
                 self.secondary_entities.append(self.primary_entity)
+                del self.secondary_entities[:-MAX_SECONDARY_ENTITIES]
             self.primary_entity = entity
         
         # Track attributes being discussed about this entity
         if attributes:
-            self.attributes_discussed[entity].extend(
-                [attr for attr in attributes if attr not in self.attributes_discussed[entity]])
+            discussed = self.attributes_discussed.setdefault(entity, [])
+            discussed.extend([attr for attr in attributes if attr not in discussed])
+        
+        if len(self.entities) > MAX_TRACKED_ENTITIES:
+            self._forget_oldest()
+    
+    def _forget_oldest(self) -> None:
+        """Drop the least recently seen entities beyond MAX_TRACKED_ENTITIES (never the primary one)."""
+        by_age = sorted(self.entities, key=lambda name: self.entities[name][0])
+        for name in by_age[:len(self.entities) - MAX_TRACKED_ENTITIES]:
+            if name == self.primary_entity:
+                continue
+            del self.entities[name]
+            self.attributes_discussed.pop(name, None)
+    
+    def to_state(self) -> dict:
+        return {
+            'entities': self.entities,
+            'primary': self.primary_entity,
+            'secondary': self.secondary_entities,
+            'turn': self.last_update_turn,
+            'attributes': self.attributes_discussed,
+        }
+    
+    @classmethod
+    def from_state(cls, state: dict) -> "EntityTracker":
+        tracker = cls()
+        tracker.entities = {name: tuple(value) for name, value in state['entities'].items()}
+        tracker.primary_entity = state['primary']
+        tracker.secondary_entities = state['secondary']
+        tracker.last_update_turn = state['turn']
+        tracker.attributes_discussed = state['attributes']
+        return tracker
+
+
+class ExchangeRecord:
+    """What is kept of one tracked exchange; the answer only as a fingerprint."""
+    
+    __slots__ = ('turn', 'question', 'answer_hash', 'entities', 'named_entities', 'attributes')
+    
+    def __init__(self, turn: int, question: str, answer_hash: int, entities: Tuple[str, ...],
+                 named_entities: Tuple[str, ...], attributes: Tuple[str, ...]):
+        self.turn = turn
+        self.question = question
+        self.answer_hash = answer_hash
+        self.entities = entities
+        self.named_entities = named_entities
+        self.attributes = attributes
+    
+    def to_state(self) -> list:
+        return [self.turn, self.question, self.answer_hash, self.entities, self.named_entities, self.attributes]
+    
+    @classmethod
+    def from_state(cls, state: list) -> "ExchangeRecord":
+        turn, question, answer_hash, entities, named_entities, attributes = state
+        return cls(turn, question, answer_hash, tuple(entities), tuple(named_entities), tuple(attributes))
+
+
+class UserContext:
+    """Conversation context of one user."""
+    
+    __slots__ = ('tracker', 'turns', 'history', 'last_question', 'last_pronoun_resolution', 'last_used')
+    
+    def __init__(self):
+        self.tracker = EntityTracker()
+        self.turns = 0
+        self.history: List[ExchangeRecord] = []
+        self.last_question = ''
+        self.last_pronoun_resolution: Optional[Dict[str, str]] = None
+        self.last_used = time.monotonic()
+    
+    def to_state(self) -> str:
+        return json.dumps({
+            'tracker': self.tracker.to_state(),
+            'turns': self.turns,
+            'history': [record.to_state() for record in self.history],
+            'last_question': self.last_question,
+            'last_pronoun_resolution': self.last_pronoun_resolution,
+        }, separators=(',', ':'))
+    
+    @classmethod
+    def from_state(cls, serialized: str) -> "UserContext":
+        state = json.loads(serialized)
+        context = cls()
+        context.tracker = EntityTracker.from_state(state['tracker'])
+        context.turns = state['turns']
+        context.history = [ExchangeRecord.from_state(record) for record in state['history']]
+        context.last_question = state['last_question']
+        context.last_pronoun_resolution = state['last_pronoun_resolution']
+        return context
+    
+    def approx_size(self) -> int:
+        """Rough bytes held by this record, for memory reporting."""
+        size = 200 + len(self.last_question) + 120 * len(self.tracker.entities)
+        for record in self.history:
+            size += 150 + len(record.question) + 60 * (len(record.entities) + len(record.named_entities))
+        return size
+
+
+class ContextStore:
+    """
+    Bounded LRU/TTL map of user ID -> UserContext.
+
+    Users evicted for space or idleness are serialized and written to SQLite
+    in batches off the request path; load() brings them back on their next
+    message, so only active users are held in memory.
+    """
+    
+    def __init__(self, max_users: int = CONTEXT_MAX_USERS, ttl_seconds: float = CONTEXT_TTL_SECONDS):
+        self.max_users = max_users
+        self.ttl = ttl_seconds
+        self._contexts: "OrderedDict[str, UserContext]" = OrderedDict()
+        # Evicted users waiting to be written: user ID -> (serialized state, evicted at)
+        self._spill: Dict[str, Tuple[str, float]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.evictions = 0
+        self.restores = 0
+        
+        metrics.register_gauge("conversation_context", self.stats)
+    
+    def __contains__(self, user_id: str) -> bool:
+        return self.get(user_id) is not None
+    
+    def get(self, user_id: str) -> Optional[UserContext]:
+        """The user's context if it is in memory and not expired; marks it recently used."""
+        context = self._contexts.get(user_id)
+        if context is None:
+            return None
+        now = time.monotonic()
+        if now - context.last_used > self.ttl:
+            self._evict(user_id)
+            return None
+        context.last_used = now
+        self._contexts.move_to_end(user_id)
+        return context
+    
+    def get_or_create(self, user_id: str) -> UserContext:
+        context = self.get(user_id)
+        if context is None:
+            context = self._install(user_id, UserContext())
+        return context
+    
+    def _install(self, user_id: str, context: UserContext) -> UserContext:
+        context.last_used = time.monotonic()
+        self._contexts[user_id] = context
+        self._spill.pop(user_id, None)
+        self._evict_excess()
+        return context
+    
+    def _evict(self, user_id: str) -> None:
+        context = self._contexts.pop(user_id)
+        self._spill[user_id] = (context.to_state(), time.time())
+        self.evictions += 1
+        self._schedule_flush()
+    
+    def _evict_excess(self) -> None:
+        now = time.monotonic()
+        while self._contexts:
+            user_id, context = next(iter(self._contexts.items()))
+            if len(self._contexts) <= self.max_users and now - context.last_used <= self.ttl:
+                break
+            self._evict(user_id)
+    
+    def _schedule_flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+        except RuntimeError:
+            # No event loop (scripts); spilled state is written on the next flush()
+            pass
+    
+    async def flush(self) -> None:
+        """Write spilled contexts to SQLite."""
+        while self._spill:
+            batch, self._spill = self._spill, {}
+            rows = [(user_id, state, evicted_at) for user_id, (state, evicted_at) in batch.items()]
+            try:
+                await save_conversation_context_states(rows)
+            except Exception as e:
+                print(f"Error spilling {len(rows)} conversation contexts: {e}")
+                return
+    
+    async def load(self, user_id: str) -> Optional[UserContext]:
+        """
+        Make sure a user's context is in memory, restoring it from the spill
+        buffer or SQLite if it was evicted.
+        
+        Returns:
+            The context, or None if the user has none yet
+        """
+        context = self.get(user_id)
+        if context is not None:
+            return context
+        spilled = self._spill.get(user_id)
+        serialized = spilled[0] if spilled else await get_conversation_context_state(user_id)
+        if serialized is None:
+            return None
+        # Another message for the same user may have created it while we were reading
+        context = self.get(user_id)
+        if context is None:
+            context = self._install(user_id, UserContext.from_state(serialized))
+            self.restores += 1
+        return context
+    
+    async def close(self) -> None:
+        """Spill every in-memory context so the next process can resume them."""
+        for user_id in list(self._contexts):
+            self._evict(user_id)
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+    
+    def stats(self) -> dict:
+        return {
+            "users": len(self._contexts),
+            "approx_bytes": sum(context.approx_size() for context in self._contexts.values()),
+            "pending_spill": len(self._spill),
+            "evictions": self.evictions,
+            "restores": self.restores,
+        }
+
 
 class ConversationContext:
     """Advanced context manager for multi-domain product conversations."""
     
-    def __init__(self):
-        self.user_contexts: Dict[str, Dict] = {}
+    def __init__(self, store: Optional[ContextStore] = None):
+        self.user_contexts = store if store is not None else ContextStore()
         self.max_history_turns = 5  # Maximum conversation turns to consider
         
         # Common attribute types - extend based on your product domains
@@ -69,8 +341,14 @@ class ConversationContext:
     def _extract_entities(self, text: str) -> List[Tuple[str, str, float]]:
         """
         Extract potential product entities from text.
+        Once rebuild_vector_db has produced the catalog entity index, entities
+        are canonical product IDs found in one pass over the text; before that
+        the regex patterns below are used.
         Returns: List of (entity, type, confidence) tuples
         """
+        if entity_index.available:
+            return [(entity_id, 'product', 1.0) for entity_id in entity_index.find(text)]
+        
         found_entities = []
         
         # Extract entities using patterns
@@ -90,6 +368,33 @@ class ConversationContext:
         
         return found_entities
     
+    def _named_entities(self, text: str) -> List[str]:
+        """
+        Distinct named products in text, e.g. "Ovego battery" or "OV-200 panel".
+        
+        The category patterns match greedily ("Tell me about the Ovego battery"),
+        so only the capitalized or numbered words right before the category noun
+        are kept; matches without such a name and the generic pattern are skipped.
+        With the catalog entity index these are canonical product IDs instead.
+        """
+        if entity_index.available:
+            return entity_index.find(text)
+        names = []
+        for entity, entity_type, _ in self._extract_entities(text):
+            if entity_type == 'generic':
+                continue
+            words = entity.split()
+            name = []
+            for word in reversed(words[:-1]):
+                if not (word[0].isupper() or word[0].isdigit()) or word.lower() in NON_NAME_WORDS:
+                    break
+                name.insert(0, word)
+            if name:
+                named = " ".join(name + words[-1:])
+                if named not in names:
+                    names.append(named)
+        return names
+    
     def _extract_attributes(self, text: str) -> List[str]:
         """Extract attributes being discussed about entities"""
         attributes = []
@@ -109,21 +414,12 @@ class ConversationContext:
             turn: Conversation turn number (or 0 for auto-increment)
         """
         # Initialize user context if needed
-        if user_id not in self.user_contexts:
-            self.user_contexts[user_id] = {
-                'tracker': EntityTracker(),
-                'turns': 0,
-                'history': [],
-                'last_question': '',
-                'last_pronoun_resolution': None
-            }
-        
-        context = self.user_contexts[user_id]
+        context = self.user_contexts.get_or_create(user_id)
         
         # Auto-increment turn if not provided
         if turn == 0:
-            context['turns'] += 1
-            turn = context['turns']
+            context.turns += 1
+            turn = context.turns
         
         # Extract entities from both question and answer
         combined_text = question + " " + answer
@@ -132,22 +428,129 @@ class ConversationContext:
         
         # Update entity tracker
         for entity, entity_type, confidence in found_entities:
-            context['tracker'].update(entity, confidence, turn, attributes)
+            context.tracker.update(entity, confidence, turn, attributes)
         
         # Store this exchange in history
-        context['history'].append({
-            'turn': turn,
-            'question': question,
-            'answer': answer,
-            'entities': [e[0] for e in found_entities],
-            'attributes': attributes
-        })
+        context.history.append(ExchangeRecord(
+            turn,
+            question,
+            _text_hash(answer),
+            tuple(dict.fromkeys(e[0] for e in found_entities)),
+            # Product in focus; follow-ups that name none keep the previous one
+            tuple(self._named_entities(question) or self._named_entities(answer)
+                  or (context.history[-1].named_entities if context.history else ())),
+            tuple(attributes)
+        ))
         
         # Limit history size
-        if len(context['history']) > self.max_history_turns:
-            context['history'] = context['history'][-self.max_history_turns:]
+        if len(context.history) > self.max_history_turns:
+            del context.history[:-self.max_history_turns]
+        
+        context.last_question = question
+    
+    async def load(self, user_id: str) -> None:
+        """Restore an evicted user's context from SQLite before it is used."""
+        await self.user_contexts.load(user_id)
+    
+    async def close(self) -> None:
+        """Persist all in-memory contexts. Called on application shutdown."""
+        await self.user_contexts.close()
+    
+    def sync_history(self, user_id: str, user_conversation: List[Dict[str, str]]) -> None:
+        """
+        Bring a user's context up to date with their stored history.
+
+        Users with no context (new, or evicted without a stored copy) are
+        replayed from their most recent exchanges; known users get any
+        exchanges newer than the last one tracked. Call load() first so
+        evicted users are restored instead of replayed.
         
-        context['last_question'] = question
+        Args:
+            user_id: User identifier
+            user_conversation: Recent exchanges, oldest first
+        """
+        recent = user_conversation[-self.max_history_turns:]
+        context = self.user_contexts.get(user_id)
+        if context is not None and context.history:
+            last = context.history[-1]
+            for position in range(len(recent) - 1, -1, -1):
+                if (recent[position]['question'] == last.question
+                        and _text_hash(recent[position]['answer']) == last.answer_hash):
+                    recent = recent[position + 1:]
+                    break
+        for exchange in recent:
+            self.track_exchange(user_id, exchange['question'], exchange['answer'])
+    
+    def classify_question(self, user_id: str, question: str) -> Tuple[str, str]:
+        """
+        Decide locally whether a question needs the LLM rewrite.
+        
+        Only questions that name their own product (with any "it" coming
+        after the name, or naming the product already in focus), or that
+        follow an exchange with no product in focus, count as standalone.
+        
+        Args:
+            user_id: User identifier (call sync_history first)
+            question: The question as the user sent it
+            
+        Returns:
+            (kind, question): kind is STANDALONE, RESOLVED or AMBIGUOUS; for
+            RESOLVED the question has its reference replaced by the product
+            discussed in the previous exchange
+        """
+        context = self.user_contexts.get(user_id)
+        if context is None or not context.history:
+            return STANDALONE, question
+        
+        if FOLLOW_UP_OPENER_PATTERN.search(question) or OTHER_REFERENCE_PATTERN.search(question):
+            return AMBIGUOUS, question
+        
+        own_entities = self._named_entities(question)
+        # Product in focus after the previous exchange
+        focus = context.history[-1].named_entities
+        expletive = EXPLETIVE_IT_PATTERN.search(question)
+        without_expletive = EXPLETIVE_IT_PATTERN.sub(" ", question)
+        singular = SINGULAR_REFERENCE_PATTERN.search(without_expletive)
+        if not singular:
+            if own_entities:
+                return STANDALONE, question
+            if focus:
+                # "What is the warranty?" right after a product was discussed is about that product
+                return AMBIGUOUS, question
+            if len(question.split()) >= MIN_STANDALONE_WORDS:
+                return STANDALONE, question
+            return AMBIGUOUS, question
+        if own_entities:
+            # "Is the Ovego battery waterproof, and how long does it last?": the
+            # reference follows the name; or the product named is the one in focus
+            if self._named_entities(without_expletive[:singular.start()]) or set(own_entities) <= set(focus):
+                return STANDALONE, question
+            # "Can I charge it with the OV-200 panel?": "it" is the earlier product
+            return AMBIGUOUS, question
+        
+        # "it"/"this" with exactly one product in the previous exchange
+        if len(focus) != 1 or expletive:
+            return AMBIGUOUS, question
+        return RESOLVED, self._substitute_pronouns(question, self._display_name(focus[0]))
+    
+    @staticmethod
+    def _display_name(entity: str) -> str:
+        """Product title for a canonical product ID; regex-extracted entities are returned as is."""
+        return entity_index.name(entity)
+    
+    def _substitute_pronouns(self, question: str, entity: str, secondary: Optional[str] = None) -> str:
+        """Replace pronoun references in a question with entity names."""
+        resolved_question = question
+        for pattern, pronoun_type in self.pronoun_patterns:
+            if not re.search(pattern, resolved_question, re.IGNORECASE):
+                continue
+            if pronoun_type in ('singular', 'specific'):
+                replacement = entity
+            else:
+                # For plural pronouns, include the secondary entity if there is one
+                replacement = f"{entity} and {secondary}" if secondary else entity
+            resolved_question = re.sub(pattern, replacement, resolved_question, flags=re.IGNORECASE)
+        return resolved_question
     
     def resolve_references(self, user_id: str, current_question: str) -> str:
         """
@@ -160,48 +563,24 @@ class ConversationContext:
         Returns:
             Question with pronouns resolved where possible
         """
-        if user_id not in self.user_contexts:
+        context = self.user_contexts.get(user_id)
+        if context is None:
             return current_question
         
-        context = self.user_contexts[user_id]
-        tracker = context['tracker']
+        tracker = context.tracker
         
         if not tracker.primary_entity:
             return current_question
         
-        resolved_question = current_question
-        resolution_applied = False
-        
-        # Try to resolve pronouns
-        for pattern, pronoun_type in self.pronoun_patterns:
-            if re.search(pattern, resolved_question, re.IGNORECASE):
-                if pronoun_type in ('singular', 'specific') and tracker.primary_entity:
-                    resolved_question = re.sub(
-                        pattern, 
-                        tracker.primary_entity, 
-                        resolved_question, 
-                        flags=re.IGNORECASE
-                    )
-                    resolution_applied = True
-                    
-                elif pronoun_type == 'plural' and (tracker.secondary_entities or tracker.primary_entity):
-                    # For plural pronouns, try to use secondary entities if available
-                    if tracker.secondary_entities:
-                        replacement = f"{tracker.primary_entity} and {tracker.secondary_entities[0]}"
-                    else:
-                        replacement = tracker.primary_entity  # Fallback to primary
-                    
-                    resolved_question = re.sub(
-                        pattern, 
-                        replacement, 
-                        resolved_question, 
-                        flags=re.IGNORECASE
-                    )
-                    resolution_applied = True
+        secondary = self._display_name(tracker.secondary_entities[0]) if tracker.secondary_entities else None
+        resolved_question = self._substitute_pronouns(
+            current_question, self._display_name(tracker.primary_entity), secondary
+        )
+        resolution_applied = resolved_question != current_question
         
         # Track the resolution for later reference
         if resolution_applied:
-            context['last_pronoun_resolution'] = {
+            context.last_pronoun_resolution = {
                 'original': current_question,
                 'resolved': resolved_question,
                 'primary_entity': tracker.primary_entity
@@ -219,17 +598,18 @@ class ConversationContext:
         Returns:
             Contextual directive for the system prompt
         """
-        if user_id not in self.user_contexts:
+        context = self.user_contexts.get(user_id)
+        if context is None:
             return ""
         
-        context = self.user_contexts[user_id]
-        tracker = context['tracker']
+        tracker = context.tracker
         
         if not tracker.primary_entity:
             return ""
         
         # Build contextual directive
-        directive = f"\n\nCONTEXT DIRECTIVE: The current conversation is focused on {tracker.primary_entity}."
+        primary_name = self._display_name(tracker.primary_entity)
+        directive = f"\n\nCONTEXT DIRECTIVE: The current conversation is focused on {primary_name}."
         
         # Add recently discussed attributes if any
         if tracker.primary_entity in tracker.attributes_discussed:
@@ -240,74 +620,84 @@ class ConversationContext:
         
         # Add secondary entities if relevant
         if tracker.secondary_entities:
-            directive += f" Other relevant products mentioned include: {', '.join(tracker.secondary_entities[:2])}."
+            secondary_names = [self._display_name(entity) for entity in tracker.secondary_entities[:2]]
+            directive += f" Other relevant products mentioned include: {', '.join(secondary_names)}."
             
         # Add pronoun resolution guidance
-        directive += f"\nWhen the user uses pronouns like 'it', 'this', or 'that', they are most likely referring to {tracker.primary_entity} unless clearly indicated otherwise."
+        directive += f"\nWhen the user uses pronouns like 'it', 'this', or 'that', they are most likely referring to {primary_name} unless clearly indicated otherwise."
         
         return directive
     
-    def filter_relevant_history(self, user_id: str, full_history: str) -> str:
+    def exchange_entities(self, user_id: str, question: str, answer: str) -> List[Tuple[str, str]]:
         """
-        Filter conversation history to maintain relevance to current context.
+        Entities an exchange is about, as stored with it for relevant-history lookups.
+        
+        Products named in the exchange, or the product in focus before it for
+        follow-ups that name none, each paired with the attributes discussed.
         
         Args:
             user_id: User identifier
-            full_history: Complete conversation history string
+            question: User's question
+            answer: System's answer
             
         Returns:
-            Filtered history focused on current topic
+            List of (entity, comma-separated attributes) pairs
         """
-        if user_id not in self.user_contexts or not full_history:
-            return full_history
-            
-        context = self.user_contexts[user_id]
-        tracker = context['tracker']
-        
-        # Return full history for short conversations
-        history_entries = full_history.strip().split('\n')
-        qa_pairs = len(history_entries) // 2
-        if qa_pairs <= 3:
-            return full_history
-            
-        # Build relevant history when we have a primary entity
-        if tracker.primary_entity:
-            filtered_lines = []
-            entity_lower = tracker.primary_entity.lower()
-            
-            # Always include the most recent exchange
-            if len(history_entries) >= 2:
-                filtered_lines.extend(history_entries[-2:])
-            
-            # Add exchanges about the primary entity
-            for i in range(0, len(history_entries)-2, 2):
-                q_line = history_entries[i]
-                a_line = history_entries[i+1] if i+1 < len(history_entries) else ""
-                
-                if entity_lower in q_line.lower() or entity_lower in a_line.lower():
-                    # Avoid duplicates
-                    if q_line not in filtered_lines:
-                        filtered_lines.insert(0, q_line)
-                        filtered_lines.insert(1, a_line)
-            
-            # If we have resolved pronouns previously, include that exchange
-            if context.get('last_pronoun_resolution'):
-                res = context['last_pronoun_resolution']
-                for i in range(0, len(history_entries)-2, 2):
-                    q_line = history_entries[i]
-                    a_line = history_entries[i+1] if i+1 < len(history_entries) else ""
-                    
-                    if res['original'] in q_line:
-                        if q_line not in filtered_lines:
-                            filtered_lines.insert(0, q_line)
-                            filtered_lines.insert(1, a_line)
+        entities = list(dict.fromkeys(self._named_entities(question) + self._named_entities(answer)))
+        if not entities:
+            context = self.user_contexts.get(user_id)
+            if context is not None and context.history:
+                entities = list(context.history[-1].named_entities)
+        attributes = ",".join(self._extract_attributes(question + " " + answer))
+        return [(entity, attributes) for entity in entities]
+    
+    def focus_products(self, user_id: Optional[str], question: str) -> List[str]:
+        """
+        Canonical product IDs a question is about, for narrowing retrieval.
+        
+        Products named in the question, or for an "it"/"this" follow-up the
+        product in focus in the previous exchange. Empty until the catalog
+        entity index exists, since regex-extracted names are not IDs.
+        
+        Args:
+            user_id: User identifier, or None if unknown
+            question: The (rewritten) question
+        """
+        if not entity_index.available:
+            return []
+        products = entity_index.find(question)
+        if products:
+            return products
+        context = self.user_contexts.get(user_id) if user_id is not None else None
+        if (context is not None and context.history
+                and SINGULAR_REFERENCE_PATTERN.search(EXPLETIVE_IT_PATTERN.sub(" ", question))):
+            return list(context.history[-1].named_entities)
+        return []
+    
+    async def filter_relevant_history(self, user_id: str, question: str, user_conversation: List[Dict[str, str]],
+                                      max_relevant: int = RELEVANT_HISTORY_TURNS) -> List[Dict[str, str]]:
+        """
+        Add older exchanges about the product in focus to the recent history.
+        
+        Matching exchanges come from one indexed query on the entities stored
+        with each exchange, so the cost does not grow with the user's history.
+        
+        Args:
+            user_id: User identifier (call sync_history first)
+            question: The current question
+            user_conversation: The user's most recent exchanges, oldest first
+            max_relevant: Maximum older exchanges to add
             
-            # Limit to maximum 4 QA pairs
-            if len(filtered_lines) > 8:
-                filtered_lines = filtered_lines[:8]
-                
-            if filtered_lines:
-                return "\n".join(filtered_lines)
-        
-        # Default: return the most recent exchanges
-        return "\n".join(history_entries[-6:]) if len(history_entries) > 6 else full_history
\ No newline at end of file
+        Returns:
+            Relevant older exchanges followed by user_conversation
+        """
+        focus = self._named_entities(question)
+        if not focus:
+            context = self.user_contexts.get(user_id)
+            if context is None or not context.history:
+                return user_conversation
+            focus = list(context.history[-1].named_entities)
+        relevant = await get_relevant_history(user_id, focus, len(user_conversation), max_relevant)
+        return relevant + user_conversation
+
+conversation_context = ConversationContext()
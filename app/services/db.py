@@ -1,43 +1,584 @@
 """
 Database connection and operations.
 """
+import asyncio
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from sqlite3 import Connection
-from config import DB_PATH
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from config import (
+    DB_PATH,
+    DB_READERS,
+    DB_FLUSH_INTERVAL_MS,
+    DB_FLUSH_MAX_ROWS,
+    DB_FLUSH_MAX_RETRIES,
+    DB_FLUSH_RETRY_DELAY_MS,
+    HISTORY_PAGE_SIZE,
+)
+from services.history_cache import history_cache
+from services.metrics import metrics
+
+# Applied to every connection; journal_mode=WAL is persistent and set once in init_db
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",    # safe with WAL, avoids an fsync per commit
+    "PRAGMA busy_timeout = 5000",     # wait for the writer instead of failing with "database is locked"
+    "PRAGMA cache_size = -16000",     # 16 MB page cache
+    "PRAGMA temp_store = MEMORY",
+)
 
 def get_db_connection() -> Connection:
     """Creates a database connection and returns the connection object."""
-    conn = sqlite3.connect(DB_PATH)
+    # Long-lived store connections reuse compiled statements from this cache
+    conn = sqlite3.connect(DB_PATH, cached_statements=256)
     conn.row_factory = sqlite3.Row  # This allows access to columns by name
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+# --- Schema migrations ---
+# Each migration moves the schema up by one version; PRAGMA user_version
+# records the version a database file is at, so existing files are upgraded
+# in place and new ones run every step. Append new migrations, never edit old ones.
+
+def _migration_1_baseline(conn: Connection) -> None:
+    """Original schema: conversations and rolling summaries."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL
+        );
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_summarized_id INTEGER NOT NULL
+        );
+    ''')
+
+def _migration_2_conversation_metadata(conn: Connection) -> None:
+    """Per-user index plus created_at, platform and external message ID columns."""
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(conversations)')}
+    # SQLite can't ALTER TABLE ADD COLUMN with a CURRENT_TIMESTAMP default, so
+    # created_at is set on insert and stays NULL for rows written before this migration
+    for name, definition in (
+        ("created_at", "REAL"),
+        ("platform", "TEXT"),
+        ("external_message_id", "TEXT"),
+    ):
+        if name not in columns:
+            conn.execute(f'ALTER TABLE conversations ADD COLUMN {name} {definition}')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations (user_id, id)'
+    )
+
+def _migration_3_conversation_contexts(conn: Connection) -> None:
+    """Serialized ConversationContext state of users evicted from memory."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_contexts (
+            user_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    ''')
+
+def _migration_4_conversation_entities(conn: Connection) -> None:
+    """Products and attributes mentioned in each exchange, indexed for relevant-history lookups."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_entities (
+            conversation_id INTEGER NOT NULL,
+            user_id TEXT NOT NULL,
+            entity TEXT NOT NULL,
+            attributes TEXT NOT NULL DEFAULT ''
+        );
+    ''')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_conversation_entities_lookup '
+        'ON conversation_entities (user_id, entity, conversation_id)'
+    )
+
+MIGRATIONS = [
+    _migration_1_baseline,
+    _migration_2_conversation_metadata,
+    _migration_3_conversation_contexts,
+    _migration_4_conversation_entities,
+]
+
+def migrate(conn: Connection) -> int:
+    """
+    Brings the database schema up to the latest version.
+    Each migration runs in its own transaction together with the version bump.
+
+    Returns:
+        The schema version after migrating
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        conn.execute('BEGIN')
+        try:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {target}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migrated database to schema version {target} ({migration.__name__})")
+        version = target
+    return version
+
 def init_db() -> None:
-    """Creates the conversations table if it doesn't exist."""
+    """Switches the database to WAL mode and applies any pending schema migrations."""
     conn = get_db_connection()
-    with conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS conversations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                question TEXT NOT NULL,
-                answer TEXT NOT NULL
-            );
-        ''')
-
-def get_user_conversation_history(user_id: str) -> list:
-    """Retrieves conversation history for a specific user as a list of exchanges."""
-    conn = get_db_connection()
-    with conn:
+    try:
+        conn.execute('PRAGMA journal_mode = WAL')
+        migrate(conn)
+    finally:
+        conn.close()
+
+# --- Async conversation store ---
+
+class ConversationStore:
+    """
+    Async access to SQLite over long-lived connections.
+
+    Reads run on a pool of reader threads and writes on a single writer
+    thread, each thread holding its own connection for its whole life. WAL
+    lets readers proceed while the writer commits, and the sqlite3 statement
+    cache on each long-lived connection means repeated queries are compiled
+    once. Every query's latency (including time queued for a thread) is
+    recorded in /metrics as db.<name>.
+    """
+
+    def __init__(self, readers: int = DB_READERS):
+        self._local = threading.local()
+        self._reader_pool = ThreadPoolExecutor(
+            max_workers=readers, thread_name_prefix="db-reader", initializer=self._open_connection
+        )
+        self._writer_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="db-writer", initializer=self._open_connection
+        )
+
+    def _open_connection(self) -> None:
+        self._local.conn = get_db_connection()
+
+    async def _run(self, pool: ThreadPoolExecutor, name: str, func: Callable, *args):
+        submitted = time.perf_counter()
+
+        def call():
+            started = time.perf_counter()
+            try:
+                return func(self._local.conn, *args)
+            finally:
+                metrics.observe(f"db.{name}.exec", time.perf_counter() - started)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, call)
+        finally:
+            metrics.observe(f"db.{name}", time.perf_counter() - submitted)
+
+    async def read(self, name: str, func: Callable, *args):
+        """Run func(conn, *args) on a reader connection."""
+        return await self._run(self._reader_pool, name, func, *args)
+
+    async def read_after_writes(self, name: str, func: Callable, *args):
+        """
+        Run func(conn, *args) on the writer thread, so it sees every write
+        submitted before it (including write-behind flushes still in flight).
+        """
+        return await self._run(self._writer_pool, name, func, *args)
+
+    async def write(self, name: str, func: Callable, *args):
+        """Run func(conn, *args) on the writer connection inside a transaction."""
+        def in_transaction(conn, *inner_args):
+            with conn:
+                return func(conn, *inner_args)
+        return await self._run(self._writer_pool, name, in_transaction, *args)
+
+    def close(self) -> None:
+        """Stop the worker threads after pending queries finish."""
+        self._reader_pool.shutdown(wait=True)
+        self._writer_pool.shutdown(wait=True)
+
+
+conversation_store = ConversationStore()
+
+
+class ConversationWriteBuffer:
+    """
+    Write-behind buffer for conversation rows.
+
+    save_conversation hands rows to this buffer and returns at once; rows are
+    inserted in one transaction per flush, every DB_FLUSH_INTERVAL_MS or as
+    soon as DB_FLUSH_MAX_ROWS are waiting, so peak traffic costs one commit
+    per batch instead of one per message. The buffer tracks which users have
+    rows not yet committed so their reads can include them.
+
+    A batch whose flush fails goes back to the front of the buffer, where
+    reads still see it, and is retried with a doubling delay; rows are only
+    dropped after DB_FLUSH_MAX_RETRIES failed retries. Each row's future
+    resolves with its id once committed (None if it was dropped).
+    """
+
+    def __init__(self, store: ConversationStore, flush_interval_ms: float = DB_FLUSH_INTERVAL_MS,
+                 max_rows: int = DB_FLUSH_MAX_ROWS, max_retries: int = DB_FLUSH_MAX_RETRIES,
+                 retry_delay_ms: float = DB_FLUSH_RETRY_DELAY_MS):
+        self.store = store
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay_ms / 1000
+        # (row, failed flushes so far, future for its id), oldest first
+        self._pending: List[Tuple[tuple, int, asyncio.Future]] = []
+        # Rows per user that are pending or being flushed
+        self._buffered: Dict[str, int] = defaultdict(int)
+        self._flush_handle = None
+        self._flushes: Set[asyncio.Task] = set()
+        self.dropped_rows = 0
+
+        metrics.register_gauge("db.write_behind.pending", lambda: len(self._pending))
+
+    def add(self, row: tuple) -> asyncio.Future:
+        """
+        Queue a (user_id, question, answer, created_at, platform, external_message_id, entities) row.
+
+        Returns:
+            Future resolving to the row's id once committed, or None if it was dropped
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, 0, future))
+        self._buffered[row[0]] += 1
+        if len(self._pending) >= self.max_rows:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+        return future
+
+    def has_buffered(self, user_id: str) -> bool:
+        """True if the user has rows that may not be committed yet."""
+        return user_id in self._buffered
+
+    def pending_for(self, user_id: str) -> list:
+        """Rows for the user that have not been handed to the writer yet, oldest first."""
+        return [row for row, _, _ in self._pending if row[0] == user_id]
+
+    def _start_flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._write(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    def _retry_delay_for(self, failures: int) -> float:
+        return self.retry_delay * 2 ** (failures - 1)
+
+    async def _write(self, batch: List[Tuple[tuple, int, asyncio.Future]]) -> None:
+        rows = [row for row, _, _ in batch]
+        try:
+            ids = await self.store.write("flush_conversations", _insert_conversations, rows)
+            metrics.observe("db.write_behind.batch_size", len(rows))
+            done = list(zip(batch, ids))
+        except Exception as e:
+            retry = [(row, failures + 1, future) for row, failures, future in batch if failures < self.max_retries]
+            done = [(entry, None) for entry in batch if entry[1] >= self.max_retries]
+            if retry:
+                # Back in front of anything added since, so rows still commit in order
+                self._pending[:0] = retry
+                delay = self._retry_delay_for(max(failures for _, failures, _ in retry))
+                metrics.increment("db.write_behind.retried_rows", len(retry))
+                print(f"Error flushing {len(rows)} conversation rows, retrying in {delay:.1f}s: {e}")
+                if self._flush_handle is not None:
+                    self._flush_handle.cancel()
+                self._flush_handle = asyncio.get_running_loop().call_later(delay, self._start_flush)
+            if done:
+                self.dropped_rows += len(done)
+                metrics.increment("db.write_behind.dropped_rows", len(done))
+                print(f"Dropped {len(done)} conversation rows after {self.max_retries} retries: {e}")
+        for (row, _, future), row_id in done:
+            self._buffered[row[0]] -= 1
+            if self._buffered[row[0]] <= 0:
+                del self._buffered[row[0]]
+            if not future.done():
+                future.set_result(row_id)
+
+    async def flush(self) -> None:
+        """
+        Write everything buffered so far and wait for it to commit, retrying
+        failed batches with the usual backoff.
+
+        Raises:
+            RuntimeError: If rows had to be dropped because they could not be written
+        """
+        dropped = self.dropped_rows
+        while True:
+            self._start_flush()
+            if self._flushes:
+                await asyncio.gather(*list(self._flushes), return_exceptions=True)
+            if not self._pending:
+                break
+            # A batch failed and was put back; wait out its backoff
+            await asyncio.sleep(self._retry_delay_for(max(failures for _, failures, _ in self._pending)))
+        if self.dropped_rows > dropped:
+            raise RuntimeError(f"{self.dropped_rows - dropped} conversation rows could not be written")
+
+
+conversation_buffer = ConversationWriteBuffer(conversation_store)
+
+# --- Queries (run on a store connection) ---
+
+def _select_history(conn: Connection, user_id: str, limit: Optional[int]) -> list:
+    if limit is None:
         user_conversation = conn.execute(
-            'SELECT question, answer FROM conversations WHERE user_id = ? ORDER BY id', 
+            'SELECT question, answer FROM conversations WHERE user_id = ? ORDER BY id',
             (user_id,)
         ).fetchall()
-        return [{"question": row['question'], "answer": row['answer']} for row in user_conversation]
-
-def save_conversation(user_id: str, question: str, answer: str) -> None:
-    """Saves a conversation entry to the database."""
-    with get_db_connection() as conn:
-        conn.execute(
-            'INSERT INTO conversations (user_id, question, answer) VALUES (?, ?, ?)',
-            (user_id, question, answer)
-        )
\ No newline at end of file
+    else:
+        user_conversation = conn.execute(
+            'SELECT question, answer FROM conversations WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+            (user_id, limit)
+        ).fetchall()[::-1]
+    return [{"question": row['question'], "answer": row['answer']} for row in user_conversation]
+
+def _insert_conversations(conn: Connection, rows: list) -> List[int]:
+    ids = []
+    entity_rows = []
+    for row in rows:
+        cursor = conn.execute(
+            'INSERT INTO conversations (user_id, question, answer, created_at, platform, external_message_id) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            row[:6]
+        )
+        ids.append(cursor.lastrowid)
+        entity_rows.extend(
+            (cursor.lastrowid, row[0], entity, attributes) for entity, attributes in row[6]
+        )
+    conn.executemany(
+        'INSERT INTO conversation_entities (conversation_id, user_id, entity, attributes) VALUES (?, ?, ?, ?)',
+        entity_rows
+    )
+    return ids
+
+def _select_history_page(conn: Connection, user_id: str, before: Optional[int], limit: int) -> dict:
+    if before is None:
+        rows = conn.execute(
+            'SELECT id, question, answer FROM conversations WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+            (user_id, limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            'SELECT id, question, answer FROM conversations WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+            (user_id, before, limit + 1)
+        ).fetchall()
+    latest = conn.execute('SELECT MAX(id) FROM conversations WHERE user_id = ?', (user_id,)).fetchone()[0]
+    page = rows[:limit][::-1]
+    return {
+        "history": [{"seq": row['id'], "question": row['question'], "answer": row['answer']} for row in page],
+        # One extra row was read to tell whether an older page exists
+        "next_cursor": page[0]['id'] if len(rows) > limit else None,
+        "seq": latest,
+    }
+
+def _select_relevant_history(conn: Connection, user_id: str, entities: list, skip_recent: int, limit: int) -> list:
+    placeholders = ", ".join("?" for _ in entities)
+    if skip_recent <= 0:
+        rows = conn.execute(f'''
+            SELECT DISTINCT c.id, c.question, c.answer
+            FROM conversation_entities e JOIN conversations c ON c.id = e.conversation_id
+            WHERE e.user_id = ? AND e.entity IN ({placeholders})
+            ORDER BY c.id DESC LIMIT ?
+        ''', (user_id, *entities, limit)).fetchall()[::-1]
+        return [{"question": row['question'], "answer": row['answer']} for row in rows]
+    rows = conn.execute(f'''
+        SELECT DISTINCT c.id, c.question, c.answer
+        FROM conversation_entities e JOIN conversations c ON c.id = e.conversation_id
+        WHERE e.user_id = ? AND e.entity IN ({placeholders}) AND e.conversation_id < (
+            SELECT MIN(id) FROM (
+                SELECT id FROM conversations WHERE user_id = ? ORDER BY id DESC LIMIT ?
+            )
+        )
+        ORDER BY c.id DESC LIMIT ?
+    ''', (user_id, *entities, user_id, skip_recent, limit)).fetchall()[::-1]
+    return [{"question": row['question'], "answer": row['answer']} for row in rows]
+
+def _select_summary(conn: Connection, user_id: str) -> Optional[dict]:
+    row = conn.execute(
+        'SELECT summary, last_summarized_id FROM conversation_summaries WHERE user_id = ?',
+        (user_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {"summary": row['summary'], "last_summarized_id": row['last_summarized_id']}
+
+def _select_turns_to_summarize(conn: Connection, user_id: str, after_id: int, keep_recent: int) -> list:
+    rows = conn.execute('''
+        SELECT id, question, answer FROM conversations
+        WHERE user_id = ? AND id > ? AND id < (
+            SELECT MIN(id) FROM (
+                SELECT id FROM conversations WHERE user_id = ? ORDER BY id DESC LIMIT ?
+            )
+        )
+        ORDER BY id
+    ''', (user_id, after_id, user_id, keep_recent)).fetchall()
+    return [{"id": row['id'], "question": row['question'], "answer": row['answer']} for row in rows]
+
+def _upsert_summary(conn: Connection, user_id: str, summary: str, last_summarized_id: int) -> None:
+    conn.execute(
+        'INSERT OR REPLACE INTO conversation_summaries (user_id, summary, last_summarized_id) VALUES (?, ?, ?)',
+        (user_id, summary, last_summarized_id)
+    )
+
+def _select_context_state(conn: Connection, user_id: str) -> Optional[str]:
+    row = conn.execute(
+        'SELECT state FROM conversation_contexts WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return row['state'] if row else None
+
+def _upsert_context_states(conn: Connection, rows: list) -> None:
+    conn.executemany(
+        'INSERT INTO conversation_contexts (user_id, state, updated_at) VALUES (?, ?, ?) '
+        'ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at',
+        rows
+    )
+
+# --- Public async API ---
+
+async def get_user_conversation_history(user_id: str, limit: Optional[int] = None) -> list:
+    """
+    Retrieves conversation history for a specific user as a list of exchanges, oldest first.
+    With a limit, only the most recent `limit` exchanges are read.
+    Served from the history cache when possible; otherwise includes the user's
+    own writes that are still in the write-behind buffer.
+    """
+    cached = history_cache.get(user_id, limit)
+    if cached is not None:
+        return cached
+
+    history_cache.begin_load(user_id)
+    if not conversation_buffer.has_buffered(user_id):
+        history = await conversation_store.read("get_history", _select_history, user_id, limit)
+    else:
+        # Rows already handed to the writer are committed before this query runs on
+        # the writer thread; rows still pending are added from the buffer.
+        pending = [{"question": row[1], "answer": row[2]} for row in conversation_buffer.pending_for(user_id)]
+        committed = await conversation_store.read_after_writes("get_history", _select_history, user_id, limit)
+        history = committed + pending
+        if limit is not None:
+            history = history[-limit:]
+    history_cache.finish_load(user_id, history, limit)
+    return list(history)
+
+async def get_history_page(user_id: str, before: Optional[int] = None, limit: int = HISTORY_PAGE_SIZE) -> dict:
+    """
+    One page of a user's history, paged in SQL by row id.
+
+    Exchanges are numbered by `seq`, their row id, which is also what
+    save_conversation's future resolves to for new exchanges. The user's
+    rows still in the write-behind buffer are committed first so they can
+    be numbered.
+
+    Args:
+        user_id: User whose history to read
+        before: Return exchanges with seq lower than this (None for the latest page)
+        limit: Page size
+
+    Returns:
+        {"history": [{"seq", "question", "answer"}] oldest first, "next_cursor":
+        seq to pass as `before` for the previous page or None, "seq": seq of
+        the user's latest exchange or None}
+    """
+    if conversation_buffer.has_buffered(user_id):
+        try:
+            await conversation_buffer.flush()
+        except RuntimeError as e:
+            print(f"Reading history page for {user_id} without unwritten rows: {e}")
+    return await conversation_store.read("get_history_page", _select_history_page, user_id, before, limit)
+
+async def save_conversation(user_id: str, question: str, answer: str,
+                            platform: Optional[str] = None, external_message_id: Optional[str] = None,
+                            entities: Optional[list] = None) -> asyncio.Future:
+    """
+    Saves a conversation entry to the database.
+    The row is buffered and committed with the next write-behind flush, and
+    written through to the history cache.
+
+    Args:
+        user_id: User the exchange belongs to
+        question: The user's message
+        answer: The reply that was sent
+        platform: Channel the message came from ("websocket", "whatsapp", "facebook")
+        external_message_id: The platform's ID for the incoming message, if any
+        entities: (entity, attributes) pairs mentioned in the exchange, see
+            ConversationContext.exchange_entities; stored for get_relevant_history
+
+    Returns:
+        Future resolving to the row's id once committed (None if it could not
+        be written); callers that don't need the id can ignore it
+    """
+    saved = conversation_buffer.add((user_id, question, answer, time.time(), platform, external_message_id, entities or ()))
+    history_cache.append(user_id, {"question": question, "answer": answer})
+    metrics.increment("db.save_conversation")
+    return saved
+
+async def get_relevant_history(user_id: str, entities: list, skip_recent: int, limit: int) -> list:
+    """
+    Older exchanges that mention any of the given entities, found through the
+    conversation_entities index rather than by scanning the user's history.
+
+    Args:
+        user_id: User whose history to search
+        entities: Entities in focus (canonical product IDs or names)
+        skip_recent: The user's most recent exchanges to leave out, since the
+            prompt already carries them; counts rows still in the write-behind
+            buffer, and 0 leaves nothing out
+        limit: Maximum exchanges to return (the most recent matches)
+
+    Returns:
+        Matching exchanges [{"question", "answer"}], oldest first
+    """
+    if not entities or limit <= 0:
+        return []
+    if not conversation_buffer.has_buffered(user_id):
+        return await conversation_store.read(
+            "get_relevant_history", _select_relevant_history, user_id, list(entities), skip_recent, limit
+        )
+    # The newest exchanges of the prompt window may still be in the buffer rather
+    # than the table, so the window covers that many fewer committed rows. Rows
+    # already handed to the writer are committed before this query runs on the writer thread.
+    skip_committed = skip_recent - len(conversation_buffer.pending_for(user_id))
+    return await conversation_store.read_after_writes(
+        "get_relevant_history", _select_relevant_history, user_id, list(entities), skip_committed, limit
+    )
+
+async def get_conversation_summary(user_id: str) -> Optional[dict]:
+    """Returns {"summary", "last_summarized_id"} for a user, or None if nothing was summarized yet."""
+    return await conversation_store.read("get_summary", _select_summary, user_id)
+
+async def get_turns_to_summarize(user_id: str, after_id: int, keep_recent: int) -> list:
+    """
+    Returns exchanges newer than `after_id` that have aged out of the active
+    window, i.e. everything except the user's `keep_recent` most recent turns.
+    """
+    return await conversation_store.read(
+        "get_turns_to_summarize", _select_turns_to_summarize, user_id, after_id, keep_recent
+    )
+
+async def save_conversation_summary(user_id: str, summary: str, last_summarized_id: int) -> None:
+    """Stores (or replaces) the rolling summary for a user."""
+    await conversation_store.write("save_summary", _upsert_summary, user_id, summary, last_summarized_id)
+
+async def get_conversation_context_state(user_id: str) -> Optional[str]:
+    """Returns the serialized conversation context stored for a user, if any."""
+    return await conversation_store.read("get_context_state", _select_context_state, user_id)
+
+async def save_conversation_context_states(rows: list) -> None:
+    """Stores (or replaces) serialized conversation contexts, given as (user_id, state, updated_at) rows."""
+    await conversation_store.write("save_context_states", _upsert_context_states, rows)
@@ -3,11 +3,157 @@ Service for generating embeddings.
 """
 # Import the actual implementation from your getembeddings module
 
-from openai import OpenAI
-from config import LLM_API_KEY
+import asyncio
+from typing import Dict, List, Tuple
+from openai import OpenAI, AsyncOpenAI
+from config import (
+    LLM_API_KEY,
+    EMBEDDING_MODEL,
+    EMBEDDING_BATCH_MAX_SIZE,
+    EMBEDDING_BATCH_MAX_WAIT_MS,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MEMORY_SIZE,
+    EMBEDDING_CACHE_MAX_ROWS,
+    EMBEDDING_CACHE_TTL_DAYS,
+)
+from services.embedding_cache import EmbeddingCache
+from services.metrics import metrics
 
 open_client = OpenAI(api_key=LLM_API_KEY)
-def get_embedding(text, model="text-embedding-3-small"):
+async_open_client = AsyncOpenAI(api_key=LLM_API_KEY)
+embedding_cache = EmbeddingCache(
+    EMBEDDING_CACHE_PATH,
+    memory_size=EMBEDDING_CACHE_MEMORY_SIZE,
+    max_rows=EMBEDDING_CACHE_MAX_ROWS,
+    ttl_seconds=EMBEDDING_CACHE_TTL_DAYS * 24 * 3600,
+)
+
+
+def is_client_error(error: Exception) -> bool:
+    """True for 4xx API errors other than 429, which retrying the same request cannot fix."""
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and 400 <= status_code < 500 and status_code != 429
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent embedding requests into batched API calls.
+
+    The first request in an empty window starts a short timer; every request
+    that arrives before it fires (or before the batch is full) is sent in the
+    same embeddings.create call, and each caller gets its own vector back.
+    If the API rejects the batch as a bad request, its texts are re-sent one
+    by one so only the callers with the offending input get the error.
+    """
+
+    def __init__(self, model: str = EMBEDDING_MODEL,
+                 max_batch_size: int = EMBEDDING_BATCH_MAX_SIZE,
+                 max_wait_ms: float = EMBEDDING_BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle = None
+        self._tasks = set()
+
+        self.requests = 0
+        self.batches = 0
+        self.api_inputs = 0
+        self.split_batches = 0
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        Queue a text for the next batch and wait for its vector.
+
+        Args:
+            text: The text to embed
+
+        Returns:
+            The embedding vector
+
+        Raises:
+            ValueError: If the text is empty, which the API would reject
+        """
+        if not text or not text.strip():
+            raise ValueError("Cannot embed empty text")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.requests += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        """Hand the pending batch to a send task and reset the window."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        """Embed a batch in one call and resolve every waiting future."""
+        # Identical texts in the same window only need to be embedded once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            outcomes = await self._create(texts)
+        except Exception as e:
+            if len(texts) > 1 and is_client_error(e):
+                # One bad input fails the whole request; find out whose it is
+                self.split_batches += 1
+                results = await asyncio.gather(*(self._create([text]) for text in texts), return_exceptions=True)
+                outcomes = {
+                    text: result if isinstance(result, BaseException) else result[text]
+                    for text, result in zip(texts, results)
+                }
+            else:
+                outcomes = {text: e for text in texts}
+
+        for text, future in batch:
+            if future.done():
+                continue
+            outcome = outcomes[text]
+            if isinstance(outcome, BaseException):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+    async def _create(self, texts: List[str]) -> Dict[str, List[float]]:
+        """One embeddings.create call; returns text -> vector."""
+        self.batches += 1
+        self.api_inputs += len(texts)
+        response = await async_open_client.embeddings.create(
+            input=texts,
+            model=self.model
+        )
+        return {texts[item.index]: item.embedding for item in response.data}
+
+    def stats(self) -> Dict[str, float]:
+        """Return request and batch counters."""
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "api_inputs": self.api_inputs,
+            "split_batches": self.split_batches,
+            "avg_batch_size": self.api_inputs / self.batches if self.batches else 0.0,
+        }
+
+
+embedding_batcher = EmbeddingBatcher()
+
+metrics.register_gauge("embedding.cache", embedding_cache.stats)
+metrics.register_gauge("embedding.batcher", embedding_batcher.stats)
+
+def get_embedding(text, model=EMBEDDING_MODEL):
     """
     Given a piece of text, this function calls OpenAI's embeddings.create endpoint
     using the new recommended API, and returns the embedding vector.
@@ -18,14 +164,50 @@ def get_embedding(text, model="text-embedding-3-small"):
     )
     return response.data[0].embedding
 
+async def aget_embedding(text, model=EMBEDDING_MODEL):
+    """
+    Async counterpart of get_embedding. Uses the AsyncOpenAI client so the
+    request never blocks the event loop.
+    """
+    response = await async_open_client.embeddings.create(
+        input=text,
+        model=model
+    )
+    return response.data[0].embedding
+
 def generate_embedding(text: str) -> list:
     """
     Generates an embedding vector for the provided text.
-    
+    Repeated questions are served from the embedding cache.
+
     Args:
         text: The text to embed
-        
+
+    Returns:
+        A list representing the embedding vector
+    """
+    cached = embedding_cache.get(EMBEDDING_MODEL, text)
+    if cached is not None:
+        return cached
+    embedding = get_embedding(text)
+    embedding_cache.put(EMBEDDING_MODEL, text, embedding)
+    return embedding
+
+async def agenerate_embedding(text: str) -> list:
+    """
+    Generates an embedding vector for the provided text without blocking the event loop.
+    Repeated questions are served from the embedding cache; misses go through
+    the batcher so concurrent callers share one API request.
+
+    Args:
+        text: The text to embed
+
     Returns:
         A list representing the embedding vector
     """
-    return get_embedding(text)
\ No newline at end of file
+    cached = await embedding_cache.aget(EMBEDDING_MODEL, text)
+    if cached is not None:
+        return cached
+    embedding = await embedding_batcher.embed(text)
+    await embedding_cache.aput(EMBEDDING_MODEL, text, embedding)
+    return embedding
@@ -0,0 +1,187 @@
+"""
+Two-tier cache for query embeddings.
+
+Tier 1 is a bounded in-process LRU, tier 2 is a SQLite file that survives
+restarts. Entries are keyed by embedding model plus a hash of the normalized
+text, so "How long does the battery last?" and "how long does the battery
+last" share one vector.
+"""
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip("?!. ")
+
+
+def make_cache_key(model: str, text: str) -> str:
+    """Build the cache key for a model/text pair."""
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+class EmbeddingCache:
+    """In-memory LRU in front of a persistent SQLite embedding store."""
+
+    # Run disk eviction once every this many inserts instead of on every write
+    EVICT_EVERY = 200
+
+    def __init__(self, path: str, memory_size: int = 2048,
+                 max_rows: int = 50000, ttl_seconds: float = 30 * 24 * 3600):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self.ttl_seconds = ttl_seconds
+
+        # key -> (vector, created_at); created_at is carried over from disk so the TTL covers both tiers
+        self._memory: "OrderedDict[str, Tuple[List[float], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts_since_evict = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                );
+            ''')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)'
+            )
+
+    def _remember(self, key: str, vector: List[float], created_at: float) -> None:
+        """Insert into the LRU tier, evicting the least recently used entry if full."""
+        self._memory[key] = (vector, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _get_memory(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            vector, created_at = entry
+            if time.time() - created_at > self.ttl_seconds:
+                # Expired; the disk row is just as old, so this is a miss
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return vector
+
+    def _get_disk(self, key: str) -> Optional[List[float]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT vector, created_at FROM embeddings WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE embeddings SET last_used = ? WHERE key = ?', (now, key)
+                )
+            vector = array("f", row[0]).tolist()
+            self._remember(key, vector, row[1])
+            self.disk_hits += 1
+            return vector
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """
+        Look up a cached embedding.
+
+        Args:
+            model: Embedding model name
+            text: Text that was embedded
+
+        Returns:
+            The cached vector, or None on a miss
+        """
+        key = make_cache_key(model, text)
+        vector = self._get_memory(key)
+        if vector is not None:
+            return vector
+        return self._get_disk(key)
+
+    def put(self, model: str, text: str, vector: List[float]) -> None:
+        """
+        Store an embedding in both tiers.
+
+        Args:
+            model: Embedding model name
+            text: Text that was embedded
+            vector: The embedding vector
+        """
+        key = make_cache_key(model, text)
+        now = time.time()
+        with self._lock:
+            self._remember(key, vector, now)
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO embeddings (key, vector, created_at, last_used) '
+                    'VALUES (?, ?, ?, ?)',
+                    (key, array("f", vector).tobytes(), now, now)
+                )
+            self._inserts_since_evict += 1
+            if self._inserts_since_evict >= self.EVICT_EVERY:
+                self._inserts_since_evict = 0
+                self._evict_disk(now)
+
+    def _evict_disk(self, now: float) -> None:
+        """Drop expired rows, then the least recently used rows above max_rows."""
+        with self._conn:
+            self._conn.execute(
+                'DELETE FROM embeddings WHERE created_at < ?', (now - self.ttl_seconds,)
+            )
+            self._conn.execute('''
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_rows,))
+
+    async def aget(self, model: str, text: str) -> Optional[List[float]]:
+        """Async lookup: memory hits return inline, disk reads run in a worker thread."""
+        key = make_cache_key(model, text)
+        vector = self._get_memory(key)
+        if vector is not None:
+            return vector
+        return await asyncio.to_thread(self._get_disk, key)
+
+    async def aput(self, model: str, text: str, vector: List[float]) -> None:
+        """Async store: the SQLite write runs in a worker thread."""
+        await asyncio.to_thread(self.put, model, text, vector)
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and tier sizes."""
+        with self._lock:
+            disk_rows = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            memory_rows = len(self._memory)
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": memory_rows,
+            "disk_entries": disk_rows,
+        }
@@ -0,0 +1,231 @@
+"""
+Product entity index derived from the Shopify catalog.
+
+rebuild_vector_db writes a small JSON dictionary of product names next to the
+Chroma data, one file per collection version like the lexical index: each
+product's handle (its canonical ID) with its title, handle words and model
+codes as aliases. The dictionary is compiled into one Aho-Corasick automaton,
+so finding every product mentioned in a message is a single pass over the
+text however many products there are. The file of the active version is
+loaded when that version changes (rebuild or rollback) or its file is
+rewritten (sync).
+"""
+import json
+import os
+import re
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from config import ENTITY_INDEX_DIR
+from services.collection_registry import collection_registry
+
+# Model codes inside titles, e.g. "OV-200", "S10", "200Wh"
+MODEL_CODE_PATTERN = re.compile(r"\b(?=[A-Za-z0-9-]*\d)(?=[A-Za-z0-9-]*[A-Za-z])[A-Za-z0-9]+(?:-[A-Za-z0-9]+)*\b")
+# Ratings like "12V", "100W", "200Wh" or "12V-100Ah": specs many products share, not model names
+UNIT_CODE_PATTERN = re.compile(r"^(?:\d+(?:v|w|wh|ah|kw|kwh|mah)(?:[-_/]|$))+$", re.IGNORECASE)
+# Aliases shorter than this match too much ordinary text
+MIN_ALIAS_LENGTH = 3
+
+
+def normalize(text: str) -> str:
+    """Lowercase and reduce everything but letters and digits to single spaces."""
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", text.lower()).split())
+
+
+def is_unit_code(code: str) -> bool:
+    """True if a model-code-shaped token is only a rating ("12V", "200Wh")."""
+    return bool(UNIT_CODE_PATTERN.match(code))
+
+
+def product_aliases(title: str, handle: str) -> List[str]:
+    """
+    Names a customer might use for a product: title, handle words and model
+    codes, each code also written without separators ("OV-200" and "ov200").
+    Ratings such as "100W" are not aliases on their own.
+    """
+    aliases = [title, handle.replace("-", " ")]
+    for code in MODEL_CODE_PATTERN.findall(title):
+        if is_unit_code(code):
+            continue
+        aliases.extend([code, re.sub(r"[^0-9A-Za-z]+", "", code)])
+    normalized = []
+    for alias in aliases:
+        alias = normalize(alias)
+        if len(alias) >= MIN_ALIAS_LENGTH and alias not in normalized:
+            normalized.append(alias)
+    return normalized
+
+
+def build_entity_dictionary(products: List[Tuple[str, str]]) -> Dict[str, dict]:
+    """
+    Build the entity dictionary for a catalog.
+
+    Args:
+        products: (handle, title) pairs
+
+    Returns:
+        {handle: {"name": title, "aliases": [...]}}; aliases shared by more
+        than one product are dropped, since they cannot identify either
+    """
+    entities = {handle: {"name": title, "aliases": product_aliases(title, handle)} for handle, title in products}
+    owners: Dict[str, set] = {}
+    for handle, entity in entities.items():
+        for alias in entity["aliases"]:
+            owners.setdefault(alias, set()).add(handle)
+    for entity in entities.values():
+        entity["aliases"] = [alias for alias in entity["aliases"] if len(owners[alias]) == 1]
+    return entities
+
+
+def index_path(version: str, directory: str = ENTITY_INDEX_DIR) -> str:
+    """File holding the dictionary of a collection version."""
+    return os.path.join(directory, f"{version}.json")
+
+
+def write_entity_index(entities: Dict[str, dict], version: str, directory: str = ENTITY_INDEX_DIR) -> None:
+    """Write the dictionary atomically (temp file, then rename) so readers never see a partial file."""
+    path = index_path(version, directory)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "entities": entities}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def delete_entity_index(version: str, directory: str = ENTITY_INDEX_DIR) -> None:
+    """Remove the dictionary of a collection version that was pruned."""
+    try:
+        os.remove(index_path(version, directory))
+    except FileNotFoundError:
+        pass
+
+
+class EntityMatcher:
+    """Aho-Corasick automaton over normalized aliases."""
+
+    def __init__(self, aliases: Dict[str, str]):
+        """
+        Args:
+            aliases: normalized alias -> canonical ID
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Per state: (alias length, canonical ID) for every alias ending there
+        self._output: List[List[Tuple[int, str]]] = [[]]
+        for alias, entity_id in aliases.items():
+            self._add(alias, entity_id)
+        self._link()
+
+    def _add(self, alias: str, entity_id: str) -> None:
+        state = 0
+        for char in alias:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(alias), entity_id))
+
+    def _link(self) -> None:
+        """Breadth-first pass computing failure links and merged outputs."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> List[str]:
+        """
+        Canonical IDs of the products mentioned in text, in order of first mention.
+        Matches must cover whole words; overlapping matches keep the leftmost
+        longest one.
+        """
+        text = normalize(text)
+        matches = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, entity_id in self._output[state]:
+                start = position - length + 1
+                end = position + 1
+                if (start == 0 or text[start - 1] == " ") and (end == len(text) or text[end] == " "):
+                    matches.append((start, -length, entity_id))
+
+        found = []
+        covered_until = -1
+        for start, negative_length, entity_id in sorted(matches):
+            if start < covered_until:
+                continue
+            covered_until = start - negative_length
+            if entity_id not in found:
+                found.append(entity_id)
+        return found
+
+
+class EntityIndex:
+    """The matcher for the active collection version, reloaded when the version or its file changes."""
+
+    def __init__(self, directory: str = ENTITY_INDEX_DIR, registry=collection_registry):
+        self.directory = directory
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._matcher: Optional[EntityMatcher] = None
+        self._names: Dict[str, str] = {}
+        self.version: Optional[str] = None
+
+    def _reload(self) -> None:
+        version = self.registry.active()
+        path = index_path(version, self.directory)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            # The version predates entity matching; don't keep matching another version's catalog
+            with self._lock:
+                self._matcher = None
+                self._names = {}
+                self.version = None
+                self._mtime = None
+            return
+        if version == self.version and mtime == self._mtime:
+            return
+        with self._lock:
+            if version == self.version and mtime == self._mtime:
+                return
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            entities = data.get("entities", {})
+            aliases = {alias: entity_id for entity_id, entity in entities.items() for alias in entity["aliases"]}
+            self._matcher = EntityMatcher(aliases)
+            self._names = {entity_id: entity["name"] for entity_id, entity in entities.items()}
+            self.version = version
+            self._mtime = mtime
+        print(f"Loaded entity index {self.version} with {len(self._names)} products")
+
+    @property
+    def available(self) -> bool:
+        """True once a rebuild has produced an index for the active version."""
+        self._reload()
+        return self._matcher is not None
+
+    def find(self, text: str) -> List[str]:
+        """Canonical product IDs mentioned in text (empty if there is no index yet)."""
+        self._reload()
+        return self._matcher.find(text) if self._matcher is not None else []
+
+    def name(self, entity_id: str) -> str:
+        """Display name for a canonical product ID."""
+        return self._names.get(entity_id, entity_id)
+
+
+entity_index = EntityIndex()
@@ -0,0 +1,45 @@
+"""
+Token-budgeted conversation history for LLM prompts.
+"""
+from litellm import token_counter
+from config import LLM_MODEL, PROMPT_TOKEN_BUDGET
+
+# Per-message overhead of the chat format (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens for the configured LLM with the local tokenizer."""
+    if not text:
+        return 0
+    return token_counter(model=LLM_MODEL, text=text)
+
+
+def fit_history_to_budget(user_conversation: list, system_prompt: str, question: str,
+                          budget: int = PROMPT_TOKEN_BUDGET) -> list:
+    """
+    Pick the most recent exchanges that fit in the prompt token budget.
+
+    The system prompt (including retrieved documents) and the current question
+    are always sent; history fills whatever budget is left, newest first.
+
+    Args:
+        user_conversation: Previous Q&A exchanges, oldest first
+        system_prompt: The system prompt that will be sent
+        question: The current user question
+        budget: Total token budget for the prompt
+
+    Returns:
+        The exchanges to include, oldest first
+    """
+    used = (count_tokens(system_prompt) + count_tokens(question)
+            + 2 * MESSAGE_OVERHEAD_TOKENS)
+    selected = []
+    for exchange in reversed(user_conversation):
+        cost = (count_tokens(exchange['question']) + count_tokens(exchange['answer'])
+                + 2 * MESSAGE_OVERHEAD_TOKENS)
+        if used + cost > budget:
+            break
+        selected.append(exchange)
+        used += cost
+    return selected[::-1]
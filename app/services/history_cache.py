@@ -0,0 +1,135 @@
+"""
+In-memory cache of recent conversation history per user.
+
+Sits in front of the conversations table so users who are actively chatting
+are served from memory: entries are filled on the first read, kept current
+by write-through from save_conversation, and evicted least-recently-used
+once the memory cap is reached or after HISTORY_CACHE_TTL_SECONDS idle.
+"""
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from config import HISTORY_CACHE_MAX_BYTES, HISTORY_CACHE_TTL_SECONDS
+from services.metrics import metrics
+
+# Rough per-exchange overhead of the dict and list slot on top of the text itself
+EXCHANGE_OVERHEAD_BYTES = 300
+
+
+def exchange_size(exchange: dict) -> int:
+    """Approximate memory used by one cached exchange."""
+    return len(exchange["question"]) + len(exchange["answer"]) + EXCHANGE_OVERHEAD_BYTES
+
+
+class HistoryEntry:
+    """Cached tail of one user's history."""
+
+    __slots__ = ("exchanges", "complete", "size", "last_used")
+
+    def __init__(self, exchanges: List[dict], complete: bool):
+        self.exchanges = exchanges
+        # True if `exchanges` is the user's whole history, not only the most recent turns
+        self.complete = complete
+        self.size = sum(exchange_size(e) for e in exchanges)
+        self.last_used = time.monotonic()
+
+
+class HistoryCache:
+    """LRU/TTL cache of conversation history, bounded by approximate memory use."""
+
+    def __init__(self, max_bytes: int = HISTORY_CACHE_MAX_BYTES, ttl_seconds: float = HISTORY_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self._entries: "OrderedDict[str, HistoryEntry]" = OrderedDict()
+        self._size = 0
+        # Users being loaded from the DB -> whether a write arrived during the load
+        self._loading: Dict[str, bool] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        metrics.register_gauge("history_cache", self.stats)
+
+    def get(self, user_id: str, limit: Optional[int] = None) -> Optional[List[dict]]:
+        """
+        Cached history for a user, or None if it has to be read from the DB.
+
+        Args:
+            user_id: User to look up
+            limit: Number of most recent exchanges wanted, None for all of them
+        """
+        entry = self._entries.get(user_id)
+        now = time.monotonic()
+        if entry is not None and now - entry.last_used > self.ttl:
+            self._remove(user_id)
+            entry = None
+        if entry is None or not (entry.complete or (limit is not None and limit <= len(entry.exchanges))):
+            self.misses += 1
+            metrics.increment("history_cache.miss")
+            return None
+
+        entry.last_used = now
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        metrics.increment("history_cache.hit")
+        return entry.exchanges[-limit:] if limit is not None else list(entry.exchanges)
+
+    def begin_load(self, user_id: str) -> None:
+        """Mark a DB read for the user as started, so writes during it can be detected."""
+        self._loading.setdefault(user_id, False)
+
+    def finish_load(self, user_id: str, exchanges: List[dict], limit: Optional[int]) -> None:
+        """
+        Store history read from the DB, unless the user wrote while it was loading
+        (the result may then be missing that exchange).
+        """
+        if self._loading.pop(user_id, True):
+            return
+        self._remove(user_id)
+        entry = HistoryEntry(list(exchanges), complete=limit is None or len(exchanges) < limit)
+        self._entries[user_id] = entry
+        self._size += entry.size
+        self._evict()
+
+    def append(self, user_id: str, exchange: dict) -> None:
+        """Write-through for a newly saved exchange."""
+        if user_id in self._loading:
+            self._loading[user_id] = True
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        entry.exchanges.append(exchange)
+        size = exchange_size(exchange)
+        entry.size += size
+        self._size += size
+        entry.last_used = time.monotonic()
+        self._entries.move_to_end(user_id)
+        self._evict()
+
+    def _remove(self, user_id: str) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if self._size <= self.max_bytes and now - entry.last_used <= self.ttl:
+                break
+            self._remove(user_id)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._entries),
+            "approx_bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+history_cache = HistoryCache()
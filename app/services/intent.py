@@ -0,0 +1,207 @@
+"""
+Local pricing-intent classifier.
+
+Scores a question with keyword/regex rules and a nearest-neighbour vote over
+embeddings of labelled example questions. The scoring itself is pure
+in-process arithmetic; callers fall back to the LLM check only when the
+confidence is below PRICING_CLASSIFIER_MIN_CONFIDENCE. Without the
+nearest-neighbour vote only a strong rule match is trusted.
+"""
+import asyncio
+import re
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import numpy as np
+from config import PRICING_CLASSIFIER_MIN_CONFIDENCE
+from services.embedding import agenerate_embedding
+from services.metrics import metrics
+
+# Unambiguous requests for a price or a quote
+STRONG_PRICING_PATTERN = re.compile(
+    r"\b(?:price[sd]?|pricing|quot(?:e|es|ation)|cost(?:s|ing)?|bei)\b"
+    r"|\b(?:ksh|kes|usd|shillings?|dollars?)\b|\$\s?\d",
+    re.IGNORECASE
+)
+# Words that often, but not always, come with a pricing question
+WEAK_PRICING_PATTERN = re.compile(
+    r"\b(?:how much|cheap(?:er|est)?|expensive|afford(?:able)?|discount(?:s|ed)?|budget|sales team|buy|purchase)\b",
+    re.IGNORECASE
+)
+
+PRICING_EXAMPLES = [
+    "How much is the solar home system?",
+    "What is the price of the e-bike?",
+    "Can I get a quote for 50 batteries?",
+    "How much does the Ovego battery cost?",
+    "What's the cost of installation?",
+    "Is there a discount for bulk orders?",
+    "Send me your price list",
+    "Bei ya hii ni ngapi?",
+    "How much would it cost to power my shop?",
+    "Is the inverter expensive?",
+    "What are your rates for the lamps?",
+    "Can you give me pricing for the solar panels?",
+]
+NON_PRICING_EXAMPLES = [
+    "How long does the battery last?",
+    "What is the range of the electric motorcycle?",
+    "How do I charge the battery?",
+    "Does the solar panel work on cloudy days?",
+    "What warranty do you offer?",
+    "Where are you located?",
+    "How many lights can the system power?",
+    "Is the battery waterproof?",
+    "What is the capacity of the power bank?",
+    "How do I swap the battery?",
+    "Can I use it with a TV?",
+    "What certifications does the product have?",
+]
+
+# Backoff between attempts to embed the examples after a failure
+EXAMPLES_RETRY_MIN_SECONDS = 5.0
+EXAMPLES_RETRY_MAX_SECONDS = 300.0
+
+
+@dataclass
+class IntentDecision:
+    """Outcome of a local classification."""
+    is_pricing: bool
+    score: float
+    confidence: float
+    source: str
+
+    @property
+    def confident(self) -> bool:
+        return self.confidence >= PRICING_CLASSIFIER_MIN_CONFIDENCE
+
+
+class PricingClassifier:
+    """Rules plus k-nearest-neighbour vote over labelled example embeddings."""
+
+    def __init__(self, k: int = 5):
+        self.k = k
+        self._example_matrix: Optional[np.ndarray] = None
+        self._example_labels: Optional[np.ndarray] = None
+        # Only one request embeds the examples; the others wait for its result
+        self._examples_lock = asyncio.Lock()
+        # After a failure, the examples are not retried before this time (monotonic)
+        self._retry_at = 0.0
+        self._retry_delay = EXAMPLES_RETRY_MIN_SECONDS
+
+    async def ensure_examples(self) -> bool:
+        """
+        Embed the labelled examples once. Embeddings go through the embedding
+        cache, so after the first run this costs no API calls. A failure is
+        retried on a later request, with a growing backoff.
+
+        Returns:
+            True if the nearest-neighbour vote is available
+        """
+        if self._example_matrix is not None:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        async with self._examples_lock:
+            if self._example_matrix is not None:
+                return True
+            if time.monotonic() < self._retry_at:
+                return False
+            return await self._embed_examples()
+
+    async def _embed_examples(self) -> bool:
+        examples: List[Tuple[str, int]] = (
+            [(q, 1) for q in PRICING_EXAMPLES] + [(q, 0) for q in NON_PRICING_EXAMPLES]
+        )
+        try:
+            # Concurrent, so the batcher sends them in one request
+            vectors = await asyncio.gather(*(agenerate_embedding(q) for q, _ in examples))
+        except Exception as e:
+            print(f"Pricing classifier examples could not be embedded, retrying in {self._retry_delay:.0f}s: {e}")
+            self._retry_at = time.monotonic() + self._retry_delay
+            self._retry_delay = min(self._retry_delay * 2, EXAMPLES_RETRY_MAX_SECONDS)
+            return False
+        matrix = np.asarray(vectors, dtype=np.float32)
+        self._example_matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._example_labels = np.asarray([label for _, label in examples], dtype=np.float32)
+        return True
+
+    @staticmethod
+    def rule_score(question: str) -> Tuple[float, str]:
+        """Probability-like score from keyword rules alone."""
+        if STRONG_PRICING_PATTERN.search(question):
+            return 0.95, "strong"
+        if WEAK_PRICING_PATTERN.search(question):
+            return 0.75, "weak"
+        return 0.2, "none"
+
+    def knn_score(self, embedding: List[float]) -> float:
+        """Similarity-weighted share of pricing examples among the k nearest."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query)
+        similarities = self._example_matrix @ query
+        nearest = np.argsort(similarities)[-self.k:]
+        weights = np.clip(similarities[nearest], 0.0, None)
+        if weights.sum() == 0:
+            return 0.5
+        return float((weights * self._example_labels[nearest]).sum() / weights.sum())
+
+    def classify(self, question: str, embedding: Optional[List[float]] = None) -> IntentDecision:
+        """
+        Classify a question locally.
+
+        Args:
+            question: The user's question
+            embedding: Its embedding, if the nearest-neighbour vote should be used
+
+        Returns:
+            The decision with a confidence in [0, 1]
+        """
+        score, strength = self.rule_score(question)
+        source = f"rules:{strength}"
+        confidence = abs(score - 0.5) * 2
+        if strength != "strong":
+            if embedding is not None and self._example_matrix is not None:
+                score = 0.5 * score + 0.5 * self.knn_score(embedding)
+                confidence = abs(score - 0.5) * 2
+                source += "+knn"
+            else:
+                # Weak or absent keywords settle nothing on their own
+                confidence = 0.0
+        return IntentDecision(
+            is_pricing=score >= 0.5,
+            score=score,
+            confidence=confidence,
+            source=source
+        )
+
+    def is_conclusive(self, question: str) -> bool:
+        """True if the rules alone settle the question, without an embedding."""
+        return self.rule_score(question)[1] == "strong"
+
+    async def aclassify(self, question: str, embedding: Optional[List[float]] = None) -> IntentDecision:
+        """
+        Classify a question, using its embedding only when the rules alone
+        are not conclusive.
+
+        Args:
+            question: The user's question
+            embedding: Its embedding if the caller already has one (the answer
+                pipeline passes the retrieval query's); fetched otherwise
+        """
+        if self.is_conclusive(question):
+            decision = self.classify(question)
+        else:
+            if await self.ensure_examples() and embedding is None:
+                try:
+                    embedding = await agenerate_embedding(question)
+                except Exception as e:
+                    print(f"Pricing classifier could not embed question: {e}")
+            started = time.perf_counter()
+            decision = self.classify(question, embedding)
+            metrics.observe("intent.pricing.classify_time", time.perf_counter() - started)
+        metrics.increment(f"intent.pricing.{'local' if decision.confident else 'low_confidence'}")
+        return decision
+
+
+pricing_classifier = PricingClassifier()
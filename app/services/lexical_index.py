@@ -0,0 +1,306 @@
+"""
+BM25 index over the indexed documents, for lexical retrieval.
+
+Customers often ask by exact model code or SKU, which embedding similarity
+handles poorly. rebuild_vector_db (and sync_vector_db when anything changed)
+writes an inverted index of every chunk's text and metadata next to the
+Chroma data, one file per collection version, so a rollback finds the index
+of the version it returns to; pruning a version deletes its file. Model
+codes found in titles and the "model" metadata are also mapped to their
+chunks, so a question naming one can be answered without an embedding. The
+index also keeps each chunk's filterable catalog fields and keywords for
+each product type, which map a question to a metadata filter. A file is
+re-read whenever it is replaced.
+"""
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from config import LEXICAL_INDEX_DIR
+from services.entity_index import MODEL_CODE_PATTERN, is_unit_code
+
+# Words joined by these are indexed both joined and apart ("OV-200" -> ov200, ov, 200)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_/][a-z0-9]+)*")
+TOKEN_SEPARATOR_PATTERN = re.compile(r"[-_/]")
+# Metadata fields that are bookkeeping rather than content
+UNINDEXED_METADATA = {"content_hash"}
+# Metadata fields that name a product's model
+MODEL_METADATA = ("title", "model")
+# Catalog fields retrieval can filter on; filters only narrow product chunks
+FILTER_FIELDS = ("product_handle", "product_type", "model")
+# Chunk metadata telling product chunks from articles
+DOCUMENT_TYPE_FIELD = "document_type"
+PRODUCT_DOCUMENT_TYPE = "product"
+# Product type keywords shorter than this are too generic to classify by
+MIN_KEYWORD_LENGTH = 3
+# Questions matching more product types than this are not filtered
+MAX_FILTER_PRODUCT_TYPES = 2
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; hyphenated codes yield the joined form and each part."""
+    tokens = []
+    for word in TOKEN_PATTERN.findall(text.lower()):
+        parts = TOKEN_SEPARATOR_PATTERN.split(word)
+        if len(parts) > 1:
+            tokens.append("".join(parts))
+        tokens.extend(parts)
+    return tokens
+
+
+def model_codes(text: str) -> List[str]:
+    """
+    Model codes in text, lowercased without separators so "OV-200" and "ov200"
+    agree. Ratings such as "12V" or "100W" are not model codes.
+    """
+    codes = []
+    for code in MODEL_CODE_PATTERN.findall(text):
+        if is_unit_code(code):
+            continue
+        code = TOKEN_SEPARATOR_PATTERN.sub("", code.lower())
+        if code not in codes:
+            codes.append(code)
+    return codes
+
+
+def keyword(token: str) -> str:
+    """Crude singular form, so "batteries" and "panels" match "battery" and "panel"."""
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    if token.endswith("s") and not token.endswith("ss") and len(token) > 3:
+        return token[:-1]
+    return token
+
+
+def product_type_keywords(chunks: List[dict]) -> Dict[str, List[str]]:
+    """
+    Words from product titles and type names that identify one product type,
+    e.g. {"Energy Storage": ["battery", "energy", "storage", ...]}. Words used
+    by more than one type (brand names, "solar", ...) are left out.
+    """
+    owners: Dict[str, set] = {}
+    for chunk in chunks:
+        metadata = chunk.get("metadata") or {}
+        product_type = metadata.get("product_type")
+        if not product_type:
+            continue
+        names = " ".join([chunk["id"], product_type] + [str(metadata[key]) for key in MODEL_METADATA if metadata.get(key)])
+        for token in tokenize(names):
+            if len(token) >= MIN_KEYWORD_LENGTH and not token.isdigit():
+                owners.setdefault(keyword(token), set()).add(product_type)
+    keywords: Dict[str, List[str]] = {}
+    for word, product_types in owners.items():
+        if len(product_types) == 1:
+            keywords.setdefault(next(iter(product_types)), []).append(word)
+    return keywords
+
+
+def build_lexical_index(chunks: List[dict]) -> dict:
+    """
+    Build the index for a collection.
+
+    Args:
+        chunks: {"id", "text", "metadata"} dicts, as added to the collection
+
+    Returns:
+        {"documents": [{"id", "text", "length", "filters"}], "postings": {term: [[document, count], ...]},
+        "models": {code: [document, ...]}, "product_types": {product type: [keyword, ...]}},
+        documents referenced by position
+    """
+    documents = []
+    postings: Dict[str, List[List[int]]] = {}
+    models: Dict[str, List[int]] = {}
+    for position, chunk in enumerate(chunks):
+        metadata = chunk.get("metadata") or {}
+        fields = [chunk["text"]] + [
+            str(value) for key, value in metadata.items()
+            if key not in UNINDEXED_METADATA and value is not None
+        ]
+        counts = Counter(tokenize("\n".join(fields)))
+        documents.append({
+            "id": chunk["id"],
+            "text": chunk["text"],
+            "length": sum(counts.values()),
+            "filters": {
+                field: metadata[field] for field in FILTER_FIELDS + (DOCUMENT_TYPE_FIELD,) if metadata.get(field)
+            },
+        })
+        for term, count in counts.items():
+            postings.setdefault(term, []).append([position, count])
+        names = [chunk["id"]] + [str(metadata[key]) for key in MODEL_METADATA if metadata.get(key)]
+        for code in model_codes("\n".join(names)):
+            if position not in models.setdefault(code, []):
+                models[code].append(position)
+    return {"documents": documents, "postings": postings, "models": models,
+            "product_types": product_type_keywords(chunks)}
+
+
+def index_path(version: str, directory: str = LEXICAL_INDEX_DIR) -> str:
+    """File holding the index of a collection version."""
+    return os.path.join(directory, f"{version}.json")
+
+
+def write_lexical_index(index: dict, version: str, directory: str = LEXICAL_INDEX_DIR) -> None:
+    """Write the index atomically (temp file, then rename) so readers never see a partial file."""
+    path = index_path(version, directory)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(dict(index, version=version), f)
+    os.replace(tmp_path, path)
+
+
+class BM25:
+    """Okapi BM25 ranking over a loaded index."""
+
+    def __init__(self, index: dict):
+        self.documents = index["documents"]
+        self.postings = index["postings"]
+        self.models = index["models"]
+        self.product_type_keywords = {
+            word: product_type
+            for product_type, words in index.get("product_types", {}).items()
+            for word in words
+        }
+        # Articles and other non-product chunks, which every filter lets through
+        self.unfiltered = {
+            position for position, document in enumerate(self.documents)
+            if document.get("filters", {}).get(DOCUMENT_TYPE_FIELD) not in (None, PRODUCT_DOCUMENT_TYPE)
+        }
+        total = len(self.documents)
+        self.average_length = (sum(doc["length"] for doc in self.documents) / total) if total else 0.0
+        self.idf = {
+            term: math.log(1 + (total - len(entries) + 0.5) / (len(entries) + 0.5))
+            for term, entries in self.postings.items()
+        }
+
+    def search(self, query: str, n_results: int, metadata_filter: Optional[Tuple[str, List[str]]] = None) -> List[Tuple[int, float]]:
+        """
+        Rank documents for a query.
+
+        Args:
+            query: Question text
+            n_results: Maximum documents to return
+            metadata_filter: Optional (field, values); only non-product
+                documents and products whose field has one of the values are ranked
+
+        Returns:
+            Up to n_results (document, score) pairs, best first
+        """
+        allowed = (self.filter_documents(metadata_filter) | self.unfiltered) if metadata_filter else None
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, count in self.postings[term]:
+                if allowed is not None and position not in allowed:
+                    continue
+                length_norm = 1 - BM25_B + BM25_B * self.documents[position]["length"] / self.average_length
+                scores[position] = scores.get(position, 0.0) + idf * count * (BM25_K1 + 1) / (count + BM25_K1 * length_norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+
+    def filter_documents(self, metadata_filter: Tuple[str, List[str]]) -> set:
+        """Product documents whose catalog field has one of the given values."""
+        field, values = metadata_filter
+        values = set(values)
+        return {
+            position for position, document in enumerate(self.documents)
+            if document.get("filters", {}).get(field) in values
+        }
+
+    def metadata_filter(self, query: str, products: Optional[List[str]] = None) -> Optional[Tuple[str, List[str]]]:
+        """
+        Map a question to the catalog field values it is about.
+
+        Args:
+            query: Question text
+            products: Canonical product IDs (handles) in focus, if known
+
+        Returns:
+            (field, values) for the focus products, the models named by
+            model code, or the one or two product types the question's words
+            point to, in that order of preference; None if none apply or no
+            product matches
+        """
+        metadata_filter = self._metadata_filter(query, products)
+        if metadata_filter is None or not self.filter_documents(metadata_filter):
+            return None
+        return metadata_filter
+
+    def _metadata_filter(self, query: str, products: Optional[List[str]]) -> Optional[Tuple[str, List[str]]]:
+        if products:
+            return "product_handle", list(products)
+        models = []
+        for position in self.model_matches(query):
+            model = self.documents[position].get("filters", {}).get("model")
+            if model and model not in models:
+                models.append(model)
+        if models:
+            return "model", models
+        product_types = []
+        for token in tokenize(query):
+            product_type = self.product_type_keywords.get(keyword(token))
+            if product_type and product_type not in product_types:
+                product_types.append(product_type)
+        if 0 < len(product_types) <= MAX_FILTER_PRODUCT_TYPES:
+            return "product_type", product_types
+        return None
+
+    def model_matches(self, query: str) -> List[int]:
+        """Documents whose title or model is a model code mentioned in the query."""
+        matches = []
+        for code in model_codes(query):
+            for position in self.models.get(code, ()):
+                if position not in matches:
+                    matches.append(position)
+        return matches
+
+
+def delete_lexical_index(version: str, directory: str = LEXICAL_INDEX_DIR) -> None:
+    """Remove the index of a collection version that was pruned."""
+    try:
+        os.remove(index_path(version, directory))
+    except FileNotFoundError:
+        pass
+
+
+class LexicalIndex:
+    """
+    The BM25 index of the collection version being read, loaded when that
+    version changes (rebuild or rollback) or its file is rewritten (sync).
+    """
+
+    def __init__(self, directory: str = LEXICAL_INDEX_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._bm25: Optional[BM25] = None
+        self.version: Optional[str] = None
+
+    def current(self, version: str) -> Optional[BM25]:
+        """
+        The index built from the given collection version, or None if there
+        is none (the version predates hybrid retrieval).
+        """
+        try:
+            mtime = os.stat(index_path(version, self.directory)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if version != self.version or mtime != self._mtime:
+                with open(index_path(version, self.directory), "r", encoding="utf-8") as f:
+                    self._bm25 = BM25(json.load(f))
+                self.version = version
+                self._mtime = mtime
+                print(f"Loaded lexical index {version} with {len(self._bm25.documents)} documents")
+            return self._bm25
+
+
+lexical_index = LexicalIndex()
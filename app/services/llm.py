@@ -108,25 +108,34 @@
 """
 LLM service for generating responses.
 """
+import time
+from typing import AsyncIterator, List, Optional
 from litellm import acompletion
 from config import LLM_MODEL, LLM_API_KEY
+from services.intent import pricing_classifier
+from services.metrics import metrics
 
-async def generate_response(messages: list) -> str:
+PRICING_RESPONSE = "Please contact our sales team at team_sales@omnivoltaic.com to get a quote."
+
+async def generate_response(messages: list, check_pricing: bool = True) -> str:
 
     """
     Generate a response using the LLM model.
     
     Args:
         messages: List of messages (system, user, assistant)
+        check_pricing: Run the pricing gate on the last user message first.
+            Internal helper calls and the answer pipeline (which runs the
+            gate as its own stage) pass False.
         
     Returns:
         The LLM's response
     """
     # Check if the last user message is about pricing with LLM
-    if messages and messages[-1]["role"] == "user":
+    if check_pricing and messages and messages[-1]["role"] == "user":
         is_pricing = await check_if_pricing_question(messages[-1]["content"])
         if is_pricing:
-            return "Please contact our sales team at team_sales@omnivoltaic.com to get a quote."
+            return PRICING_RESPONSE
     
     response = await acompletion(
         model=LLM_MODEL,
@@ -135,7 +144,62 @@ async def generate_response(messages: list) -> str:
     )
     return response.choices[0].message.content
 
-async def check_if_pricing_question(question: str) -> bool:
+async def stream_response(messages: list) -> AsyncIterator[str]:
+    """
+    Stream a response from the LLM model as it is generated.
+
+    Args:
+        messages: List of messages (system, user, assistant)
+
+    Yields:
+        Pieces of the reply text, in order
+    """
+    started = time.monotonic()
+    first_token = True
+    response = await acompletion(
+        model=LLM_MODEL,
+        messages=messages,
+        api_key=LLM_API_KEY,
+        stream=True
+    )
+    async for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if first_token:
+            metrics.observe("llm.time_to_first_token", time.monotonic() - started)
+            first_token = False
+        yield delta
+    metrics.observe("llm.stream_time", time.monotonic() - started)
+
+async def check_if_pricing_question(question: str, embedding: Optional[List[float]] = None) -> bool:
+    """
+    Determine if a question is related to pricing.
+
+    The local classifier answers most questions in-process; only the ones it
+    is unsure about go to the LLM.
+
+    Args:
+        question: The user's question
+        embedding: Embedding to use for the local classifier, if already fetched
+
+    Returns:
+        True if it's a pricing-related question, False otherwise
+    """
+    decision = await pricing_classifier.aclassify(question, embedding)
+    if decision.confident:
+        print(f"Pricing check ({decision.source}, confidence {decision.confidence:.2f}): "
+              f"{'YES' if decision.is_pricing else 'NO'} for {question!r}")
+        return decision.is_pricing
+
+    is_pricing = await llm_check_if_pricing_question(question)
+    print(f"Pricing check (llm fallback, local score {decision.score:.2f}): "
+          f"{'YES' if is_pricing else 'NO'} for {question!r}")
+    return is_pricing
+
+async def llm_check_if_pricing_question(question: str) -> bool:
     """
     Use the LLM to determine if a question is related to pricing.
     
@@ -154,7 +218,7 @@ Output only "NO" if the question is not about pricing.
         {"role": "user", "content": f"Question: {question}\nIs this a question about pricing?"}
     ]
     
-    print(LLM_MODEL, LLM_API_KEY, "LLM API Key")
+    metrics.increment("intent.pricing.llm_calls")
     # Use a smaller response size since we only need YES/NO
     response = await acompletion(
         model=LLM_MODEL,
@@ -162,21 +226,21 @@ Output only "NO" if the question is not about pricing.
         api_key=LLM_API_KEY,
         max_tokens=5  # We only need a short YES/NO response
     )
-    print(response, "Is Pricing question")
     answer = response.choices[0].message.content.strip().upper()
     return "YES" in answer
 
-def create_system_prompt(context_docs: str) -> str:
+def create_system_prompt(context_docs: str, conversation_summary: str = "") -> str:
     """
     Create the system prompt with context documents.
     
     Args:
         context_docs: Relevant documents as context
+        conversation_summary: Rolling summary of earlier turns no longer sent verbatim
         
     Returns:
         Formatted system prompt
     """
-    return f"""
+    prompt = f"""
     You are a customer support agent representing Omnivoltaic. Your task is to answer customer queries using the product and article information provided. 
 
     Respond as if you are an expert from Omnivoltaic, speaking naturally and conversationally. Your responses should reflect the company's voice and avoid formalities like referencing "documents" or "details in the document." Focus on providing straightforward, clear, and helpful answers to the user's questions. 
@@ -189,6 +253,32 @@ def create_system_prompt(context_docs: str) -> str:
         
     {context_docs}
     """
+    if conversation_summary:
+        prompt += f"""
+    Summary of the earlier conversation with this customer:
+
+    {conversation_summary}
+    """
+    return prompt
+
+def build_messages(system_prompt: str, user_conversation: list, question: str) -> list:
+    """
+    Build the chat message list: system prompt, past exchanges, current question.
+
+    Args:
+        system_prompt: System prompt with the retrieved context
+        user_conversation: List of previous Q&A exchanges [{"question": str, "answer": str}]
+        question: The current user question
+
+    Returns:
+        List of messages for the LLM
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    for exchange in user_conversation:
+        messages.append({"role": "user", "content": exchange['question']})
+        messages.append({"role": "assistant", "content": exchange['answer']})
+    messages.append({"role": "user", "content": question})
+    return messages
 
 
 async def analyze_question(question: str, user_conversation: list) -> str:
@@ -204,7 +294,7 @@ async def analyze_question(question: str, user_conversation: list) -> str:
     Returns:
         str: Either the original question or a rewritten question with context
     """
-    # No need to check for pricing questions here as that's handled in generate_response
+    # No need to check for pricing questions here as that's handled by the answer pipeline
     if not user_conversation:
         return question  # No conversation history, so must be a unique question
     
@@ -237,8 +327,8 @@ async def analyze_question(question: str, user_conversation: list) -> str:
         {"role": "user", "content": analysis_prompt}
     ]
     
-    # Use the same LLM to analyze the question
-    response = await generate_response(messages)
+    # Use the same LLM to analyze the question; the pricing gate doesn't apply to this internal prompt
+    response = await generate_response(messages, check_pricing=False)
     
     # Parse the response to get the analyzed question
     if response.startswith("REWRITTEN:"):
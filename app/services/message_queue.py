@@ -0,0 +1,144 @@
+"""
+Background worker pool for incoming webhook messages.
+
+The webhook only validates and enqueues messages so Meta gets its 200
+straight away; a fixed pool of async workers drains one shared queue and does
+the LLM work and replies. Any free worker takes the next message, but a
+sender's messages are answered one at a time and in order: while one of them
+is being processed, that sender's later messages are parked behind it and the
+worker that finishes it takes the next one. Messages without a sender are
+skipped. Recently accepted platform message IDs are remembered, so a payload
+Meta redelivers after a 503 does not get its already-queued messages answered
+twice.
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from config import WEBHOOK_DEDUP_SIZE
+from services.metrics import metrics
+
+
+@dataclass
+class IncomingMessage:
+    """A message accepted by the webhook and waiting to be processed."""
+    sender_id: str
+    text: str
+    platform: str
+    message_id: Optional[str] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class MessageWorkerPool:
+    """Bounded shared queue of incoming messages, processed in order per sender."""
+
+    def __init__(self, handler: Callable[[str, str, str, Optional[str]], Awaitable[None]],
+                 workers: int, max_queue_size: int, dedup_size: int = WEBHOOK_DEDUP_SIZE):
+        self.handler = handler
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        # Bounded by max_queue_size in submit, counting parked messages too
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # Senders with a message being processed, and their messages waiting behind it
+        self._in_flight: Dict[str, Deque[IncomingMessage]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.busy = 0
+        self.dedup_size = dedup_size
+        self._recent_ids: "OrderedDict[tuple, None]" = OrderedDict()
+
+        metrics.register_gauge("webhook.queue_depth", self.queue_depth)
+        metrics.register_gauge("webhook.busy_workers", lambda: self.busy)
+
+    def start(self) -> None:
+        """Spawn the worker tasks. Must be called from the running event loop."""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"webhook-worker-{i}")
+            for i in range(self.workers)
+        ]
+        print(f"Started {self.workers} webhook workers")
+
+    async def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Let the workers finish what is already queued, then cancel them.
+
+        Args:
+            timeout: Seconds to wait for the queue to drain before cancelling
+        """
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Webhook queue not drained on shutdown; {self.queue_depth()} messages dropped")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def queue_depth(self) -> int:
+        """Messages waiting, including those parked behind a sender's message in progress."""
+        return self.queue.qsize() + sum(len(parked) for parked in self._in_flight.values())
+
+    def submit(self, message: IncomingMessage) -> bool:
+        """
+        Enqueue a message without waiting. Messages whose platform ID was
+        accepted recently are dropped as redeliveries, and messages without a
+        sender are skipped since there is no one to answer.
+
+        Returns:
+            False if the queue is full and the message was not accepted
+        """
+        if not message.sender_id:
+            metrics.increment("webhook.invalid")
+            print(f"Skipping {message.platform} message {message.message_id} without a sender")
+            return True
+        key = (message.platform, message.message_id)
+        if message.message_id and key in self._recent_ids:
+            metrics.increment("webhook.duplicate")
+            return True
+        if self.queue_depth() >= self.max_queue_size:
+            metrics.increment("webhook.rejected")
+            return False
+        self.queue.put_nowait(message)
+        if message.message_id:
+            self._recent_ids[key] = None
+            if len(self._recent_ids) > self.dedup_size:
+                self._recent_ids.popitem(last=False)
+        metrics.increment("webhook.enqueued")
+        return True
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            message = await self.queue.get()
+            parked = self._in_flight.get(message.sender_id)
+            if parked is not None:
+                # Another worker is answering this sender; it picks this up when done
+                parked.append(message)
+                continue
+            self._in_flight[message.sender_id] = parked = deque()
+            try:
+                while True:
+                    await self._process(worker_id, message)
+                    if not parked:
+                        break
+                    message = parked.popleft()
+            finally:
+                del self._in_flight[message.sender_id]
+
+    async def _process(self, worker_id: int, message: IncomingMessage) -> None:
+        metrics.observe("webhook.queue_wait", time.monotonic() - message.enqueued_at)
+        started = time.monotonic()
+        self.busy += 1
+        try:
+            await self.handler(message.sender_id, message.text, message.platform, message.message_id)
+            metrics.increment("webhook.processed")
+        except Exception as e:
+            metrics.increment("webhook.failed")
+            print(f"Worker {worker_id} failed on message from {message.sender_id}: {e}")
+        finally:
+            self.busy -= 1
+            metrics.observe("webhook.processing_time", time.monotonic() - started)
+            self.queue.task_done()
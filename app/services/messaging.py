@@ -0,0 +1,159 @@
+"""
+Outbound messaging to WhatsApp and Facebook Messenger.
+
+All sends share one keep-alive HTTP connection pool to graph.facebook.com,
+are capped by a concurrency limit and retried with backoff on 429/5xx.
+"""
+import asyncio
+import random
+import time
+from typing import Optional
+import httpx
+from config import (
+    PAGE_ACCESS_TOKEN,
+    WHATSAPP_TOKEN,
+    WHATSAPP_PHONE_NUMBER_ID,
+    GRAPH_API_URL,
+    OUTBOUND_MAX_CONNECTIONS,
+    OUTBOUND_MAX_CONCURRENCY,
+    OUTBOUND_MAX_RETRIES,
+)
+from services.metrics import metrics
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Longest wait between attempts, whatever Retry-After asks for; the send slot is held meanwhile
+MAX_RETRY_DELAY_SECONDS = 8.0
+
+
+class OutboundClient:
+    """Pooled async HTTP client for Graph API sends."""
+
+    def __init__(self, max_connections: int = OUTBOUND_MAX_CONNECTIONS,
+                 max_concurrency: int = OUTBOUND_MAX_CONCURRENCY,
+                 max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared client, created on first use inside the running loop."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=GRAPH_API_URL,
+                timeout=httpx.Timeout(10.0, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                headers={"Content-Type": "application/json"}
+            )
+        return self._client
+
+    async def close(self) -> None:
+        """Close pooled connections. Called on application shutdown."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _backoff(attempt: int, response: Optional[httpx.Response]) -> float:
+        """
+        Delay before the next attempt: Retry-After if given, else exponential
+        with jitter, capped at MAX_RETRY_DELAY_SECONDS either way.
+        """
+        if response is not None:
+            try:
+                return min(MAX_RETRY_DELAY_SECONDS, max(0.0, float(response.headers["retry-after"])))
+            except (KeyError, ValueError):
+                pass
+        return min(MAX_RETRY_DELAY_SECONDS, 0.5 * 2 ** attempt) + random.uniform(0, 0.25)
+
+    async def post(self, platform: str, path: str, payload: dict, access_token: str) -> bool:
+        """
+        POST a message payload to the Graph API.
+
+        Args:
+            platform: Platform label used for logs and metrics
+            path: Graph API path, e.g. "me/messages"
+            payload: JSON body
+            access_token: Token sent as the access_token query parameter
+
+        Returns:
+            True if the message was accepted
+        """
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                started = time.monotonic()
+                response = None
+                try:
+                    response = await self.client.post(
+                        path, json=payload, params={"access_token": access_token}
+                    )
+                except httpx.TransportError as e:
+                    error = str(e) or type(e).__name__
+                else:
+                    metrics.observe(f"outbound.{platform}.latency", time.monotonic() - started)
+                    if response.is_success:
+                        metrics.increment(f"outbound.{platform}.sent")
+                        return True
+                    error = f"{response.status_code} {response.text}"
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        break
+
+                if attempt < self.max_retries:
+                    metrics.increment(f"outbound.{platform}.retries")
+                    delay = self._backoff(attempt, response)
+                    print(f"{platform} send failed ({error}); retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+
+        metrics.increment(f"outbound.{platform}.failed")
+        print(f"Error sending {platform} message: {error}")
+        return False
+
+
+outbound_client = OutboundClient()
+
+
+async def send_whatsapp_message(recipient_id: str, message_text: str,
+                                phone_number_id: str = WHATSAPP_PHONE_NUMBER_ID) -> bool:
+    """
+    Send a message to the user via WhatsApp Business API.
+
+    Args:
+        recipient_id: WhatsApp ID of the recipient
+        message_text: Text to send
+        phone_number_id: Sending WhatsApp phone number ID
+    """
+    payload = {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": recipient_id,
+        "type": "text",
+        "text": {
+            "body": message_text
+        }
+    }
+    sent = await outbound_client.post("whatsapp", f"{phone_number_id}/messages", payload, WHATSAPP_TOKEN)
+    if sent:
+        print(f"WhatsApp message sent to {recipient_id}: {message_text}")
+    return sent
+
+
+async def send_facebook_message(recipient_id: str, message_text: str) -> bool:
+    """
+    Send a message to the user via Facebook Messenger API and log any errors.
+
+    Args:
+        recipient_id: Page-scoped ID of the recipient
+        message_text: Text to send
+    """
+    payload = {
+        "recipient": {"id": recipient_id},
+        "message": {"text": message_text},
+    }
+    sent = await outbound_client.post("facebook", "me/messages", payload, PAGE_ACCESS_TOKEN)
+    if sent:
+        print(f"Message sent to {recipient_id}: {message_text}")
+    return sent
@@ -0,0 +1,84 @@
+"""
+In-process metrics: counters, gauges and latency summaries.
+
+Values are kept in memory and exposed as JSON by the /metrics endpoint.
+"""
+import threading
+from collections import defaultdict, deque
+from typing import Callable, Dict
+
+
+class LatencySummary:
+    """Keeps a sliding window of recent samples for percentile estimates."""
+
+    def __init__(self, window: int = 1024):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+
+        def percentile(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": ordered[-1] if ordered else 0.0,
+        }
+
+
+class Metrics:
+    """Registry of named counters, gauges and latency summaries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._summaries: Dict[str, LatencySummary] = {}
+        self._gauges: Dict[str, Callable[[], object]] = {}
+
+    def increment(self, name: str, amount: float = 1) -> None:
+        """Add to a counter."""
+        with self._lock:
+            self._counters[name] += amount
+
+    def observe(self, name: str, value: float) -> None:
+        """Record a latency (or any other) sample, in seconds by convention."""
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = self._summaries[name] = LatencySummary()
+            summary.observe(value)
+
+    def register_gauge(self, name: str, read: Callable[[], object]) -> None:
+        """Register a callable that is read every time metrics are collected."""
+        with self._lock:
+            self._gauges[name] = read
+
+    def snapshot(self) -> Dict[str, object]:
+        """Collect all metrics into a JSON-serializable dict."""
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = {name: s.snapshot() for name, s in self._summaries.items()}
+            gauges = dict(self._gauges)
+        gauge_values = {}
+        for name, read in gauges.items():
+            try:
+                gauge_values[name] = read()
+            except Exception as e:
+                gauge_values[name] = f"error: {e}"
+        return {"counters": counters, "gauges": gauge_values, "latencies": summaries}
+
+
+metrics = Metrics()
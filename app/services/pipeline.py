@@ -0,0 +1,97 @@
+"""
+Small DAG executor for the per-message request pipeline.
+
+Stages declare which other stages they depend on; every stage whose
+dependencies are done runs concurrently with the rest. A stage can end the
+whole run early by raising ShortCircuit, which cancels everything still
+in flight.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Sequence
+from services.metrics import metrics
+
+
+class ShortCircuit(Exception):
+    """Raised by a stage to stop the pipeline and return `result` immediately."""
+
+    def __init__(self, result: Any):
+        super().__init__("pipeline short-circuited")
+        self.result = result
+
+
+class Stage:
+    """A named async step with dependencies on other stages."""
+
+    def __init__(self, name: str, func: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 depends_on: Sequence[str] = ()):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+
+
+class Pipeline:
+    """Runs a set of stages as a dependency graph."""
+
+    def __init__(self, name: str, stages: List[Stage], output: str):
+        self.name = name
+        self.stages = {stage.name: stage for stage in stages}
+        self.output = output
+        for stage in stages:
+            missing = [dep for dep in stage.depends_on if dep not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages {missing}")
+
+    async def run(self, **inputs: Any) -> Any:
+        """
+        Execute the pipeline.
+
+        Args:
+            **inputs: Values every stage can read from its context dict
+
+        Returns:
+            The result of the output stage, or the value of a ShortCircuit
+        """
+        try:
+            context = await self.run_context(**inputs)
+        except ShortCircuit as short_circuit:
+            return short_circuit.result
+        return context[self.output]
+
+    async def run_context(self, **inputs: Any) -> Dict[str, Any]:
+        """
+        Execute the pipeline and return the whole context (inputs plus every
+        stage result). A ShortCircuit raised by a stage propagates to the caller.
+        """
+        context: Dict[str, Any] = dict(inputs)
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage) -> Any:
+            if stage.depends_on:
+                await asyncio.gather(*(tasks[dep] for dep in stage.depends_on))
+            started = time.monotonic()
+            result = await stage.func(context)
+            metrics.observe(f"pipeline.{self.name}.{stage.name}", time.monotonic() - started)
+            context[stage.name] = result
+            return result
+
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.create_task(run_stage(stage), name=f"{self.name}.{stage.name}")
+
+        pending = set(tasks.values())
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    error = task.exception()
+                    if isinstance(error, ShortCircuit):
+                        metrics.increment(f"pipeline.{self.name}.short_circuit")
+                    if error is not None:
+                        raise error
+            return context
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+            # Let cancelled stages unwind so their exceptions aren't reported as unretrieved
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
@@ -0,0 +1,121 @@
+"""
+Background rolling summaries of older conversation turns.
+
+Prompts carry the user's most recent HISTORY_MAX_TURNS exchanges verbatim.
+Turns older than that are folded into a compact per-user summary stored in
+SQLite, so their context is kept without replaying the raw transcript. The
+summaries are refreshed off the request path: replying only schedules the
+user, and a background worker does the LLM call.
+"""
+import asyncio
+from typing import Optional, Set
+from config import HISTORY_MAX_TURNS, SUMMARY_MIN_NEW_TURNS
+from services.db import (
+    get_conversation_summary,
+    get_turns_to_summarize,
+    save_conversation_summary,
+)
+from services.llm import generate_response
+from services.metrics import metrics
+
+
+async def summarize_turns(previous_summary: str, turns: list) -> str:
+    """
+    Fold new exchanges into an existing summary with the LLM.
+
+    Args:
+        previous_summary: Summary so far (may be empty)
+        turns: Exchanges to fold in, oldest first
+
+    Returns:
+        The updated summary
+    """
+    transcript = "\n".join(f"Customer: {t['question']}\nAgent: {t['answer']}" for t in turns)
+    prompt = f"""
+    Update the summary of a customer support conversation with Omnivoltaic.
+
+    Current summary:
+    {previous_summary or "(none yet)"}
+
+    New exchanges to fold in:
+    {transcript}
+
+    Write the updated summary in under 150 words. Keep the products the customer
+    asked about, their needs and situation, and any answers or commitments given.
+    Drop greetings and small talk. Return only the summary text.
+    """
+    messages = [
+        {"role": "system", "content": "You write concise running summaries of customer support conversations."},
+        {"role": "user", "content": prompt}
+    ]
+    return (await generate_response(messages, check_pricing=False)).strip()
+
+
+class ConversationSummarizer:
+    """Queue of users whose aged-out turns need folding into their summary."""
+
+    def __init__(self, keep_recent: int = HISTORY_MAX_TURNS, min_new_turns: int = SUMMARY_MIN_NEW_TURNS):
+        self.keep_recent = keep_recent
+        self.min_new_turns = min_new_turns
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._scheduled: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        metrics.register_gauge("summarizer.queue_depth", self.queue.qsize)
+
+    def start(self) -> None:
+        """Start the background worker. Must be called from the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._worker(), name="conversation-summarizer")
+
+    async def stop(self) -> None:
+        """Stop the worker; users still queued are picked up again on their next message."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def schedule(self, user_id: str) -> None:
+        """Ask for the user's summary to be refreshed. Never blocks the caller."""
+        if user_id in self._scheduled:
+            return
+        self._scheduled.add(user_id)
+        self.queue.put_nowait(user_id)
+
+    async def refresh(self, user_id: str) -> bool:
+        """
+        Fold the user's aged-out turns into their summary if enough have accumulated.
+
+        Returns:
+            True if the summary was updated
+        """
+        # Rows still in the write-behind buffer are the newest, so leaving them
+        # out only shifts the active window back and folds fewer turns
+        existing = await get_conversation_summary(user_id)
+        previous_summary = existing["summary"] if existing else ""
+        last_id = existing["last_summarized_id"] if existing else 0
+
+        turns = await get_turns_to_summarize(user_id, last_id, self.keep_recent)
+        if len(turns) < self.min_new_turns:
+            return False
+
+        summary = await summarize_turns(previous_summary, turns)
+        await save_conversation_summary(user_id, summary, turns[-1]["id"])
+        metrics.increment("summarizer.turns_folded", len(turns))
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            user_id = await self.queue.get()
+            self._scheduled.discard(user_id)
+            try:
+                if await self.refresh(user_id):
+                    metrics.increment("summarizer.updated")
+            except Exception as e:
+                metrics.increment("summarizer.failed")
+                print(f"Error summarizing conversation for {user_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+
+conversation_summarizer = ConversationSummarizer()
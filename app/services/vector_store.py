@@ -1,66 +1,275 @@
-
 """
 ChromaDB integration for vector storage and retrieval.
 """
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
-from config import CHROMA_PATH, COLLECTION_NAME
-from services.embedding import generate_embedding
-from typing import List
+from config import CHROMA_PATH, VECTOR_STORE_MAX_WORKERS, RETRIEVAL_MODE, RRF_K
+from services.collection_registry import collection_registry
+from services.embedding import generate_embedding, agenerate_embedding
+from services.lexical_index import BM25, DOCUMENT_TYPE_FIELD, PRODUCT_DOCUMENT_TYPE, lexical_index
+from services.metrics import metrics
+from typing import Dict, List, Optional, Tuple
+
+# Each side of a hybrid query contributes this many times n_results candidates to the fusion
+HYBRID_CANDIDATES_FACTOR = 4
 
 class VectorStore:
     """Interface for ChromaDB vector database operations."""
-    
-    def __init__(self):
-        """Initialize ChromaDB client."""
+
+    def __init__(self, mode: str = RETRIEVAL_MODE):
+        """
+        Initialize ChromaDB client.
+
+        Args:
+            mode: "hybrid" to fuse BM25 and vector results, "vector" for embeddings only
+        """
         self.client = chromadb.PersistentClient(path=CHROMA_PATH)
+        self.mode = mode
         # Don’t store collection here; fetch it dynamically
-        self.collection_name = COLLECTION_NAME
-    
+        self.registry = collection_registry
+        # Chroma's client is synchronous, so async callers run it on this bounded pool
+        self.executor = ThreadPoolExecutor(
+            max_workers=VECTOR_STORE_MAX_WORKERS,
+            thread_name_prefix="chroma"
+        )
+
+    @property
+    def collection_name(self) -> str:
+        """Name of the active collection version, as published by rebuild_vector_db."""
+        return self.registry.active()
+
     def get_collection(self):
-        """Fetch or create the collection dynamically."""
+        """
+        Fetch the active collection dynamically.
+
+        Raises if it does not exist rather than creating it: an empty
+        collection would silently answer every question with no context,
+        and the registry only points at versions a rebuild has written.
+        """
+        name = self.collection_name
         try:
-            return self.client.get_collection(name=self.collection_name)
+            return self.client.get_collection(name=name)
         except Exception as e:
-            # If collection doesn’t exist, create it (initial empty state)
             if "does not exist" in str(e):
-                return self.client.create_collection(name=self.collection_name)
+                raise RuntimeError(f"Active collection {name} does not exist; run a rebuild") from e
             raise e
-    
-    def query(self, question: str, n_results: int = 5) -> str:
+
+    def _vector_search(self, query_embedding: List[float], n_results: int,
+                       metadata_filter: Optional[Tuple[str, List[str]]] = None) -> List[Tuple[str, str]]:
         """
-        Query the vector store with the user question.
-        
+        Run a similarity search against the current collection.
+
         Args:
-            question: User's question
+            query_embedding: Embedding of the user's question
             n_results: Number of similar documents to retrieve
-            
+            metadata_filter: Optional (field, values) passed to Chroma as a where
+                filter on product chunks; other chunks stay eligible
+
         Returns:
-            Combined text from the most relevant documents
+            (id, text) of the most similar documents, best first
         """
-        # Generate embedding for the query
-        query_embedding = generate_embedding(question)
-        
         # Fetch the current collection
         collection = self.get_collection()
-        
+
         # Query ChromaDB
+        where = None
+        if metadata_filter is not None:
+            field, values = metadata_filter
+            where = {"$or": [
+                {field: {"$in": list(values)}},
+                {DOCUMENT_TYPE_FIELD: {"$ne": PRODUCT_DOCUMENT_TYPE}},
+            ]}
         results = collection.query(
             query_embeddings=[query_embedding],
-            n_results=n_results
+            n_results=n_results,
+            where=where
         )
-        
-        # Extract and combine documents
-        documents = results.get("documents", [])
-        flattened_documents = [item for sublist in documents for item in sublist]
-        combined_documents = "\n\n".join(flattened_documents)
-        
-        return combined_documents
-    
+
+        ids = [item for sublist in results.get("ids", []) for item in sublist]
+        documents = [item for sublist in results.get("documents", []) for item in sublist]
+        return list(zip(ids, documents))
+
+    @staticmethod
+    def _lexical_search(index: BM25, question: str, n_results: int,
+                        metadata_filter: Optional[Tuple[str, List[str]]] = None) -> List[Tuple[str, str]]:
+        """(id, text) of the best BM25 matches, best first."""
+        return [
+            (index.documents[position]["id"], index.documents[position]["text"])
+            for position, _ in index.search(question, n_results, metadata_filter)
+        ]
+
+    @staticmethod
+    def _model_match(index: BM25, question: str, n_results: int) -> Optional[List[Tuple[str, str]]]:
+        """
+        Documents for a model code named in the question, topped up with the
+        best other BM25 matches, or None if no model matches exactly (or too
+        many do to be specific).
+        """
+        matches = index.model_matches(question)
+        if not matches or len(matches) > n_results:
+            return None
+        ranked = [position for position, _ in index.search(question, n_results + len(matches))]
+        positions = matches + [position for position in ranked if position not in matches]
+        return [
+            (index.documents[position]["id"], index.documents[position]["text"])
+            for position in positions[:n_results]
+        ]
+
+    @staticmethod
+    def _fuse(rankings: List[List[Tuple[str, str]]], n_results: int) -> List[Tuple[str, str]]:
+        """
+        Merge rankings with reciprocal rank fusion: each document scores
+        sum(1 / (RRF_K + rank)) over the rankings it appears in.
+        """
+        scores: Dict[str, float] = {}
+        texts: Dict[str, str] = {}
+        for ranking in rankings:
+            for rank, (document_id, text) in enumerate(ranking, start=1):
+                scores[document_id] = scores.get(document_id, 0.0) + 1 / (RRF_K + rank)
+                texts.setdefault(document_id, text)
+        best = sorted(scores, key=scores.get, reverse=True)[:n_results]
+        return [(document_id, texts[document_id]) for document_id in best]
+
+    @staticmethod
+    def _combine(results: List[Tuple[str, str]]) -> str:
+        """Combined text of the retrieved documents."""
+        return "\n\n".join(text for _, text in results)
+
+    def _metadata_filter(self, catalog: Optional[BM25], question: str,
+                         products: Optional[List[str]]) -> Optional[Tuple[str, List[str]]]:
+        """Catalog filter for a question, or None without a catalog index for the active collection."""
+        if catalog is None:
+            return None
+        return catalog.metadata_filter(question, products)
+
+    def _plan(self, question: str, n_results: int, products: Optional[List[str]]):
+        """
+        The BM25 index of the active collection, the model-code fast-path
+        result (hybrid mode only) and the catalog filter for a question.
+        Blocking; aquery runs it on the executor.
+
+        Returns:
+            (index or None, documents or None, filter or None); the filter is
+            only worked out when there is no fast-path result
+        """
+        catalog = lexical_index.current(self.collection_name)
+        if catalog is not None and self.mode == "hybrid":
+            model_match = self._model_match(catalog, question, n_results)
+            if model_match is not None:
+                return catalog, model_match, None
+        return catalog, None, self._metadata_filter(catalog, question, products)
+
+    def query(self, question: str, n_results: int = 5, products: Optional[List[str]] = None) -> str:
+        """
+        Query the vector store with the user question.
+
+        Blocking version kept for scripts and sync callers; request handlers
+        should use aquery instead.
+
+        Args:
+            question: User's question
+            n_results: Number of similar documents to retrieve
+            products: Canonical product IDs the question is about, if known
+
+        Returns:
+            Combined text from the most relevant documents
+        """
+        catalog, model_match, metadata_filter = self._plan(question, n_results, products)
+        index = catalog if self.mode == "hybrid" else None
+        if model_match is not None:
+            return self._combine(model_match)
+        query_embedding = generate_embedding(question)
+        candidates = n_results * HYBRID_CANDIDATES_FACTOR if index is not None else n_results
+        for attempt_filter in ([metadata_filter, None] if metadata_filter else [None]):
+            vector_results = self._vector_search(query_embedding, candidates, attempt_filter)
+            lexical_results = self._lexical_search(index, question, candidates, attempt_filter) if index is not None else []
+            if vector_results or lexical_results:
+                break
+        if index is None:
+            return self._combine(vector_results)
+        return self._combine(self._fuse([lexical_results, vector_results], n_results))
+
+    async def aquery(self, question: str, n_results: int = 5, products: Optional[List[str]] = None,
+                     embedding: Optional[List[float]] = None) -> str:
+        """
+        Query the vector store without blocking the event loop.
+
+        In hybrid mode, a question naming a known model code is answered from
+        the BM25 index alone, without an embedding. Otherwise BM25 and vector
+        search run concurrently and their rankings are fused. The embedding
+        is fetched with the async OpenAI client and the Chroma and BM25
+        lookups run on the store's bounded executor.
+
+        Product chunks in both searches are narrowed to the catalog entries
+        the question is about (the focus products, else models or product
+        types recognised in the question); articles are always searched. The
+        search is repeated without the filter if it finds nothing.
+
+        Args:
+            question: User's question
+            n_results: Number of similar documents to retrieve
+            products: Canonical product IDs the question is about, if known
+            embedding: The question's embedding, if the caller already has it
+
+        Returns:
+            Combined text from the most relevant documents
+        """
+        query_embedding = embedding
+        loop = asyncio.get_running_loop()
+        # Loading the index and matching against it is CPU and file work; keep it off the event loop
+        catalog, model_match, metadata_filter = await loop.run_in_executor(
+            self.executor, self._plan, question, n_results, products
+        )
+        index = catalog if self.mode == "hybrid" else None
+        if model_match is not None:
+            metrics.increment("retrieval.lexical_fast_path")
+            return self._combine(model_match)
+
+        candidates = n_results * HYBRID_CANDIDATES_FACTOR if index is not None else n_results
+        if query_embedding is not None:
+            embedding = loop.create_future()
+            embedding.set_result(query_embedding)
+        else:
+            embedding = asyncio.ensure_future(agenerate_embedding(question))
+
+        async def vector_search(attempt_filter) -> List[Tuple[str, str]]:
+            return await loop.run_in_executor(
+                self.executor, self._vector_search, await embedding, candidates, attempt_filter
+            )
+
+        async def search(attempt_filter) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+            if index is None:
+                return [], await vector_search(attempt_filter)
+            lexical_results, vector_results = await asyncio.gather(
+                loop.run_in_executor(self.executor, self._lexical_search, index, question, candidates, attempt_filter),
+                vector_search(attempt_filter),
+            )
+            return lexical_results, vector_results
+
+        metrics.increment("retrieval.hybrid" if index is not None else "retrieval.vector")
+        try:
+            lexical_results, vector_results = await search(metadata_filter)
+            if metadata_filter is not None:
+                if lexical_results or vector_results:
+                    metrics.increment(f"retrieval.filter.{metadata_filter[0]}")
+                else:
+                    # Nothing in the catalog matches the filter; search everything
+                    metrics.increment("retrieval.filter.fallback")
+                    lexical_results, vector_results = await search(None)
+        finally:
+            embedding.cancel()
+        if index is None:
+            return self._combine(vector_results)
+        return self._combine(self._fuse([lexical_results, vector_results], n_results))
+
     def switch_collection(self, new_collection_name: str):
         """
         Switch to a different collection by name.
-        
+        This flips the shared active-collection pointer, so it also applies
+        to other processes reading the same Chroma directory.
+
         Args:
             new_collection_name: Name of the collection to switch to
         """
-        self.collection_name = new_collection_name
\ No newline at end of file
+        self.registry.activate(new_collection_name)
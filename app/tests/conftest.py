@@ -0,0 +1,18 @@
+"""
+Test setup: the app imports its modules from the app directory (services.x,
+routes.x) and reads its settings from the environment when config is first
+imported, so both are arranged here before any test module imports them.
+"""
+import os
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+DATA_DIR = tempfile.mkdtemp(prefix="bot-app-tests-")
+os.environ.setdefault("LLM_API_KEY", "sk-test")
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+os.environ["DB_PATH"] = os.path.join(DATA_DIR, "conversation_history.db")
+os.environ["CHROMA_PATH"] = os.path.join(DATA_DIR, "chroma")
+os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(DATA_DIR, "embedding_cache.db")
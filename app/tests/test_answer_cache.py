@@ -0,0 +1,71 @@
+import pytest
+from services.answer_cache import SemanticAnswerCache
+from services.collection_registry import CollectionRegistry
+
+QUESTION = [1.0, 0.0, 0.0]
+SIMILAR = [0.99, 0.05, 0.0]
+DIFFERENT = [0.0, 1.0, 0.0]
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = CollectionRegistry(str(tmp_path / "active_collection.json"), default="chunks")
+    registry.activate("a")
+    return registry
+
+
+@pytest.fixture
+def cache(registry):
+    return SemanticAnswerCache(max_entries=4, ttl_seconds=60, min_similarity=0.95, registry=registry)
+
+
+def store(cache, embedding, answer):
+    assert cache.get(embedding) is None
+    cache.put("question", embedding, answer, cost=1.0, version=cache.version)
+
+
+def test_similar_question_hits(cache):
+    store(cache, QUESTION, "answer")
+    assert cache.get(SIMILAR).answer == "answer"
+    assert cache.get(DIFFERENT) is None
+
+
+def test_sync_invalidates_entries(cache, registry):
+    store(cache, QUESTION, "answer")
+    registry.mark_updated()
+    assert cache.get(QUESTION) is None
+    assert cache.invalidations == 1
+
+
+def test_rebuild_and_rollback_invalidate_entries(cache, registry):
+    store(cache, QUESTION, "from a")
+    registry.activate("b")
+    assert cache.get(QUESTION) is None
+    store(cache, QUESTION, "from b")
+    registry.rollback()
+    assert cache.get(QUESTION) is None
+
+
+def test_answer_from_changed_data_is_not_stored(cache, registry):
+    assert cache.get(QUESTION) is None
+    looked_up = cache.version
+    # The data changes and changes back while the answer is being generated
+    registry.activate("b")
+    registry.rollback()
+    cache.put("question", QUESTION, "stale", cost=1.0, version=looked_up)
+    assert cache.get(QUESTION) is None
+
+
+def test_user_specific_questions_are_not_cacheable(cache):
+    assert not cache.cacheable("Where is my order 12345?")
+    assert cache.cacheable("How long does the OV-200 battery last?")
+
+
+def test_least_recently_used_entry_is_evicted(registry):
+    cache = SemanticAnswerCache(max_entries=2, ttl_seconds=60, min_similarity=0.95, registry=registry)
+    store(cache, [1.0, 0.0, 0.0], "x")
+    store(cache, [0.0, 1.0, 0.0], "y")
+    assert cache.get([1.0, 0.0, 0.0]).answer == "x"
+    store(cache, [0.0, 0.0, 1.0], "z")
+    assert cache.get([0.0, 1.0, 0.0]) is None
+    assert cache.get([1.0, 0.0, 0.0]).answer == "x"
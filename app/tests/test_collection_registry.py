@@ -0,0 +1,76 @@
+import pytest
+from services.collection_registry import CollectionRegistry
+
+
+class FakeClient:
+    def __init__(self):
+        self.deleted = []
+
+    def delete_collection(self, name):
+        self.deleted.append(name)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return CollectionRegistry(str(tmp_path / "active_collection.json"), default="chunks")
+
+
+def test_default_before_any_rebuild(registry):
+    assert registry.active() == "chunks"
+    assert registry.versions() == []
+    assert registry.rollback() is None
+
+
+def test_activate_records_versions(registry):
+    registry.activate("a")
+    registry.activate("b")
+    assert registry.active() == "b"
+    assert registry.versions() == ["a", "b"]
+
+
+def test_rollback_returns_to_previous_version(registry):
+    registry.activate("a")
+    registry.activate("b")
+    assert registry.rollback() == "a"
+    assert registry.active() == "a"
+    assert registry.rollback() is None
+
+
+def test_data_version_never_repeats(registry):
+    seen = []
+    registry.activate("a")
+    seen.append(registry.data_version())
+    registry.mark_updated()
+    seen.append(registry.data_version())
+    registry.activate("b")
+    seen.append(registry.data_version())
+    registry.rollback()
+    seen.append(registry.data_version())
+    assert registry.active() == "a"
+    assert len(set(seen)) == len(seen)
+
+
+def test_state_is_shared_through_the_pointer_file(registry):
+    registry.activate("a")
+    registry.activate("b")
+    other = CollectionRegistry(registry.path, default="chunks")
+    assert other.active() == "b"
+    assert other.data_version() == registry.data_version()
+
+
+def test_prune_keeps_newest_and_active(registry):
+    for name in ("a", "b", "c", "d"):
+        registry.activate(name)
+    registry.rollback()
+    registry.rollback()
+    assert registry.active() == "b"
+    client = FakeClient()
+    assert registry.prune(client, keep=1) == ["a", "c"]
+    assert client.deleted == ["a", "c"]
+    assert registry.versions() == ["b", "d"]
+
+
+def test_new_version_names_are_unique(registry):
+    first = registry.new_version_name()
+    registry.activate(first)
+    assert registry.new_version_name() != first
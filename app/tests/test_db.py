@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import pytest
+from services.db import (
+    ConversationWriteBuffer,
+    conversation_buffer,
+    get_history_page,
+    get_relevant_history,
+    get_user_conversation_history,
+    init_db,
+    save_conversation,
+)
+
+_users = itertools.count()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    init_db()
+
+
+def new_user() -> str:
+    return f"user-{next(_users)}"
+
+
+async def save(user_id: str, question: str, entities=()) -> None:
+    await save_conversation(user_id, question, f"answer to {question}", entities=[(e, "") for e in entities])
+
+
+def questions(exchanges: list) -> list:
+    return [exchange["question"] for exchange in exchanges]
+
+
+def test_relevant_history_without_recent_window():
+    async def scenario():
+        user_id = new_user()
+        await save(user_id, "q1", ["ov-200"])
+        await save(user_id, "q2")
+        await save(user_id, "q3", ["ov-200"])
+        await conversation_buffer.flush()
+        return await get_relevant_history(user_id, ["ov-200"], skip_recent=0, limit=5)
+
+    assert questions(asyncio.run(scenario())) == ["q1", "q3"]
+
+
+def test_relevant_history_window_counts_buffered_rows():
+    async def scenario():
+        user_id = new_user()
+        for question in ("q1", "q2", "q3"):
+            await save(user_id, question, ["ov-200"])
+        await save(user_id, "q4")
+        await conversation_buffer.flush()
+        # Newest two exchanges are not committed yet; the window is q4, p1, p2
+        await save(user_id, "p1", ["ov-200"])
+        await save(user_id, "p2", ["ov-200"])
+        relevant = await get_relevant_history(user_id, ["ov-200"], skip_recent=3, limit=5)
+        await conversation_buffer.flush()
+        return relevant
+
+    assert questions(asyncio.run(scenario())) == ["q1", "q2", "q3"]
+
+
+def test_relevant_history_skips_committed_window():
+    async def scenario():
+        user_id = new_user()
+        for question in ("q1", "q2", "q3", "q4"):
+            await save(user_id, question, ["ov-200"])
+        await conversation_buffer.flush()
+        return await get_relevant_history(user_id, ["ov-200"], skip_recent=2, limit=5)
+
+    assert questions(asyncio.run(scenario())) == ["q1", "q2"]
+
+
+def test_history_page_cursor_walks_back_to_the_first_exchange():
+    async def scenario():
+        user_id = new_user()
+        saved = [await save_conversation(user_id, f"q{i}", f"a{i}") for i in range(5)]
+        await save(new_user(), "someone else")
+        # Rows still in the buffer are committed so they can be numbered
+        pages = [await get_history_page(user_id, limit=2)]
+        while pages[-1]["next_cursor"] is not None:
+            pages.append(await get_history_page(user_id, before=pages[-1]["next_cursor"], limit=2))
+        return [await future for future in saved], pages
+
+    ids, pages = asyncio.run(scenario())
+    assert [questions(page["history"]) for page in pages] == [["q3", "q4"], ["q1", "q2"], ["q0"]]
+    assert [exchange["seq"] for page in reversed(pages) for exchange in page["history"]] == ids
+    assert all(page["seq"] == ids[-1] for page in pages)
+
+
+def test_history_page_for_unknown_user():
+    page = asyncio.run(get_history_page(new_user()))
+    assert page == {"history": [], "next_cursor": None, "seq": None}
+
+
+def test_history_reads_include_buffered_rows():
+    async def scenario():
+        user_id = new_user()
+        await save(user_id, "q1")
+        await conversation_buffer.flush()
+        await save(user_id, "q2")
+        assert conversation_buffer.pending_for(user_id)
+        history = await get_user_conversation_history(user_id, limit=5)
+        await conversation_buffer.flush()
+        return history
+
+    assert questions(asyncio.run(scenario())) == ["q1", "q2"]
+
+
+class FlakyStore:
+    """Conversation store whose first `failures` writes fail."""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.rows = []
+
+    async def write(self, name, func, rows):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        self.rows.extend(rows)
+        return list(range(len(self.rows) - len(rows) + 1, len(self.rows) + 1))
+
+
+def row(user_id: str, question: str) -> tuple:
+    return (user_id, question, "answer", 0.0, None, None, ())
+
+
+def test_failed_flush_is_retried_in_order():
+    async def scenario():
+        store = FlakyStore(failures=2)
+        buffer = ConversationWriteBuffer(store, flush_interval_ms=1, max_retries=3, retry_delay_ms=50)
+        first = buffer.add(row("u", "q1"))
+        await asyncio.sleep(0.005)
+        # The failed row is back in the buffer, where reads still see it
+        assert [r[1] for r in buffer.pending_for("u")] == ["q1"]
+        second = buffer.add(row("u", "q2"))
+        await buffer.flush()
+        return store, await first, await second, buffer
+
+    store, first, second, buffer = asyncio.run(scenario())
+    assert [r[1] for r in store.rows] == ["q1", "q2"]
+    assert (first, second) == (1, 2)
+    assert not buffer.has_buffered("u")
+
+
+def test_rows_are_dropped_after_retries_and_flush_reports_it():
+    async def scenario():
+        buffer = ConversationWriteBuffer(FlakyStore(failures=10), flush_interval_ms=1, max_retries=2, retry_delay_ms=1)
+        saved = buffer.add(row("u", "q1"))
+        with pytest.raises(RuntimeError):
+            await buffer.flush()
+        return await saved, buffer
+
+    row_id, buffer = asyncio.run(scenario())
+    assert row_id is None
+    assert buffer.dropped_rows == 1
+    assert not buffer.has_buffered("u")
@@ -0,0 +1,59 @@
+from services.entity_index import EntityMatcher, build_entity_dictionary, is_unit_code, product_aliases
+
+CATALOG = [
+    ("ovego-ov-200", "Ovego OV-200 Power Station 200Wh"),
+    ("ovego-s10-panel", "Ovego S10 Solar Panel 100W 12V"),
+    ("ovego-lamp", "Ovego Lamp 12V"),
+]
+
+
+def matcher(products=CATALOG):
+    entities = build_entity_dictionary(products)
+    return EntityMatcher({alias: handle for handle, entity in entities.items() for alias in entity["aliases"]})
+
+
+def test_model_code_aliases_with_and_without_separators():
+    aliases = product_aliases("Ovego OV-200 Power Station 200Wh", "ovego-ov-200")
+    assert "ov 200" in aliases
+    assert "ov200" in aliases
+
+
+def test_unit_codes_are_not_aliases():
+    for code in ("12V", "100W", "200Wh", "5kWh", "1000mAh", "12V-100Ah"):
+        assert is_unit_code(code)
+    for code in ("OV-200", "S10", "v12"):
+        assert not is_unit_code(code)
+    aliases = product_aliases("Ovego S10 Solar Panel 100W 12V", "ovego-s10-panel")
+    assert "100w" not in aliases
+    assert "12v" not in aliases
+
+
+def test_matches_model_code_spellings():
+    products = matcher()
+    assert products.find("Is the ov200 waterproof?") == ["ovego-ov-200"]
+    assert products.find("How long does the OV-200 take to charge?") == ["ovego-ov-200"]
+    assert products.find("Compare the OV-200 and the S10") == ["ovego-ov-200", "ovego-s10-panel"]
+
+
+def test_ratings_do_not_match_products():
+    products = matcher()
+    assert products.find("Do you have anything at 100W?") == []
+    assert products.find("I need a 12V battery") == []
+    assert products.find("What is 200Wh in hours?") == []
+
+
+def test_shared_aliases_are_dropped():
+    entities = build_entity_dictionary([("a", "Ovego Lamp"), ("b", "Ovego Lamp")])
+    assert entities["a"]["aliases"] == []
+    assert entities["b"]["aliases"] == []
+
+
+def test_matches_whole_words_only():
+    products = matcher()
+    assert products.find("xov200") == []
+
+
+def test_overlapping_aliases_keep_the_longest_match():
+    products = EntityMatcher({"ovego": "brand", "ovego lamp": "ovego-lamp", "lamp": "any-lamp"})
+    assert products.find("Is the Ovego lamp bright?") == ["ovego-lamp"]
+    assert products.find("a lamp from ovego") == ["any-lamp", "brand"]
@@ -0,0 +1,67 @@
+from services.lexical_index import BM25, build_lexical_index, model_codes
+
+CHUNKS = [
+    {
+        "id": "Ovego OV-200 Power Station",
+        "text": "Product: Ovego OV-200 Power Station\n\nPortable 200Wh battery with a 12V outlet.",
+        "metadata": {"title": "Ovego OV-200 Power Station 12V", "model": "OV-200", "product_type": "Energy Storage",
+                     "product_handle": "ovego-ov-200", "document_type": "product"},
+    },
+    {
+        "id": "Sunny S10 Panel",
+        "text": "Product: Sunny S10 Panel\n\n100W solar panel with a 12V output.",
+        "metadata": {"title": "Sunny S10 Panel 100W", "model": "S10", "product_type": "Solar Panels",
+                     "product_handle": "sunny-s10", "document_type": "product"},
+    },
+    {
+        "id": "Warranty policy",
+        "text": "All products carry a two year warranty.",
+        "metadata": {"document_type": "article"},
+    },
+]
+
+
+def bm25() -> BM25:
+    return BM25(build_lexical_index(CHUNKS))
+
+
+def test_model_codes_skip_ratings():
+    assert model_codes("Is the OV-200 better than the S10 at 100W and 12V?") == ["ov200", "s10"]
+
+
+def test_ratings_are_not_indexed_as_models():
+    index = build_lexical_index(CHUNKS)
+    assert set(index["models"]) == {"ov200", "s10"}
+    assert bm25().model_matches("Which products have a 12V outlet?") == []
+
+
+def test_model_matches_either_spelling():
+    index = bm25()
+    assert index.model_matches("does the ov200 charge phones") == [0]
+    assert index.model_matches("does the OV-200 charge phones") == [0]
+
+
+def test_metadata_filter_prefers_focus_products():
+    assert bm25().metadata_filter("how long does it last", ["ovego-ov-200"]) == ("product_handle", ["ovego-ov-200"])
+
+
+def test_metadata_filter_from_model_code():
+    assert bm25().metadata_filter("does the OV-200 charge phones") == ("model", ["OV-200"])
+
+
+def test_metadata_filter_from_product_type_keywords():
+    assert bm25().metadata_filter("which panel works on cloudy days") == ("product_type", ["Solar Panels"])
+
+
+def test_metadata_filter_none_when_nothing_applies():
+    index = bm25()
+    assert index.metadata_filter("how long is the warranty") is None
+    # A filter no product matches would hide every product
+    assert index.metadata_filter("how long does it last", ["discontinued-product"]) is None
+
+
+def test_filtered_search_keeps_articles():
+    index = bm25()
+    ranked = [position for position, _ in index.search("warranty panel battery", 3, ("product_type", ["Energy Storage"]))]
+    assert 1 not in ranked
+    assert set(ranked) == {0, 2}